@@ -1,8 +1,9 @@
 # Run a parameter sweep of the Held Suarez model
 # by varying the rotation rate from 1% to 1000% of Earth's rot rate
-import numpy as np
-from isca import Experiment, DryCodeBase, FailedRunError, GFDL_BASE
-from isca.util import exp_progress
+import os
+
+from isca import Experiment, DryCodeBase, GFDL_BASE
+from isca.scheduler import EnsembleScheduler
 
 from held_suarez_test_case import namelist, diag
 
@@ -18,25 +19,34 @@ earth_omega = 7.292e-5
 
 scales = [1.0, 10.0, 100.0, 1000.0]
 
+# each experiment runs on 16 cores.  They run side by side, as many at once as
+# fit on the node's cores, or one at a time on a node with fewer than 16.
+num_cores = 16
+scheduler = EnsembleScheduler(num_cores=max(num_cores, os.cpu_count() or 1))
+
+base = Experiment('hs_om_scale', codebase=cb)
+base.namelist = namelist
+base.diag_table = diag
+# only keep the restart files from the end of the final run
+base.restart_archive_interval = 10
+
+exps = []
 for s in scales:
-    exp_name = 'hs_om_scale_%.0f' % s
     omega = earth_omega * (s/100.0)
-    exp = Experiment(exp_name, codebase=cb)
-    exp.namelist = namelist.copy()
-    exp.diag_table = diag
-
+    # each derived experiment has its own copy of the namelist and settings
+    exp = base.derive('hs_om_scale_%.0f' % s)
     exp.update_namelist({'constants_nml': {'omega': omega}})
-    try:
-        # run with a progress bar with description showing omega
-        with exp_progress(exp, description='o%.0f d{day}' % s) as pbar:
-            exp.run(1, use_restart=False, num_cores=16)
-
-        for n in range(2, 11):
-            with exp_progress(exp, description='o%.0f d{day}' % s) as pbar:
-                exp.run(n)
-                exp.delete_restart(n-1)
-
-    except FailedRunError as e:
-        # don't let a crash get in the way of good science
-        # (we could try and reduce timestep here if we wanted to be smarter)
-        continue
\ No newline at end of file
+    exps.append(exp)
+
+    scheduler.add(exp, runs=range(1, 11), num_cores=num_cores, use_restart=False)
+
+# a crash in one experiment doesn't get in the way of the others
+# (we could try and reduce timestep here if we wanted to be smarter)
+failed = {name: e for name, e in scheduler.run().items() if e is not None}
+for name, e in failed.items():
+    print('%s failed: %r' % (name, e))
+
+# the restart of each final run was archived, so the copies in the workdirs
+# can go
+for exp in exps:
+    exp.clear_handoffs()
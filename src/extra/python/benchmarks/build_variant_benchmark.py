@@ -0,0 +1,124 @@
+"""Compare the speed and the answers of the build variants of a codebase.
+
+The Held-Suarez test case is compiled with each build variant given (see
+`CodeBase.BUILD_VARIANTS`) and run once from the initial conditions with each
+executable.  The throughput of each variant, in model days per hour of wall
+time, is measured from the `execute` phase in the run's `timings.json`.  The
+output of every variant is then compared to that of the first variant given,
+and reported as bit-identical or with the largest difference found.
+
+Needs a working $GFDL_BASE, $GFDL_ENV and compilers, as the model is really
+compiled and run.
+
+    $ python build_variant_benchmark.py --variants default aggressive host --days 10 --cores 16
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import xarray as xr
+
+from isca import DryCodeBase, DiagTable, Experiment, Namelist, GFDL_BASE
+from isca.diagtable import run_seconds
+
+OUTPUT_FILE = 'atmos_daily.nc'
+
+
+def held_suarez(name, codebase, days, resolution):
+    exp = Experiment(name, codebase=codebase)
+    diag = DiagTable()
+    diag.add_file('atmos_daily', 1, 'days', time_units='days')
+    for field in ('ps', 'ucomp', 'vcomp', 'temp', 'vor', 'div'):
+        diag.add_field('dynamics', field, time_avg=True)
+    exp.diag_table = diag
+    exp.namelist = Namelist({
+        'main_nml': {'dt_atmos': 600, 'days': days, 'calendar': 'thirty_day', 'current_date': [2000, 1, 1, 0, 0, 0]},
+        'atmosphere_nml': {'idealized_moist_model': False},
+        'spectral_dynamics_nml': {
+            'damping_order': 4,
+            'water_correction_limit': 200.e2,
+            'reference_sea_level_press': 1.0e5,
+            'valid_range_t': [100., 800.],
+            'initial_sphum': 0.0,
+            'vert_coord_option': 'uneven_sigma',
+            'scale_heights': 6.0,
+            'exponent': 7.5,
+            'surf_res': 0.5,
+        },
+        'hs_forcing_nml': {'t_zero': 315., 't_strat': 200., 'delh': 60., 'delv': 10., 'eps': 0., 'sigma_b': 0.7,
+                           'ka': -40., 'ks': -4., 'kf': -1., 'do_conserve_energy': True},
+        'diag_manager_nml': {'mix_snapshot_average_fields': False},
+        'fms_nml': {'domains_stack_size': 600000},
+        'fms_io_nml': {'threading_write': 'single', 'fileset_write': 'single'},
+    })
+    exp.set_resolution(*resolution)
+    return exp
+
+
+def days_per_hour(exp, run=1):
+    with open(os.path.join(exp.get_outputdir(run), 'timings.json')) as f:
+        execute = json.load(f)['phases']['execute']
+    return run_seconds(exp.namelist) / 86400.0 / (execute / 3600.0)
+
+
+def compare(filename, reference):
+    """Returns whether every variable of the two files is bit-identical, and
+    the largest absolute difference between them."""
+    identical, largest = True, 0.0
+    with xr.open_dataset(filename, decode_times=False) as ds, xr.open_dataset(reference, decode_times=False) as ref:
+        for name in ref.variables:
+            a, b = ds[name].values, ref[name].values
+            if a.shape != b.shape:
+                return False, np.inf
+            # missing values are NaN in both files when the output is the same
+            if np.array_equal(a, b, equal_nan=(a.dtype.kind == 'f' and b.dtype.kind == 'f')):
+                continue
+            identical = False
+            if a.dtype.kind in 'fiu':
+                largest = max(largest, float(np.nanmax(np.abs(a.astype(float) - b.astype(float)))))
+    return identical, largest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variants', nargs='+', default=['default', 'aggressive', 'host'],
+                        help='Build variants to compare.  The first is the reference for the output')
+    parser.add_argument('--days', type=int, default=10, help='Length of the run in model days')
+    parser.add_argument('--cores', type=int, default=16)
+    parser.add_argument('--resolution', default='T42')
+    parser.add_argument('--levels', type=int, default=25)
+    parser.add_argument('--keep', action='store_true', help="Don't delete the output of the runs")
+    args = parser.parse_args()
+
+    logging.getLogger('isca').setLevel(logging.WARNING)
+    cb = DryCodeBase.from_directory(GFDL_BASE)
+
+    results = []
+    for name in args.variants:
+        variant = cb.variant(name)
+        variant.compile()
+        exp = held_suarez('build_variant_benchmark_%s' % name, variant, args.days, (args.resolution, args.levels))
+        exp.rm_datadir()
+        exp.run(1, use_restart=False, num_cores=args.cores)
+        results.append((name, exp, days_per_hour(exp)))
+
+    reference = os.path.join(results[0][1].get_outputdir(1), OUTPUT_FILE)
+    print('%-12s %14s  %s' % ('variant', 'days per hour', 'output'))
+    for name, exp, speed in results:
+        if exp is results[0][1]:
+            output = 'reference'
+        else:
+            identical, largest = compare(os.path.join(exp.get_outputdir(1), OUTPUT_FILE), reference)
+            output = 'bit-identical' if identical else 'differs, largest difference %.3g' % largest
+        print('%-12s %14.1f  %s' % (name, speed, output))
+
+    if not args.keep:
+        for _, exp, _ in results:
+            exp.rm_datadir()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
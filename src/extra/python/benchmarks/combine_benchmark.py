@@ -0,0 +1,147 @@
+"""Benchmark the python netcdf combiner against the compiled mppnccombine tool.
+
+Synthetic FMS-style fragments are written for a range of resolutions, then
+combined with `isca.combine` and, if available, `mppnccombine.x`.  The combined
+files are checked to be identical.
+
+    $ python combine_benchmark.py --cores 16 --resolution T42 T85
+    $ python combine_benchmark.py --mppnccombine $GFDL_BASE/postprocessing/mppnccombine.x
+
+If `--mppnccombine-run` is given the C tool is launched through
+`mppnccombine_run.sh` instead, which includes the cost of sourcing the
+environment file on each call, as `Experiment.run` did previously.
+
+With `--fragments`, the fragments of real model output are combined instead,
+e.g. those left in a run directory with `exp.run(..., save_run=True)`.  Do this
+before using `exp.combine_tool = 'python'` for a new configuration:
+
+    $ python combine_benchmark.py --mppnccombine $GFDL_BASE/postprocessing/mppnccombine.x \
+        --fragments /path/to/run/atmos_daily.nc /path/to/run/atmos_monthly.nc
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import netCDF4
+
+from isca.combine import combine, find_fragments
+
+GRIDS = {
+    'T42': (128, 64),
+    'T85': (256, 128),
+    'T170': (512, 256),
+}
+
+
+def write_fragments(filename, nlon, nlat, nlev, ntime, ncores):
+    """Write `ncores` fragments of a diagnostic file, decomposed in latitude."""
+    nlat_local = nlat // ncores
+    for pe in range(ncores):
+        lat0 = pe * nlat_local
+        ds = netCDF4.Dataset('%s.%04d' % (filename, pe), 'w', format='NETCDF3_64BIT_OFFSET')
+        ds.filename = os.path.basename(filename)
+        ds.NumFilesInSet = np.int32(ncores)
+        ds.createDimension('lon', nlon)
+        ds.createDimension('lat', nlat_local)
+        ds.createDimension('pfull', nlev)
+        ds.createDimension('time', None)
+        lon = ds.createVariable('lon', 'f8', ('lon',))
+        lon[:] = np.linspace(0, 360, nlon, endpoint=False)
+        lon.domain_decomposition = np.array([1, nlon, 1, nlon], dtype='i4')
+        lat = ds.createVariable('lat', 'f8', ('lat',))
+        lat[:] = np.linspace(-90, 90, nlat)[lat0:lat0 + nlat_local]
+        lat.domain_decomposition = np.array([1, nlat, lat0 + 1, lat0 + nlat_local], dtype='i4')
+        ds.createVariable('pfull', 'f8', ('pfull',))[:] = np.linspace(1, 1000, nlev)
+        time_ = ds.createVariable('time', 'f8', ('time',))
+        time_.units = 'days since 0001-01-01 00:00:00'
+        time_[:] = np.arange(ntime)
+        rng = np.random.RandomState(pe)
+        for name in ('ucomp', 'vcomp', 'temp'):
+            var = ds.createVariable(name, 'f4', ('time', 'pfull', 'lat', 'lon'))
+            for t in range(ntime):
+                var[t] = rng.standard_normal((nlev, nlat_local, nlon))
+        ds.createVariable('ps', 'f4', ('time', 'lat', 'lon'))[:] = rng.standard_normal((ntime, nlat_local, nlon))
+        ds.close()
+
+
+def files_identical(a, b):
+    with netCDF4.Dataset(a) as da, netCDF4.Dataset(b) as db:
+        if set(da.variables) != set(db.variables):
+            return False
+        # compare the values as stored, including any fill values
+        da.set_auto_maskandscale(False)
+        db.set_auto_maskandscale(False)
+        return all(np.array_equal(da.variables[v][:], db.variables[v][:], equal_nan=da.variables[v].dtype.kind == 'f')
+                   for v in da.variables)
+
+
+def timed(fn, *args):
+    start = time.time()
+    fn(*args)
+    return time.time() - start
+
+
+def compare_tools(filename, args):
+    """Combine the fragments of `filename` with both tools.  Returns the size of
+    the fragments in MB, the seconds each tool took and whether the results are identical."""
+    size = sum(os.path.getsize(f) for f in find_fragments(filename)) / 1e6
+    c_out = filename.replace('.nc', '_c.nc')
+    for f in find_fragments(filename):
+        os.link(f, c_out + f[len(filename):])
+
+    t_py = timed(combine, filename)
+
+    t_c, identical = float('nan'), '-'
+    if args.mppnccombine or args.mppnccombine_run:
+        if args.mppnccombine_run:
+            cmd = [args.mppnccombine_run, os.path.dirname(args.mppnccombine_run), c_out]
+        else:
+            cmd = [args.mppnccombine, c_out]
+        t_c = timed(subprocess.check_output, cmd)
+        identical = str(files_identical(filename, c_out))
+    return size, t_py, t_c, identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolution', nargs='+', default=['T42', 'T85'], choices=sorted(GRIDS))
+    parser.add_argument('--cores', type=int, default=16)
+    parser.add_argument('--levels', type=int, default=25)
+    parser.add_argument('--times', type=int, default=30)
+    parser.add_argument('--mppnccombine', help='Path to a compiled mppnccombine.x')
+    parser.add_argument('--mppnccombine-run', help='Path to mppnccombine_run.sh (includes environment sourcing)')
+    parser.add_argument('--fragments', nargs='+', metavar='FILE',
+                        help='Combine the fragments FILE.NNNN of model output rather than synthetic ones')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='isca_combine_bench_')
+    try:
+        print('%-16s %10s %12s %12s %9s' % ('file', 'MB', 'python (s)', 'C tool (s)', 'identical'))
+        if args.fragments:
+            cases = []
+            for n, source in enumerate(args.fragments):
+                filename = os.path.join(tmpdir, '%d_%s' % (n, os.path.basename(source)))
+                for f in find_fragments(source):
+                    shutil.copyfile(f, filename + f[len(source):])
+                cases.append((os.path.basename(source), filename))
+        else:
+            cases = []
+            for res in args.resolution:
+                nlon, nlat = GRIDS[res]
+                filename = os.path.join(tmpdir, 'atmos_%s.nc' % res)
+                write_fragments(filename, nlon, nlat, args.levels, args.times, args.cores)
+                cases.append((res, filename))
+
+        for label, filename in cases:
+            size, t_py, t_c, identical = compare_tools(filename, args)
+            print('%-16s %10.1f %12.3f %12.3f %9s' % (label, size, t_py, t_c, identical))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
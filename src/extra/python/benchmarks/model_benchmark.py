@@ -0,0 +1,286 @@
+"""Benchmark the model test cases over resolutions and numbers of cores.
+
+Each test case in `exp/test_cases` is loaded (without running it), run from
+its initial conditions for a fixed number of model days at each resolution
+and number of cores, and measured from the `timings.json` of the run:
+
+    days/hour   model days simulated per hour of the `execute` phase
+    efficiency  the strong scaling efficiency, the speed-up over the fewest
+                cores run divided by the increase in cores
+    overhead    seconds of the run spent outside the model in `Experiment.run`
+
+Every result is appended to a history file, one JSON record per line with the
+version of its format, so the performance of the model can be followed
+between commits and machines.  `--plot` draws the strong scaling curves.
+
+    $ python model_benchmark.py --cases held_suarez frierson --resolutions T42 T85 --cores 4 8 16 32
+    $ python model_benchmark.py --plot scaling.png
+
+With `--stub`, the cases are run in a temporary GFDL_BASE/GFDL_WORK/GFDL_DATA
+with a stub in place of the model, which writes one field to each diagnostic
+file and exits.  Nothing is compiled, and only the python side of
+`Experiment.run`, including combining the output with the python combiner, is
+measured.  This works on machines without a Fortran compiler or MPI:
+
+    $ python model_benchmark.py --stub --cores 1 4 16
+
+Cases that read input at a fixed resolution, such as the land mask of
+realistic_continents, fail at other resolutions and are reported as failed.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import runpy
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+
+from run_overhead_benchmark import ISCA_ROOT, make_sandbox
+
+# the format of the records in the history file.  Increase when it changes.
+HISTORY_VERSION = 1
+
+TEST_CASES = os.path.join(ISCA_ROOT, 'exp', 'test_cases')
+CASES = {
+    'held_suarez': 'held_suarez/held_suarez_test_case.py',
+    'frierson': 'frierson/frierson_test_case.py',
+    'bucket_hydrology': 'bucket_hydrology/bucket_model_test_case.py',
+    'MiMA': 'MiMA/MiMA_test_case.py',
+    'realistic_continents': 'realistic_continents/realistic_continents_fixed_sst_test_case.py',
+}
+
+
+# In place of the model: writes one field to each file of the diag table, split
+# over the cores in latitude as FMS does, so that combining is measured too.
+STUB_MODEL = """#!{python}
+import os, re
+import numpy as np
+from scipy.io import netcdf_file
+
+cores = int(os.environ.get('STUB_CORES', '1'))
+nml = open('input.nml').read()
+def setting(name, default):
+    match = re.search(name + r'\\s*=\\s*(\\d+)', nml, re.I)
+    return int(match.group(1)) if match else default
+nlon, nlat, nlev = setting('lon_max', 128), setting('lat_max', 64), setting('num_levels', 25)
+
+files = re.findall(r'^\\s*"(\\w+)"\\s*,\\s*-?\\d+\\s*,', open('diag_table').read(), re.M)
+rows = nlat // cores
+for name in files:
+    for core in range(cores):
+        filename = name + '.nc' + ('.%04d' % core if cores > 1 else '')
+        lat0 = core * rows
+        lat1 = nlat if core == cores - 1 else lat0 + rows
+        with netcdf_file(filename, 'w') as f:
+            f.createDimension('time', None)
+            f.createDimension('pfull', nlev)
+            f.createDimension('lat', lat1 - lat0)
+            f.createDimension('lon', nlon)
+            for dim, values in (('pfull', np.arange(nlev)), ('lat', np.arange(lat0, lat1)), ('lon', np.arange(nlon))):
+                var = f.createVariable(dim, 'd', (dim,))
+                var[:] = values
+                if cores > 1:
+                    size = nlat if dim == 'lat' else len(values)
+                    start = lat0 if dim == 'lat' else 0
+                    var.domain_decomposition = np.array([1, size, start + 1, start + len(values)], dtype='i4')
+            time = f.createVariable('time', 'd', ('time',))
+            time[0] = 0.0
+            temp = f.createVariable('temp', 'f', ('time', 'pfull', 'lat', 'lon'))
+            temp[0] = np.random.random((nlev, lat1 - lat0, nlon))
+"""
+
+
+def make_stub_sandbox(root):
+    """A sandbox as in run_overhead_benchmark, with the test cases and their
+    input files and an `mpirun` that runs the executable once."""
+    env, _ = make_sandbox(root, 0, 0)
+    for name in ('input', 'exp'):
+        os.symlink(os.path.join(ISCA_ROOT, name), os.path.join(env['GFDL_BASE'], name))
+    with open(os.path.join(root, 'bin', 'mpirun'), 'w') as f:
+        f.write('#!/bin/sh\n'
+                'while [ $# -gt 1 ]; do\n'
+                '  [ "$1" = "-np" ] && export STUB_CORES=$2\n'
+                '  shift\n'
+                'done\n'
+                'exec "$1"\n')
+    return env
+
+
+def install_stub_executable(codebase):
+    """Replaces compiling `codebase` with writing the stub model as its executable."""
+    if not os.path.isdir(codebase.builddir):
+        os.makedirs(codebase.builddir)
+    with open(codebase.executable_fullpath, 'w') as f:
+        f.write(STUB_MODEL.format(python=sys.executable))
+    os.chmod(codebase.executable_fullpath, 0o755)
+
+
+def load_case(name):
+    """The Experiment configured by the test case `name`."""
+    # the test cases only run when they are __main__
+    return runpy.run_path(os.path.join(TEST_CASES, CASES[name]), run_name='isca_benchmark')['exp']
+
+
+def isca_commit():
+    try:
+        return subprocess.check_output(['git', '-C', ISCA_ROOT, 'rev-parse', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(case_exp, name, resolution, levels, num_cores, days, combine_tool=None):
+    """Run `case_exp` once for `days` at `resolution` on `num_cores`.
+    Returns the timings of the run, or None if it failed."""
+    from isca.experiment import FailedRunError
+    exp = case_exp.derive('benchmark_%s_%s_%d' % (name, resolution, num_cores))
+    if combine_tool:
+        exp.combine_tool = combine_tool
+    exp.set_resolution(resolution, levels)
+    main = exp.namelist['main_nml']
+    for key in ('years', 'months', 'hours', 'minutes', 'seconds'):
+        main.pop(key, None)
+    main['days'] = days
+    exp.rm_datadir()
+    try:
+        exp.run(1, use_restart=False, num_cores=num_cores)
+    except FailedRunError as e:
+        print('%s %s on %d cores failed: %s' % (name, resolution, num_cores, e))
+        return None
+    with open(os.path.join(exp.get_outputdir(1), 'timings.json')) as f:
+        timings = json.load(f)
+    exp.rm_datadir()
+    return timings
+
+
+def add_efficiency(records):
+    """Set the strong scaling efficiency of each record, relative to the
+    record of the same case and resolution with the fewest cores."""
+    for record in records:
+        group = [r for r in records if (r['case'], r['resolution']) == (record['case'], record['resolution'])]
+        base = min(group, key=lambda r: r['num_cores'])
+        speedup = record['days_per_hour'] / base['days_per_hour'] if base['days_per_hour'] else 0.0
+        record['efficiency'] = speedup / (record['num_cores'] / float(base['num_cores']))
+
+
+def read_history(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return [r for r in (json.loads(line) for line in f if line.strip()) if r.get('version') == HISTORY_VERSION]
+
+
+def append_history(filename, records):
+    with open(filename, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def plot_scaling(records, filename):
+    """Plot days/hour against cores, one line per case and resolution, with
+    perfect scaling from the fewest cores dashed."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    groups = sorted(set((r['case'], r['resolution']) for r in records))
+    for case, resolution in groups:
+        group = sorted((r for r in records if (r['case'], r['resolution']) == (case, resolution)),
+                       key=lambda r: r['num_cores'])
+        cores = [r['num_cores'] for r in group]
+        line, = ax.plot(cores, [r['days_per_hour'] for r in group], 'o-', label='%s %s' % (case, resolution))
+        ideal = [group[0]['days_per_hour'] * n / cores[0] for n in cores]
+        ax.plot(cores, ideal, '--', color=line.get_color(), alpha=0.5)
+    ax.set_xscale('log', base=2)
+    ax.set_yscale('log')
+    ax.set_xlabel('cores')
+    ax.set_ylabel('model days per hour')
+    ax.legend(fontsize='small')
+    fig.savefig(filename)
+    print('Wrote %s' % filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', default=sorted(CASES), choices=sorted(CASES))
+    parser.add_argument('--resolutions', nargs='+', default=['T42', 'T85', 'T170'], choices=['T42', 'T85', 'T170'])
+    parser.add_argument('--levels', type=int, default=None, help='Vertical levels.  Default: those of each case')
+    parser.add_argument('--cores', nargs='+', type=int, default=[4, 8, 16])
+    parser.add_argument('--days', type=int, default=5, help='Length of each run in model days')
+    parser.add_argument('--history', default='model_benchmark_history.jsonl',
+                        help='File the results are appended to')
+    parser.add_argument('--plot', default=None, help='Plot the strong scaling curves to this file')
+    parser.add_argument('--plot-history', action='store_true',
+                        help="Plot the last results in the history file for this host, don't run anything")
+    parser.add_argument('--stub', action='store_true', help='Run an executable that does nothing in place of the model')
+    args = parser.parse_args()
+    history = os.path.abspath(args.history)
+
+    if args.plot_history:
+        host = socket.gethostname()
+        latest = {}
+        for record in read_history(history):
+            if record['host'] == host and record['stub'] == args.stub:
+                latest[(record['case'], record['resolution'], record['num_cores'])] = record
+        plot_scaling(list(latest.values()), args.plot or 'scaling.png')
+        return
+
+    root = None
+    if args.stub:
+        root = tempfile.mkdtemp(prefix='isca_model_bench_')
+        os.environ.update(make_stub_sandbox(root))
+    try:
+        from isca.codebase import CodeBase
+        logging.getLogger('isca').setLevel(logging.WARNING)
+        if args.stub:
+            CodeBase.compile = install_stub_executable
+
+        started = datetime.datetime.utcnow().isoformat()
+        commit = isca_commit()
+        records = []
+        for name in args.cases:
+            case_exp = load_case(name)
+            for resolution in args.resolutions:
+                for num_cores in args.cores:
+                    # mppnccombine isn't compiled for the stub
+                    timings = run_case(case_exp, name, resolution, args.levels, num_cores, args.days,
+                                       combine_tool='python' if args.stub else None)
+                    if timings is None:
+                        continue
+                    execute = timings['phases']['execute']
+                    records.append({
+                        'version': HISTORY_VERSION,
+                        'started': started,
+                        'host': socket.gethostname(),
+                        'commit': commit,
+                        'stub': args.stub,
+                        'case': name,
+                        'resolution': resolution,
+                        'num_cores': num_cores,
+                        'days': args.days,
+                        'execute_seconds': execute,
+                        'days_per_hour': args.days / (execute / 3600.0) if execute else 0.0,
+                        'overhead_seconds': timings['total'] - execute,
+                        'phases': timings['phases'],
+                    })
+        add_efficiency(records)
+    finally:
+        if root is not None:
+            shutil.rmtree(root)
+
+    print('%-22s %-5s %6s %12s %11s %12s' % ('case', 'res', 'cores', 'days/hour', 'efficiency', 'overhead/s'))
+    for r in records:
+        print('%-22s %-5s %6d %12.1f %10.0f%% %12.3f' % (
+            r['case'], r['resolution'], r['num_cores'], r['days_per_hour'], 100 * r['efficiency'], r['overhead_seconds']))
+    append_history(history, records)
+    print('Appended %d results to %s' % (len(records), history))
+    if args.plot and records:
+        plot_scaling(records, args.plot)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Benchmark reading experiment output as NETCDF3 and as compressed NetCDF4.
+
+A set of synthetic combined output files, one per run, is written as
+uncompressed NETCDF3 (the output of `isca.combine`) and a copy rewritten with
+`isca.compress`.  Each is then read with three common access patterns:
+
+    timeseries: one variable, all levels, over every time of every run
+    snapshot:   every variable at a single time
+    zonalmean:  the zonal mean of one variable over every time of every run
+
+    $ python netcdf_read_benchmark.py --runs 24 --resolution T42
+
+Reads are served from the page cache unless `--drop-caches` is given, which
+requires root.  With a cold cache the difference in bytes read dominates.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import netCDF4
+
+from isca.compress import compress
+
+GRIDS = {
+    'T42': (128, 64),
+    'T85': (256, 128),
+    'T170': (512, 256),
+}
+
+VARIABLES = ('ucomp', 'vcomp', 'temp', 'sphum')
+
+
+def write_run(filename, run, nlon, nlat, nlev, ntime):
+    """Write one run of daily output with smooth fields plus a little noise,
+    so it compresses roughly like real model output."""
+    lon = np.linspace(0, 360, nlon, endpoint=False)
+    lat = np.linspace(-90, 90, nlat)
+    rng = np.random.RandomState(run)
+    ds = netCDF4.Dataset(filename, 'w', format='NETCDF3_64BIT_OFFSET')
+    ds.createDimension('lon', nlon)
+    ds.createDimension('lat', nlat)
+    ds.createDimension('pfull', nlev)
+    ds.createDimension('time', None)
+    ds.createVariable('lon', 'f8', ('lon',))[:] = lon
+    ds.createVariable('lat', 'f8', ('lat',))[:] = lat
+    ds.createVariable('pfull', 'f8', ('pfull',))[:] = np.linspace(10, 1000, nlev)
+    t = ds.createVariable('time', 'f8', ('time',))
+    t.units = 'days since 0001-01-01 00:00:00'
+    t[:] = run * ntime + np.arange(ntime)
+    base = (np.cos(np.radians(lat))[None, :, None] * np.sin(np.radians(3 * lon))[None, None, :]
+            + np.linspace(0, 1, nlev)[:, None, None])
+    for name, scale in zip(VARIABLES, (30., 10., 250., 1e-3)):
+        var = ds.createVariable(name, 'f4', ('time', 'pfull', 'lat', 'lon'))
+        for n in range(ntime):
+            var[n] = scale * (base + 1e-2 * rng.standard_normal(base.shape))
+    ds.createVariable('ps', 'f4', ('time', 'lat', 'lon'))[:] = 1e5 + 1e3 * rng.standard_normal((ntime, nlat, nlon))
+    ds.close()
+
+
+def drop_caches():
+    subprocess.check_call(['sync'])
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def read_timeseries(files):
+    out = []
+    for f in files:
+        with netCDF4.Dataset(f) as ds:
+            out.append(ds['temp'][:])
+    return out
+
+
+def read_snapshot(files):
+    with netCDF4.Dataset(files[len(files) // 2]) as ds:
+        return [ds[name][0] for name in VARIABLES + ('ps',)]
+
+
+def read_zonalmean(files):
+    out = []
+    for f in files:
+        with netCDF4.Dataset(f) as ds:
+            out.append(ds['ucomp'][:].mean(axis=-1))
+    return out
+
+
+PATTERNS = (('timeseries', read_timeseries), ('snapshot', read_snapshot), ('zonalmean', read_zonalmean))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=12)
+    parser.add_argument('--resolution', default='T42', choices=sorted(GRIDS))
+    parser.add_argument('--levels', type=int, default=25)
+    parser.add_argument('--times', type=int, default=30, help='Number of output times per run')
+    parser.add_argument('--complevel', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3, help='Report the best of this many repetitions')
+    parser.add_argument('--drop-caches', action='store_true', help='Drop the page cache before each read')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='isca_read_bench_')
+    try:
+        nlon, nlat = GRIDS[args.resolution]
+        formats = {'netcdf3': [], 'netcdf4': []}
+        for run in range(args.runs):
+            nc3 = os.path.join(tmpdir, 'run%04d.nc3' % run)
+            nc4 = os.path.join(tmpdir, 'run%04d.nc4' % run)
+            write_run(nc3, run, nlon, nlat, args.levels, args.times)
+            shutil.copyfile(nc3, nc4)
+            formats['netcdf3'].append(nc3)
+            formats['netcdf4'].append(nc4)
+
+        start = time.time()
+        for f in formats['netcdf4']:
+            compress(f, complevel=args.complevel)
+        print('Compressed %d files in %.2f s' % (args.runs, time.time() - start))
+
+        print('%-8s %10s %12s %12s %12s' % ('format', 'size (MB)', 'timeseries', 'snapshot', 'zonalmean'))
+        for name in ('netcdf3', 'netcdf4'):
+            files = formats[name]
+            size = sum(os.path.getsize(f) for f in files)
+            results = []
+            for _, fn in PATTERNS:
+                times = []
+                for _ in range(args.repeat):
+                    if args.drop_caches:
+                        drop_caches()
+                    start = time.time()
+                    fn(files)
+                    times.append(time.time() - start)
+                results.append(min(times))
+            print('%-8s %10.1f %11.3fs %11.3fs %11.3fs' % ((name, size / 1e6) + tuple(results)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
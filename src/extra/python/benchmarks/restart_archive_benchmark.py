@@ -0,0 +1,113 @@
+"""Benchmark the restart archive codecs in `isca.archive`.
+
+Reports the time to archive and extract, and the size on disk, of a set of
+restart files for every codec available on this machine.
+
+The restart files can be taken from an existing archive:
+
+    $ python restart_archive_benchmark.py --restart $GFDL_DATA/my_exp/restarts/res0012.tar.gz
+
+or synthesised at a given resolution.  Synthetic restarts contain smooth
+fields plus a small amount of noise, so they compress roughly like the real
+prognostic fields of a spectral model:
+
+    $ python restart_archive_benchmark.py --resolution T170 --levels 40
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import netCDF4
+
+from isca.archive import CODECS, detect_codec, remove_archive
+
+GRIDS = {
+    'T42': (128, 64),
+    'T85': (256, 128),
+    'T170': (512, 256),
+}
+
+
+def write_synthetic_restart(directory, nlon, nlat, nlev):
+    """Write an atmosphere.res.nc with two time levels of the main prognostic
+    fields, similar in layout to the spectral dynamical core restart."""
+    lon = np.linspace(0, 2*np.pi, nlon, endpoint=False)
+    lat = np.linspace(-np.pi/2, np.pi/2, nlat)
+    lev = np.linspace(0, 1, nlev)
+    base = (np.cos(lat)[None, :, None] * np.sin(3*lon)[None, None, :]
+            + lev[:, None, None])
+    rng = np.random.RandomState(0)
+
+    ds = netCDF4.Dataset(os.path.join(directory, 'atmosphere.res.nc'), 'w', format='NETCDF3_64BIT_OFFSET')
+    ds.createDimension('xaxis_1', nlon)
+    ds.createDimension('yaxis_1', nlat)
+    ds.createDimension('zaxis_1', nlev)
+    ds.createDimension('Time', None)
+    for name, scale in (('u', 30.), ('v', 10.), ('t', 250.), ('vor', 1e-5), ('div', 1e-6), ('sphum', 1e-3)):
+        var = ds.createVariable(name, 'f8', ('Time', 'zaxis_1', 'yaxis_1', 'xaxis_1'))
+        for t in range(2):
+            var[t] = scale * (base + 1e-3 * rng.standard_normal(base.shape))
+    ds.createVariable('ps', 'f8', ('Time', 'yaxis_1', 'xaxis_1'))[:] = 1e5 + 1e3 * base[:2, :, :]
+    ds.close()
+
+    with open(os.path.join(directory, 'coupler.res'), 'w') as f:
+        f.write('     1        (Calendar: no_calendar=0, thirty_day_months=1, julian=2, gregorian=3, noleap=4)\n')
+        f.write('  2000     1     1     0     0     0        Model start time:   year, month, day, hour, minute, second\n')
+        f.write('  2000     2     1     0     0     0        Current model time: year, month, day, hour, minute, second\n')
+
+
+def disk_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--restart', help='An existing restart archive to use as the benchmark input')
+    parser.add_argument('--resolution', default='T85', choices=sorted(GRIDS))
+    parser.add_argument('--levels', type=int, default=25)
+    parser.add_argument('--repeat', type=int, default=3, help='Report the best of this many repetitions')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='isca_restart_bench_')
+    try:
+        restartdir = os.path.join(tmpdir, 'RESTART')
+        os.makedirs(restartdir)
+        if args.restart:
+            detect_codec(args.restart).extract(args.restart, restartdir)
+        else:
+            nlon, nlat = GRIDS[args.resolution]
+            write_synthetic_restart(restartdir, nlon, nlat, args.levels)
+        raw_size = disk_size(restartdir)
+        print('Restart files: %.1f MB' % (raw_size / 1e6))
+
+        print('%-6s %12s %12s %10s %7s' % ('codec', 'archive (s)', 'extract (s)', 'size (MB)', 'ratio'))
+        for name in sorted(CODECS):
+            codec = CODECS[name]()
+            if not codec.is_available():
+                print('%-6s %s' % (name, 'not available'))
+                continue
+            archive_file = os.path.join(tmpdir, 'res0001' + codec.extension)
+            t_archive, t_extract = [], []
+            for _ in range(args.repeat):
+                extractdir = os.path.join(tmpdir, 'INPUT')
+                start = time.time()
+                codec.archive(archive_file, restartdir)
+                t_archive.append(time.time() - start)
+                start = time.time()
+                detect_codec(archive_file).extract(archive_file, extractdir)
+                t_extract.append(time.time() - start)
+                size = disk_size(archive_file)
+                shutil.rmtree(extractdir)
+                remove_archive(archive_file)
+            print('%-6s %12.3f %12.3f %10.1f %7.2f' % (name, min(t_archive), min(t_extract), size / 1e6, raw_size / float(size)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Measure the fixed python-side overhead of `Experiment.run`.
+
+A sandbox GFDL_BASE/GFDL_WORK/GFDL_DATA is created in a temporary directory,
+with an environment file that does nothing and an `mpirun` on the PATH that
+exits immediately, so the model itself takes no time.  Everything measured is
+the cost of setting up the run directory, staging files, archiving restarts,
+writing run metadata and cleaning up.
+
+    $ python run_overhead_benchmark.py --runs 20
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ISCA_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..'))
+
+
+def make_sandbox(root, ninputs, input_mb):
+    """Create a minimal Isca tree with a no-op model and return the environment."""
+    base = os.path.join(root, 'base')
+    os.makedirs(os.path.join(base, 'src', 'extra', 'env'))
+    os.symlink(os.path.join(ISCA_ROOT, 'src', 'extra', 'python'), os.path.join(base, 'src', 'extra', 'python'))
+    os.symlink(os.path.join(ISCA_ROOT, 'src', 'extra', 'model'), os.path.join(base, 'src', 'extra', 'model'))
+    with open(os.path.join(base, 'src', 'extra', 'env', 'benchmark'), 'w') as f:
+        f.write('module() { :; }\n')
+    subprocess.check_call(['git', 'init', '-q', base])
+    subprocess.check_call(['git', '-C', base, '-c', 'user.name=bench', '-c', 'user.email=bench@localhost',
+                           'commit', '-q', '--allow-empty', '-m', 'benchmark'])
+
+    bindir = os.path.join(root, 'bin')
+    os.makedirs(bindir)
+    with open(os.path.join(bindir, 'mpirun'), 'w') as f:
+        f.write('#!/bin/sh\nexit 0\n')
+    os.chmod(os.path.join(bindir, 'mpirun'), 0o755)
+
+    inputs = []
+    for n in range(ninputs):
+        filename = os.path.join(root, 'input%d.nc' % n)
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(int(input_mb * 1e6)))
+        inputs.append(filename)
+
+    env = {
+        'GFDL_BASE': base,
+        'GFDL_WORK': os.path.join(root, 'work'),
+        'GFDL_DATA': os.path.join(root, 'data'),
+        'GFDL_ENV': 'benchmark',
+        'PATH': bindir + os.pathsep + os.environ.get('PATH', ''),
+    }
+    return env, inputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--inputs', type=int, default=3, help='Number of input files staged each run')
+    parser.add_argument('--input-mb', type=float, default=20, help='Size of each input file in MB')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='isca_overhead_bench_')
+    try:
+        env, inputs = make_sandbox(root, args.inputs, args.input_mb)
+        os.environ.update(env)
+
+        import logging
+        from isca import Experiment, DryCodeBase, DiagTable, Namelist
+        logging.getLogger('isca').setLevel(logging.WARNING)
+
+        cb = DryCodeBase.from_directory(env['GFDL_BASE'])
+        os.makedirs(cb.builddir)
+        open(cb.executable_fullpath, 'w').close()
+
+        exp = Experiment('overhead', codebase=cb)
+        exp.diag_table = DiagTable()
+        exp.diag_table.add_file('atmos_monthly', 30, 'days', time_units='days')
+        exp.diag_table.add_field('dynamics', 'ps', time_avg=True)
+        exp.namelist = Namelist({'main_nml': {'days': 30, 'calendar': 'thirty_day', 'dt_atmos': 600}})
+        exp.inputfiles = inputs
+
+        times = []
+        for i in range(1, args.runs + 1):
+            start = time.time()
+            exp.run(i, use_restart=(i > 1), num_cores=1)
+            times.append(time.time() - start)
+
+        steady = sorted(times[1:]) or times
+        print('runs: %d, inputs: %d x %.0f MB' % (args.runs, args.inputs, args.input_mb))
+        print('first run:         %.3f s' % times[0])
+        print('median later run:  %.3f s' % steady[len(steady) // 2])
+        print('mean later run:    %.3f s' % (sum(steady) / len(steady)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
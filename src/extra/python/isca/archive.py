@@ -0,0 +1,217 @@
+"""Codecs used to store restart files between runs.
+
+The codec used by an experiment is chosen by name, e.g.
+
+    exp.restart_codec = 'zstd'
+
+    'gz':   gzip compressed tar (res0001.tar.gz).  The default and the format
+            used by all previous versions of Isca.
+    'pigz': gzip compressed tar, compressed on several threads with the `pigz`
+            executable.  Produces standard .tar.gz files.
+    'zstd': zstandard compressed tar (res0001.tar.zst), compressed on all
+            available cores.  Requires the `zstandard` python package
+            (`pip install -e .[zstd]`).
+    'tar':  uncompressed tar (res0001.tar).
+    'dir':  a plain directory of restart files (res0001/).
+
+When extracting, the format is detected from the archive itself so restarts
+written with any codec can always be read back.
+
+Codecs write to a path that doesn't exist yet.  Use `replacing` to write an
+archive that may already exist, e.g. when a run is repeated:
+
+    with replacing(archive_file) as tmp:
+        codec.archive(tmp, restart_directory)
+"""
+from contextlib import contextmanager
+import importlib.util
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+
+from isca.loghandler import log
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _have_executable(name):
+    return any(os.access(os.path.join(path, name), os.X_OK)
+               for path in os.environ.get('PATH', '').split(os.pathsep))
+
+
+class ArchiveCodec(object):
+    """Base class for restart archive codecs."""
+    name = None
+    extension = None
+
+    def is_available(self):
+        return True
+
+    def archive(self, archive_file, directory):
+        """Store the contents of `directory` at `archive_file`."""
+        raise NotImplementedError
+
+    def extract(self, archive_file, directory):
+        """Extract the contents of `archive_file` into `directory`."""
+        raise NotImplementedError
+
+
+class TarCodec(ArchiveCodec):
+    name = 'tar'
+    extension = '.tar'
+    mode = ''
+
+    def archive(self, archive_file, directory):
+        with tarfile.open(archive_file, 'w:' + self.mode) as tar:
+            tar.add(directory, arcname='.')
+
+    def extract(self, archive_file, directory):
+        with tarfile.open(archive_file, 'r:' + self.mode) as tar:
+            tar.extractall(path=directory)
+
+
+class GzipCodec(TarCodec):
+    name = 'gz'
+    extension = '.tar.gz'
+    mode = 'gz'
+
+    def extract(self, archive_file, directory):
+        # pigz decompresses noticeably faster than python's zlib
+        if _have_executable('pigz'):
+            PigzCodec().extract(archive_file, directory)
+        else:
+            super(GzipCodec, self).extract(archive_file, directory)
+
+
+class PigzCodec(ArchiveCodec):
+    name = 'pigz'
+    extension = '.tar.gz'
+
+    def __init__(self, threads=None):
+        self.threads = threads or os.cpu_count() or 1
+
+    def is_available(self):
+        return _have_executable('pigz')
+
+    def archive(self, archive_file, directory):
+        with open(archive_file, 'wb') as out:
+            proc = subprocess.Popen(['pigz', '-p', str(self.threads)], stdin=subprocess.PIPE, stdout=out)
+            with tarfile.open(fileobj=proc.stdin, mode='w|') as tar:
+                tar.add(directory, arcname='.')
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise IOError('pigz failed to compress %s' % archive_file)
+
+    def extract(self, archive_file, directory):
+        proc = subprocess.Popen(['pigz', '-dc', archive_file], stdout=subprocess.PIPE)
+        with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+            tar.extractall(path=directory)
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise IOError('pigz failed to decompress %s' % archive_file)
+
+
+class ZstdCodec(ArchiveCodec):
+    name = 'zstd'
+    extension = '.tar.zst'
+
+    def __init__(self, level=3, threads=-1):
+        self.level = level
+        self.threads = threads  # -1 uses all available cores
+
+    def is_available(self):
+        return importlib.util.find_spec('zstandard') is not None
+
+    def archive(self, archive_file, directory):
+        import zstandard
+        cctx = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+        with open(archive_file, 'wb') as out:
+            with cctx.stream_writer(out) as compressor:
+                with tarfile.open(fileobj=compressor, mode='w|') as tar:
+                    tar.add(directory, arcname='.')
+
+    def extract(self, archive_file, directory):
+        import zstandard
+        with open(archive_file, 'rb') as fh:
+            with zstandard.ZstdDecompressor().stream_reader(fh) as reader:
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    tar.extractall(path=directory)
+
+
+class DirectoryCodec(ArchiveCodec):
+    name = 'dir'
+    extension = ''
+
+    def archive(self, archive_file, directory):
+        shutil.copytree(directory, archive_file)
+
+    def extract(self, archive_file, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in os.listdir(archive_file):
+            shutil.copy2(os.path.join(archive_file, name), directory)
+
+
+CODECS = {codec.name: codec for codec in (GzipCodec, PigzCodec, ZstdCodec, TarCodec, DirectoryCodec)}
+
+
+def get_codec(name):
+    """Return an instance of the codec called `name`."""
+    try:
+        codec = CODECS[name]()
+    except KeyError:
+        raise ValueError('Unknown restart codec %r.  Choose from %s' % (name, ', '.join(sorted(CODECS))))
+    if not codec.is_available():
+        log.error('Restart codec %r is not available on this system' % name)
+        raise ValueError('Restart codec %r is not available on this system' % name)
+    return codec
+
+
+def detect_codec(archive_file):
+    """Return the codec able to read `archive_file`, based on its contents."""
+    if os.path.isdir(archive_file):
+        return DirectoryCodec()
+    with open(archive_file, 'rb') as fh:
+        magic = fh.read(4)
+    if magic.startswith(_GZIP_MAGIC):
+        return GzipCodec()
+    if magic == _ZSTD_MAGIC:
+        return ZstdCodec()
+    return TarCodec()
+
+
+def find_archive(basepath):
+    """Return the path of an existing archive at `basepath` plus any known
+    codec extension, or None if there isn't one."""
+    for ext in sorted(set(codec.extension for codec in CODECS.values()), key=len, reverse=True):
+        if os.path.exists(basepath + ext):
+            return basepath + ext
+    return None
+
+
+@contextmanager
+def replacing(archive_file):
+    """Yields a temporary path beside `archive_file` to write an archive to.
+
+    When the body succeeds the archive is moved to `archive_file`, replacing
+    any archive there, so `archive_file` is never left half written."""
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(archive_file) or '.', prefix='.archive')
+    try:
+        tmp = os.path.join(tmpdir, os.path.basename(archive_file))
+        yield tmp
+        if os.path.isdir(archive_file) and not os.path.islink(archive_file):
+            # a directory can't be replaced in one step, so move the old one aside
+            os.rename(archive_file, os.path.join(tmpdir, 'old'))
+        os.replace(tmp, archive_file)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def remove_archive(archive_file):
+    if os.path.isdir(archive_file):
+        shutil.rmtree(archive_file)
+    else:
+        os.remove(archive_file)
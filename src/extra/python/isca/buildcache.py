@@ -0,0 +1,132 @@
+"""A content-addressed cache of compiled model executables.
+
+Compiling a CodeBase regenerates the Makefile and runs make, which takes some
+time even when nothing has changed.  The BuildCache stores each executable it
+is given under a key made from everything that determines the build:
+
+    - the contents of every source file listed in `path_names`, and of the
+      other files (such as .inc and .h files) in their directories and the
+      include directories
+    - the compile flags
+    - the environment file
+    - the mkmf and compile.sh templates
+
+When the key of a compile is already in the cache the cached executable is
+used, and make is never run.  Source files are only re-hashed when their size
+or modification time changes, so checking an unchanged codebase costs a `stat`
+per file.  The cache is shared by all codebases under `GFDL_WORK/buildcache`.
+
+The cache holds at most `max_entries` executables.  When more are added, the
+least recently used are removed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+
+from isca import GFDL_WORK
+from isca.helpers import copy_file
+from isca.loghandler import Logger
+from isca.staging import file_digest
+
+P = os.path.join
+
+
+class BuildCache(Logger):
+    """Compiled executables, indexed by a hash of their inputs.
+
+        cache = BuildCache()
+        key = cache.key(sources, compile_flags, env_file_contents)
+        if cache.get(key, 'isca.x') is None:
+            ... compile ...
+            cache.add(key, '/work/codebase/.../build/isca/isca.x')
+    """
+    def __init__(self, cachedir=P(GFDL_WORK, 'buildcache'), max_entries=20):
+        self.cachedir = cachedir
+        self.max_entries = max_entries
+        self.objectdir = P(cachedir, 'executables')
+        self.index_file = P(cachedir, 'index.json')
+
+    def _read_index(self):
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        fd, tmp = tempfile.mkstemp(dir=self.cachedir, prefix='.index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_file)
+
+    def key(self, sources, *inputs):
+        """The key of a build of the files `sources`, a dict of {name: path},
+        with the other `inputs` (strings) that determine the build."""
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        index = self._read_index()
+        before = dict(index)
+        h = hashlib.sha1()
+        for name in sorted(sources):
+            h.update(('%s %s\n' % (name, self._digest(sources[name], index))).encode())
+        for value in inputs:
+            h.update(hashlib.sha1(value.encode()).hexdigest().encode())
+        if index != before:
+            self._write_index(index)
+        return h.hexdigest()
+
+    def _digest(self, filename, index):
+        st = os.stat(filename)
+        entry = index.get(filename)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return entry['digest']
+        digest = file_digest(filename)
+        index[filename] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'digest': digest}
+        return digest
+
+    def get(self, key, executable_name):
+        """Returns the path of the cached executable for `key`, or None."""
+        cached = P(self.objectdir, key, executable_name)
+        if not os.path.exists(cached):
+            return None
+        # the entry was just used, see `prune`
+        os.utime(P(self.objectdir, key))
+        return cached
+
+    def add(self, key, executable):
+        """Store a copy of `executable` as the build for `key`."""
+        cached = P(self.objectdir, key, os.path.basename(executable))
+        if not os.path.isdir(os.path.dirname(cached)):
+            os.makedirs(os.path.dirname(cached))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cached), prefix='.tmp')
+        os.close(fd)
+        copy_file(executable, tmp)
+        # cached executables are shared, so must never be modified in place
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
+        os.replace(tmp, cached)
+        os.utime(os.path.dirname(cached))
+        self.log.debug('Added %s to the build cache as %s' % (executable, key))
+        self.prune()
+        return cached
+
+    def prune(self):
+        """Remove the least recently used executables until at most
+        `max_entries` remain.  Returns the keys removed."""
+        if not os.path.isdir(self.objectdir):
+            return []
+        keys = [k for k in os.listdir(self.objectdir) if not k.startswith('.')]
+        keys.sort(key=lambda k: os.path.getmtime(P(self.objectdir, k)))
+        removed = keys[:max(0, len(keys) - self.max_entries)]
+        for key in removed:
+            # move the entry aside first, so it is never seen half removed
+            tmp = tempfile.mkdtemp(dir=self.objectdir, prefix='.tmp')
+            try:
+                os.rename(P(self.objectdir, key), P(tmp, key))
+            except OSError:
+                pass
+            shutil.rmtree(tmp, ignore_errors=True)
+            self.log.debug('Removed %s from the build cache' % key)
+        return removed
@@ -0,0 +1,133 @@
+"""Report how long each file of a build took to compile.
+
+While `CodeBase.compile` runs make, `isca.objcache` appends the start and end
+time of every Fortran compile to `compile_profile.log` in the build directory.
+`profile_report` combines this with the dependencies between objects in the
+Makefile written by mkmf to find the critical path: the chain of compiles,
+each waiting on the modules of the one before, that sets the shortest
+possible build time however many files are compiled at once.
+
+The report is written to `compile_profile.json` in the build directory:
+
+    {"wall_seconds": 412.3, "compile_seconds": 1290.1, "cache_hits": 12,
+     "critical_path": ["constants.o", ..., "spectral_dynamics.o", "atmosphere.o"],
+     "critical_path_seconds": 201.7,
+     "units": [{"object": "rrtmg_lw_rad.o", "start": ..., "end": ..., "seconds": 95.2, "cached": false}, ...]}
+
+and can be summarised from the command line:
+
+    $ python -m isca.buildprofile $GFDL_WORK/codebase/<codebase>/build/isca
+"""
+import json
+import os
+import re
+
+P = os.path.join
+
+PROFILE_LOG = 'compile_profile.log'
+PROFILE_REPORT = 'compile_profile.json'
+
+
+def read_profile_log(filename):
+    """The compile records in `filename`, one for each object, sorted by start time."""
+    units = {}
+    with open(filename) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            record['seconds'] = record['end'] - record['start']
+            # keep the last compile of an object
+            units[record['object']] = record
+    return sorted(units.values(), key=lambda u: u['start'])
+
+
+def makefile_dependencies(makefile):
+    """The objects each object depends on, from a Makefile written by mkmf."""
+    with open(makefile) as f:
+        text = f.read().replace('\\\n', ' ')
+    deps = {}
+    for match in re.finditer(r'^(\S+\.o):(.*)$', text, re.M):
+        deps[match.group(1)] = [d for d in match.group(2).split() if d.endswith('.o')]
+    return deps
+
+
+def critical_path(seconds, deps):
+    """The longest chain of dependent compiles.
+
+        `seconds`: {object: compile time}.  Objects not listed take no time.
+        `deps`:    {object: [objects it depends on]}
+    Returns the objects of the chain, first to last, and its length in seconds.
+    """
+    finish = {}
+    previous = {}
+
+    def finish_time(obj, visiting=()):
+        if obj not in finish:
+            before = [d for d in deps.get(obj, []) if d not in visiting]
+            longest = max(before, key=lambda d: finish_time(d, visiting + (obj,)), default=None)
+            previous[obj] = longest
+            finish[obj] = seconds.get(obj, 0.0) + (finish[longest] if longest else 0.0)
+        return finish[obj]
+
+    for obj in set(seconds) | set(deps):
+        finish_time(obj)
+    if not finish:
+        return [], 0.0
+    last = max(finish, key=finish.get)
+    path = []
+    obj = last
+    while obj is not None:
+        path.append(obj)
+        obj = previous[obj]
+    return path[::-1], finish[last]
+
+
+def profile_report(builddir, jobs=None):
+    """Build the report of the last compile in `builddir` and write it to
+    `compile_profile.json`.  Returns the report."""
+    units = read_profile_log(P(builddir, PROFILE_LOG))
+    deps = makefile_dependencies(P(builddir, 'Makefile')) if os.path.exists(P(builddir, 'Makefile')) else {}
+    seconds = {u['object']: u['seconds'] for u in units}
+    path, path_seconds = critical_path(seconds, deps)
+    wall = (max(u['end'] for u in units) - min(u['start'] for u in units)) if units else 0.0
+    report = {
+        'jobs': jobs,
+        'wall_seconds': wall,
+        'compile_seconds': sum(seconds.values()),
+        'cache_hits': sum(1 for u in units if u['cached']),
+        'critical_path': path,
+        'critical_path_seconds': path_seconds,
+        'units': units,
+    }
+    with open(P(builddir, PROFILE_REPORT), 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def summary(report, slowest=10):
+    """Lines of text summarising a report."""
+    units = report['units']
+    lines = ['Compiled %d files in %.1fs (%.1fs of compiling, %d from the cache)' % (
+        len(units), report['wall_seconds'], report['compile_seconds'], report['cache_hits'])]
+    if report['wall_seconds'] > 0:
+        lines.append('Average parallelism %.1f with %s jobs' % (
+            report['compile_seconds'] / report['wall_seconds'], report['jobs']))
+    lines.append('Critical path %.1fs through %d files: %s' % (
+        report['critical_path_seconds'], len(report['critical_path']), ' -> '.join(report['critical_path'])))
+    lines.append('Slowest files:')
+    for unit in sorted(units, key=lambda u: u['seconds'], reverse=True)[:slowest]:
+        lines.append('  %8.1fs  %s%s' % (unit['seconds'], unit['object'], ' (cached)' if unit['cached'] else ''))
+    return lines
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarise the compile profile of a build directory.')
+    parser.add_argument('builddir')
+    parser.add_argument('-n', dest='slowest', type=int, default=10, help='Number of the slowest files to list')
+    args = parser.parse_args()
+    with open(P(args.builddir, PROFILE_REPORT)) as f:
+        report = json.load(f)
+    print('\n'.join(summary(report, args.slowest)))
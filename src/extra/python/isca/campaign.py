@@ -0,0 +1,221 @@
+"""Persistent record of the state of each run of an experiment.
+
+Every experiment keeps an SQLite database, `campaign.db`, in its data
+directory.  A run is claimed in the database before its run directory is
+touched and marked completed only once all of its output has been saved, so
+the database always knows which runs are finished, which failed and which
+are in progress, and by whom:
+
+    run | status    | controller      | restart_file           | namelist_hash | timings
+    ----+-----------+-----------------+------------------------+---------------+--------
+      1 | completed | node01:4242     | .../restarts/res0001.. | 3f2a...       | {...}
+      2 | running   | node01:4242     |                        | 3f2a...       |
+
+A run left `running` by a controller process that no longer exists has
+crashed.  Only one controller can hold a run at a time, so two scripts
+resuming the same experiment can't overwrite each other's run directory.
+
+A controller on another host can't be checked directly, so from claiming a
+run until it is completed or failed the controller updates the `heartbeat` of
+the run every `HEARTBEAT_INTERVAL` seconds, through staging, the model, and
+all of the post-processing.  A run whose heartbeat is older than
+`CampaignState.stale_after` has crashed.  `claim(run, force=True)` takes over
+a run regardless.
+"""
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from isca.loghandler import Logger
+
+P = os.path.join
+
+# seconds between updates of the heartbeat of a running run
+HEARTBEAT_INTERVAL = 60
+
+
+class RunInProgressError(Exception):
+    pass
+
+
+def namelist_hash(namelist):
+    return hashlib.sha1(str(namelist).encode()).hexdigest()
+
+
+def controller_id():
+    """Identifies this python process as the controller of a run."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def controller_alive(controller, heartbeat=None, stale_after=None):
+    """Returns False if `controller` is known to no longer be running.
+
+    Only processes on this host can be checked.  A controller on another host
+    is alive unless its last `heartbeat` was more than `stale_after` seconds ago."""
+    host, pid = controller.rsplit(':', 1)
+    if host != socket.gethostname():
+        if heartbeat is None or stale_after is None:
+            return True
+        return time.time() - heartbeat < stale_after
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class CampaignState(Logger):
+    """The run state database of an experiment."""
+    def __init__(self, filename, stale_after=15 * 60, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.filename = filename
+        # seconds without a heartbeat after which a run on another host has crashed
+        self.stale_after = stale_after
+        self.heartbeat_interval = heartbeat_interval
+        self._db = None
+        # runs claimed by this controller that have not yet completed or failed,
+        # whose heartbeat is kept up by the `_beating` thread
+        self._held = set()
+        self._beating = None
+        # the connection is shared with the post-processing threads of `run_many`
+        self._lock = threading.RLock()
+
+    @property
+    def db(self):
+        if self._db is not None and not os.path.exists(self.filename):
+            # the data directory has been removed, e.g. by `rm_datadir`
+            self.close()
+        if self._db is None:
+            dirname = os.path.dirname(self.filename)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            # autocommit; transactions are started explicitly where needed
+            self._db = sqlite3.connect(self.filename, timeout=60, isolation_level=None, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute("""CREATE TABLE IF NOT EXISTS runs (
+                run INTEGER PRIMARY KEY,
+                status TEXT NOT NULL,
+                controller TEXT,
+                started REAL,
+                finished REAL,
+                restart_file TEXT,
+                namelist_hash TEXT,
+                timings TEXT,
+                error TEXT,
+                heartbeat REAL)""")
+            columns = [row['name'] for row in self._db.execute('PRAGMA table_info(runs)')]
+            if 'heartbeat' not in columns:
+                # databases written before heartbeats were recorded
+                self._db.execute('ALTER TABLE runs ADD COLUMN heartbeat REAL')
+        return self._db
+
+    def close(self):
+        """Close the connection.  The database is opened again when next used."""
+        with self._lock:
+            # the runs' records are gone with the database, e.g. after `rm_datadir`
+            self._held.clear()
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def get(self, run):
+        """Returns the record of `run` as a dict, or None if it has never been started."""
+        with self._lock:
+            row = self.db.execute('SELECT * FROM runs WHERE run = ?', (run,)).fetchone()
+        return dict(row) if row else None
+
+    def status(self, run):
+        """Returns the status of `run`: None, 'running', 'completed', 'failed' or 'crashed'."""
+        record = self.get(run)
+        if record is None:
+            return None
+        if record['status'] == 'running' and not self._alive(record):
+            return 'crashed'
+        return record['status']
+
+    def _alive(self, record):
+        return controller_alive(record['controller'], record['heartbeat'], self.stale_after)
+
+    def runs(self):
+        with self._lock:
+            return [dict(row) for row in self.db.execute('SELECT * FROM runs ORDER BY run')]
+
+    def claim(self, run, namelist_hash=None, force=False):
+        """Mark `run` as running under this process.  Raises RunInProgressError
+        if another live controller is performing the run, unless `force`."""
+        with self._lock:
+            db = self.db
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                row = db.execute('SELECT status, controller, heartbeat FROM runs WHERE run = ?', (run,)).fetchone()
+                if (not force and row and row['status'] == 'running' and row['controller'] != controller_id()
+                        and self._alive(row)):
+                    raise RunInProgressError('Run %d is already being performed by %s' % (run, row['controller']))
+                now = time.time()
+                db.execute('INSERT OR REPLACE INTO runs (run, status, controller, started, namelist_hash, heartbeat) VALUES (?, ?, ?, ?, ?, ?)',
+                           (run, 'running', controller_id(), now, namelist_hash, now))
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+            self._hold(run)
+
+    def release(self, run, record=None):
+        """Undo a claim on `run`, restoring its previous `record`."""
+        with self._lock:
+            self._held.discard(run)
+            if record is None:
+                self.db.execute('DELETE FROM runs WHERE run = ?', (run,))
+            else:
+                columns = sorted(record)
+                self.db.execute('INSERT OR REPLACE INTO runs (%s) VALUES (%s)' % (', '.join(columns), ', '.join('?' * len(columns))),
+                                [record[c] for c in columns])
+
+    def beat(self, run):
+        """Record that the controller of `run` is still alive."""
+        with self._lock:
+            # a run taken over by another controller with `force` is no longer ours
+            self.db.execute("UPDATE runs SET heartbeat = ? WHERE run = ? AND controller = ? AND status = 'running'",
+                            (time.time(), run, controller_id()))
+
+    def _hold(self, run):
+        """Keep up the heartbeat of `run` until it is completed, failed or released."""
+        with self._lock:
+            self._held.add(run)
+            if self._beating is None:
+                self._beating = threading.Thread(target=self._beat_held, daemon=True)
+                self._beating.start()
+
+    def _beat_held(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                if not os.path.exists(self.filename):
+                    # don't create the database again once it has been removed
+                    self._held.clear()
+                if not self._held:
+                    self._beating = None
+                    return
+                for run in self._held:
+                    self.beat(run)
+
+    def set_restart_file(self, run, restart_file):
+        with self._lock:
+            self.db.execute('UPDATE runs SET restart_file = ? WHERE run = ?', (restart_file, run))
+
+    def complete(self, run, timings=None):
+        with self._lock:
+            self._held.discard(run)
+            self.db.execute('UPDATE runs SET status = ?, finished = ?, timings = ?, error = NULL WHERE run = ?',
+                            ('completed', time.time(), json.dumps(timings) if timings else None, run))
+
+    def fail(self, run, error=None):
+        with self._lock:
+            self._held.discard(run)
+            self.db.execute('UPDATE runs SET status = ?, finished = ?, error = ? WHERE run = ?',
+                            ('failed', time.time(), error, run))
@@ -0,0 +1,223 @@
+"""An index of the restart archives of an experiment.
+
+Every restart archive written to `restartdir` is recorded in
+`restartdir/catalog.json` together with the model time it was written at, the
+resolution of the model and the commit of the code that produced it, and a
+checksum of the archive.  The model time is read from the restart files
+before they are archived, so the catalog can be searched without opening any
+archives:
+
+    >>> exp.restart_catalog.find(days=3600)
+    {'file': 'res0120.tar.gz', 'run': 120, 'days': 3600.0, 'date': [0, 0, 3600, 0, 0, 0],
+     'calendar': 'no_calendar', 'num_fourier': 42, 'lat_max': 64, 'num_levels': 25,
+     'commit': '1b2c3d...', 'checksum': '9f8e7d...', 'codec': 'gz'}
+
+    >>> new_exp.run(1, restart_file=exp.get_restart_at(days=3600))
+
+`days` is the number of model days since the start of the experiment.
+Archives written before the catalog existed are added by `scan`, which reads
+just the model time files from each archive.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+
+from isca.archive import detect_codec
+from isca.loghandler import Logger
+from isca.monitor import model_day
+from isca.staging import file_digest
+
+P = os.path.join
+
+# calendar numbers used in the restart files of FMS
+CALENDARS = {0: 'no_calendar', 1: 'thirty_day', 2: 'julian', 3: 'gregorian', 4: 'noleap'}
+
+TIME_FILES = ('coupler.res', 'atmos_model.res')
+
+
+def archive_digest(archive_file):
+    """Returns a sha1 checksum of a restart archive file or directory."""
+    if not os.path.isdir(archive_file):
+        return file_digest(archive_file)
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(archive_file)):
+        h.update(('%s %s\n' % (name, file_digest(P(archive_file, name)))).encode())
+    return h.hexdigest()
+
+
+def parse_model_time(text):
+    """Read the model time from the contents of a coupler.res or atmos_model.res.
+
+    Returns a dict with the `calendar` name, the current `date` as [year, month,
+    day, hour, minute, second] and the `start` date if it is recorded.
+    """
+    info = {}
+    for line in text.splitlines():
+        numbers = [int(x) for x in re.findall(r'-?\d+', line.split('(')[0])]
+        if 'Calendar' in line and numbers:
+            info['calendar'] = CALENDARS.get(numbers[0], str(numbers[0]))
+        elif 'Current model time' in line:
+            info['date'] = numbers[:6]
+        elif 'Model start time' in line:
+            info['start'] = numbers[:6]
+    return info
+
+
+def elapsed_days(date, calendar, start=None):
+    """Model days from `start` to `date`.  For no_calendar, the date is already
+    a count of days since the start.  Returns None if no start date is known."""
+    year, month, day, hour, minute, second = date
+    if calendar in (None, 'no_calendar'):
+        return day + (hour * 3600 + minute * 60 + second) / 86400.0
+    if start is None:
+        return None
+    return model_day(date, calendar) - model_day(start, calendar)
+
+
+class RestartCatalog(Logger):
+    """The catalog of restart archives in `restartdir`."""
+    def __init__(self, restartdir):
+        self.restartdir = restartdir
+        self.catalog_file = P(restartdir, 'catalog.json')
+        # restarts may be archived on a background thread
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.catalog_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write(self, catalog):
+        fd, tmp = tempfile.mkstemp(dir=self.restartdir, prefix='.catalog')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(catalog, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.catalog_file)
+
+    def add(self, archive_file, restart_directory, namelist=None, commit=None):
+        """Record `archive_file`, written from the files in `restart_directory`.
+
+            `namelist`: The namelist of the run, used for the resolution and start date.
+            `commit`:   The commit of the code that wrote the restart.
+        """
+        entry = self._describe(archive_file, restart_directory, namelist)
+        entry['commit'] = commit
+        with self._lock:
+            catalog = self._read()
+            catalog[entry['file']] = entry
+            self._write(catalog)
+        return entry
+
+    def remove(self, archive_file):
+        """Remove the entry of `archive_file` from the catalog."""
+        with self._lock:
+            catalog = self._read()
+            if catalog.pop(os.path.basename(archive_file), None) is not None:
+                self._write(catalog)
+
+    def _describe(self, archive_file, restart_directory, namelist=None):
+        name = os.path.basename(archive_file)
+        match = re.match(r'res(\d+)', name)
+        entry = {
+            'file': name,
+            'run': int(match.group(1)) if match else None,
+            'codec': detect_codec(archive_file).name,
+            'checksum': archive_digest(archive_file),
+        }
+
+        namelist = namelist or {}
+        try:
+            entry.update(self._model_time(restart_directory, namelist))
+        except (ValueError, TypeError) as e:
+            # the archive is good, only its entry in the catalog is incomplete
+            self.log.warning('Could not read the model time of %s (%s).  It is catalogued without one.' % (name, e))
+
+        spectral = namelist.get('spectral_dynamics_nml', {})
+        for key in ('num_fourier', 'lat_max', 'num_levels'):
+            entry[key] = spectral.get(key)
+        return entry
+
+    def _model_time(self, restart_directory, namelist):
+        """The `date`, `calendar` and `days` of the restart files in `restart_directory`.
+        Raises ValueError or TypeError if the time files can't be read."""
+        info = {}
+        for time_file in TIME_FILES:
+            if os.path.exists(P(restart_directory, time_file)):
+                with open(P(restart_directory, time_file)) as f:
+                    info = parse_model_time(f.read())
+                break
+        main = namelist.get('main_nml', {})
+        if 'start' not in info and main.get('current_date'):
+            info['start'] = list(main['current_date'])[:6]
+        if 'date' not in info:
+            return {}
+        return {
+            'date': info['date'],
+            'calendar': info.get('calendar'),
+            'days': elapsed_days(info['date'], info.get('calendar'), info.get('start')),
+        }
+
+    def scan(self, namelist=None):
+        """Add any archives in `restartdir` that aren't in the catalog, reading
+        the model time files out of each archive."""
+        with self._lock:
+            self._scan(namelist)
+
+    def _scan(self, namelist):
+        catalog = self._read()
+        for name in sorted(os.listdir(self.restartdir)):
+            archive_file = P(self.restartdir, name)
+            if name in catalog or not re.match(r'res\d+', name):
+                continue
+            tmpdir = tempfile.mkdtemp(dir=self.restartdir, prefix='.scan')
+            try:
+                self._extract_time_files(archive_file, tmpdir)
+                catalog[name] = self._describe(archive_file, tmpdir, namelist)
+                catalog[name]['commit'] = None
+                self.log.info('Added %s to the restart catalog' % name)
+            finally:
+                shutil.rmtree(tmpdir)
+        self._write(catalog)
+
+    def _extract_time_files(self, archive_file, directory):
+        if os.path.isdir(archive_file):
+            names = [n for n in TIME_FILES if os.path.exists(P(archive_file, n))]
+            for n in names:
+                with open(P(archive_file, n)) as src, open(P(directory, n), 'w') as dst:
+                    dst.write(src.read())
+            return
+        codec = detect_codec(archive_file)
+        if codec.name == 'zstd':
+            # zstd archives can only be read as a stream, so extract them whole
+            codec.extract(archive_file, directory)
+            return
+        with tarfile.open(archive_file) as tar:
+            for member in tar.getmembers():
+                if os.path.basename(member.name) in TIME_FILES:
+                    member.name = os.path.basename(member.name)
+                    tar.extract(member, directory)
+
+    def entries(self):
+        """All entries of restart archives that still exist, in run order."""
+        catalog = self._read()
+        entries = [e for e in catalog.values() if os.path.exists(P(self.restartdir, e['file']))]
+        return sorted(entries, key=lambda e: (e['run'] is None, e['run']))
+
+    def find(self, days=None, date=None, run=None):
+        """Return the entry of the restart written at model day `days`, at
+        `date` ([year, month, day, ...]) or at the end of `run`.
+        Raises KeyError if there is no such restart."""
+        for entry in self.entries():
+            if days is not None and entry.get('days') is not None and abs(entry['days'] - days) < 1e-6:
+                return entry
+            if date is not None and entry.get('date') and entry['date'][:len(date)] == list(date):
+                return entry
+            if run is not None and entry['run'] == run:
+                return entry
+        raise KeyError('No restart found matching days=%r, date=%r, run=%r' % (days, date, run))
@@ -1,13 +1,62 @@
 from contextlib import contextmanager
+import copy
+import hashlib
 import os
+import re
+import shutil
 import socket
+import sys
+import threading
 
 from jinja2 import Environment, FileSystemLoader
 import sh
 
 from isca import GFDL_WORK, GFDL_BASE, _module_directory, get_env_file
+from . import buildprofile, objcache
+from .buildcache import BuildCache
+from .makedeps import DependencyScan
+from .worktrees import WorktreePool
 from .loghandler import Logger
-from .helpers import url_to_folder, destructive, useworkdir, mkdir, cd, git, P, git_run_in_directory
+from .helpers import url_to_folder, destructive, useworkdir, mkdir, rm, ln, cd, git, P, git_run_in_directory, file_lock
+
+# changes to files with these suffixes are recorded in the source control status
+SOURCE_SUFFIXES = ('.f90', '.inc', '.c')
+
+_gfdl_base_commit = []
+
+def gfdl_base_commit():
+    """The commit of GFDL_BASE, read once per process."""
+    if not _gfdl_base_commit:
+        gfdl_git = git_run_in_directory(GFDL_BASE, GFDL_BASE)
+        _gfdl_base_commit.append(gfdl_git.log('-1', '--format="%H"').stdout.decode('utf8'))
+    return _gfdl_base_commit[0]
+
+def template_compiler(template):
+    """The value of FC in the mkmf `template` file, e.g. '$(F90)' or 'mpif90'.
+    None if it isn't set."""
+    compiler = None
+    with open(template) as f:
+        for line in f:
+            match = re.match(r'\s*FC\s*[:?]?=\s*(.*?)\s*$', line)
+            if match:
+                compiler = match.group(1) or None
+    return compiler
+
+def host_flag(version):
+    """The flag that optimises for the cpu of this machine, for the compiler
+    that printed `version` from `--version`.  None if the compiler isn't known."""
+    if re.search(r'ifort|ifx|intel', version, re.I):
+        return '-xHost'
+    if 'GNU Fortran' in version:
+        return '-march=native'
+    return None
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
 
 
 class CodeBase(Logger):
@@ -25,6 +74,22 @@ class CodeBase(Logger):
     path_names_file = None
     executable_name = None
 
+    # named builds of a codebase, each compiled in its own build directory.
+    # `template` is the mkmf template in isca/templates, and `flags` are added
+    # to the compile command after the flags of the template.  With `host`, the
+    # flag that optimises for this machine's cpu is added too, -xHost for the
+    # Intel compiler and -march=native for gfortran.  See `variant`.
+    BUILD_VARIANTS = {
+        'default': {'template': 'mkmf.template.ia64', 'flags': []},
+        'debug': {'template': 'mkmf.template.debug', 'flags': []},
+        'aggressive': {'template': 'mkmf.template.ia64', 'flags': ['-O3']},
+        'host': {'template': 'mkmf.template.ia64', 'flags': ['-O3'], 'host': True},
+    }
+
+    # commits of a repo are checked out as worktrees of a mirror shared by all
+    # codebases.  Set to None to clone the repo for every commit instead.
+    worktree_pool = WorktreePool()
+
     @classmethod
     def from_repo(cls, repo, commit=None, **kwargs):
         return cls(repo=repo, commit=commit, **kwargs)
@@ -77,12 +142,24 @@ class CodeBase(Logger):
         self.workdir =  P(self.storedir, workdir)   # base for all codebase I/O actions
         self.codedir =  P(self.workdir, 'code')     # where code is checked out / symlinked to directory
         self.srcdir  =  P(self.codedir, 'src')      # ISCA_CODE/src
-        self.builddir = P(self.workdir, 'build', self.executable_name.split('.')[0])
+        self.build_variant = 'default'
+        self.builddir = self._variant_builddir(self.build_variant)
         self.templatedir = P(_module_directory, 'templates')  # templates are stored with the python isca module
         self.executable_fullpath = P(self.builddir, self.executable_name)
 
         # alias a version of git acting from within the code directory
         self.git = git_run_in_directory(GFDL_BASE, self.codedir)
+        self._git_dir = None
+        self._tracked_sources = None
+        self._status_cache = None
+        # the status is written from the post-processing threads of `Experiment.run_many`
+        self._status_lock = threading.Lock()
+
+        if self.repo and self.worktree_pool is not None:
+            # held for the life of this object, so that the worktree isn't removed
+            # while experiments still read from it.  Taken before the check below,
+            # so that the worktree can't be removed in between.
+            self._worktree_lease = self.worktree_pool.lease(self.codedir)
 
         # check if the code is available.  If it's not, checkout the repo.
         if not self.code_is_available:
@@ -91,6 +168,8 @@ class CodeBase(Logger):
                 self.checkout()
             else:
                 self.link_source_to(directory)
+        elif self.repo and self.worktree_pool is not None:
+            self.worktree_pool.touch(self.codedir)
 
         self.templates = Environment(loader=FileSystemLoader(self.templatedir))
 
@@ -98,6 +177,25 @@ class CodeBase(Logger):
         self.path_names = []
         self.compile_flags = []  # users can append to this to add additional compiler options
 
+        # executables are reused from a content-addressed cache when none of
+        # the source, flags or templates have changed.  Set to None to always
+        # run make.
+        self.build_cache = BuildCache()
+        # number of files make compiles at once.  None uses one per available cpu.
+        self.make_jobs = None
+        # Fortran objects are reused from this directory, shared by all codebases,
+        # when their preprocessed source and flags are unchanged.  See `isca.objcache`.
+        # Set to None to compile every object.
+        self.object_cache = P(GFDL_WORK, 'objcache')
+        # after each build, the least recently used objects are removed until
+        # the object cache is no larger than this many bytes
+        self.object_cache_size = 5 * 1024**3
+        # record how long each file takes to compile.  See `isca.buildprofile`.
+        self.profile_compile = True
+        # keep the Makefile when the files, flags, template and dependencies
+        # given to mkmf are unchanged.  See `isca.makedeps`.
+        self.reuse_makefile = True
+
     @property
     def code_is_available(self):
         """Returns True if the repo has been checked out, or the directory
@@ -129,34 +227,76 @@ class CodeBase(Logger):
 
     def write_source_control_status(self, outfile):
         """Write the current state of the source code to a file."""
+        with open(outfile, 'w') as file:
+            file.write(self.source_control_status)
 
-        gfdl_git = git_run_in_directory(GFDL_BASE, GFDL_BASE)
+    @property
+    def source_control_status(self):
+        """The commit and any uncommitted changes of the source code, as
+        written by `write_source_control_status`.
 
-        with open(outfile, 'w') as file:
-            # write out the git commit id of the compiled source code
-            file.write("*---commit hash used for fortran code in workdir---*:\n")
-            file.write(self.git_commit)
-
-            # write out the git commit id of GFDL_BASE
-            file.write("\n\n*---commit hash used for code in GFDL_BASE, including this python module---*:\n")
-            file.write(gfdl_git.log('-1', '--format="%H"').stdout.decode('utf8'))
-
-            # if there are any uncommited changes in the working directory,
-            # add those to the file too
-            source_status = self.git.status("-b", "--porcelain").stdout.decode('utf8')
-            # filter the source status for changes in specific files
-            filetypes = ('.f90', '.inc', '.c')
-            source_status = [line for line in source_status.split('\n')
-                    if any([suffix in line.lower() for suffix in filetypes])]
-
-            # write the status and diff only when something is modified
-            if source_status:
-                file.write("\n#### Code compiled from dirty commit ####\n")
-                file.write("*---git status output (only f90 and inc files)---*:\n")
-                file.write('\n'.join(source_status))
-                file.write('\n\n*---git diff output---*\n')
-                source_diff = self.git.diff('--no-color').stdout.decode('utf8')
-                file.write(source_diff)
+        Running git is slow when the diff is large, so the status is only
+        read again when a tracked source file, the index or HEAD has changed.
+        """
+        with self._status_lock:
+            git_state, sources = self._status_cache[0] if self._status_cache else (None, None)
+            if git_state != self._git_state() or sources != self._source_file_stats():
+                # stat the sources before running git so that edits made
+                # while git is running are seen by the next call
+                sources = self._source_file_stats()
+                status = self._read_source_control_status()
+                self._status_cache = ((self._git_state(), sources), status)
+            return self._status_cache[1]
+
+    def _read_source_control_status(self):
+        lines = []
+        # write out the git commit id of the compiled source code
+        lines.append("*---commit hash used for fortran code in workdir---*:\n")
+        lines.append(self.git_commit)
+
+        # write out the git commit id of GFDL_BASE
+        lines.append("\n\n*---commit hash used for code in GFDL_BASE, including this python module---*:\n")
+        lines.append(gfdl_base_commit())
+
+        # if there are any uncommited changes in the working directory,
+        # add those to the file too
+        source_status = self.git.status("-b", "--porcelain").stdout.decode('utf8')
+        # filter the source status for changes in specific files
+        source_status = [line for line in source_status.split('\n')
+                if line.lower().endswith(SOURCE_SUFFIXES)]
+
+        # write the status and diff only when something is modified
+        if source_status:
+            lines.append("\n#### Code compiled from dirty commit ####\n")
+            lines.append("*---git status output (only f90 and inc files)---*:\n")
+            lines.append('\n'.join(source_status))
+            lines.append('\n\n*---git diff output---*\n')
+            lines.append(self.git.diff('--no-color').stdout.decode('utf8'))
+        return ''.join(lines)
+
+    def _git_state(self):
+        """The directory the code is in, and modification stamps of the files
+        git changes on commit, checkout or add."""
+        # the code directory is a link, which `link_source_to` can point elsewhere
+        source = os.path.realpath(self.codedir)
+        if self._git_dir is None or self._git_dir[0] != source:
+            git_dir = self.git('rev-parse', '--git-dir').stdout.decode('utf8').strip()
+            self._git_dir = (source, P(self.codedir, git_dir))
+        git_dir = self._git_dir[1]
+        with open(P(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        files = ['HEAD', 'index']
+        if head.startswith('ref:'):
+            files.append(head.split(None, 1)[1])
+        return (source, head) + tuple(_stamp(P(git_dir, f)) for f in files)
+
+    def _source_file_stats(self):
+        """Modification stamps of the source files tracked by git."""
+        git_state = self._git_state()
+        if self._tracked_sources is None or self._tracked_sources[0] != git_state:
+            tracked = self.git('ls-files').stdout.decode('utf8').split('\n')
+            self._tracked_sources = (git_state, [f for f in tracked if f.lower().endswith(SOURCE_SUFFIXES)])
+        return [_stamp(P(self.codedir, f)) for f in self._tracked_sources[1]]
 
     def read_path_names(self, path_names_file):
         with open(path_names_file) as pn:
@@ -176,10 +316,10 @@ class CodeBase(Logger):
         # link workdir/code to the directory codebase for simplified paths
         if os.path.exists(self.codedir):
             self.log.info("Relinking %s to %s" % (self.codedir, directory))
-            sh.rm(self.codedir)
+            rm(self.codedir)
         else:
             self.log.info("Linking %s to %s" % (self.codedir, directory))
-        sh.ln('-s', directory, self.codedir)
+        ln(directory, self.codedir)
 
     @useworkdir
     @destructive
@@ -188,6 +328,10 @@ class CodeBase(Logger):
             self.log.warn('Cannot checkout a directory.  Use a CodeBase(repo="...") object instead.')
             return None
 
+        if self.worktree_pool is not None and not os.path.exists(self.codedir):
+            self.worktree_pool.add(self.repo, self.commit, self.codedir)
+            return
+
         try:
             self.git.status()
         except Exception as e:
@@ -218,45 +362,272 @@ class CodeBase(Logger):
     @useworkdir
     @destructive
     def compile(self, debug=False, optimisation=None):
+        """Compile the executable of this codebase's build variant.
+
+            `debug`: Switch this codebase, and so the experiments that use it,
+                     to the 'debug' variant and compile that.  To keep this
+                     codebase as it is, use `cb.variant('debug').compile()`.
+            `optimisation`: Compile with `-O<optimisation>`, after the flags of the variant.
+        """
+        if debug and self.build_variant != 'debug':
+            self.log.info('Switching to the debug build variant, built in %s' % self._variant_builddir('debug'))
+            self._set_variant('debug')
         env = get_env_file()
         mkdir(self.builddir)
 
         compile_flags = []
-        # if debug:
-        #     compile_flags.append('-g')
-        #     compile_flags.append('-traceback')
-        #     compile_flags.append('-debug all')
-
-        # if optimisation is not None:
-        #     compile_flags.append('-O%d' % optimisation)
-
         compile_flags.extend(self.compile_flags)
         compile_flags_str = ' '.join(compile_flags)
 
+        variant = self.BUILD_VARIANTS[self.build_variant]
+        other_flags = list(variant['flags'])
+        if variant.get('host'):
+            flag = self._host_flag(env, variant['template'])
+            if flag is not None:
+                other_flags.append(flag)
+        if optimisation is not None:
+            other_flags.append('-O%d' % optimisation)
+        other_flags_str = ' '.join(other_flags)
+
         # get path_names from the directory
         if not self.path_names:
             self.path_names = self.read_path_names(P(self.srcdir, 'extra', 'model', self.name, 'path_names'))
-        self.write_path_names(self.path_names)
-        path_names_str = P(self.builddir, 'path_names')
-
-        vars = {
-            'execdir': self.builddir,
-            'template_dir': self.templatedir,
-            'srcdir': self.srcdir,
-            'workdir': self.workdir,
-            'compile_flags': compile_flags_str,
-            'env_source': env,
-            'path_names': path_names_str,
-            'executable_name': self.executable_name,
-        }
-
-        self.templates.get_template('compile.sh').stream(**vars).dump(P(self.builddir, 'compile.sh'))
-        self.log.info('Running compiler')
-        for line in sh.bash(P(self.builddir, 'compile.sh'), _iter=True, _err_to_out=True):
-            self._log_line(line)
 
+        # only one process can build in the build directory at a time
+        with file_lock(self.builddir + '.lock'):
+            # also needed when the executable is up to date or from the build
+            # cache, which may have been built in another build directory
+            self._build_postprocessing(env)
+            key = None
+            if self.build_cache is not None:
+                key = self.build_key(env, compile_flags_str, variant['template'], other_flags_str)
+                if self._built_key() == key and os.path.exists(self.executable_fullpath):
+                    self.log.info('Executable is up to date, not compiling.')
+                    return
+                cached = self.build_cache.get(key, self.executable_name)
+                if cached is not None:
+                    # replace rather than overwrite, the old executable may be running
+                    tmp = self.executable_fullpath + '.tmp'
+                    try:
+                        shutil.copyfile(cached, tmp)
+                    except (IOError, OSError):
+                        # removed from the cache by another build, so compile it
+                        cached = None
+                if cached is not None:
+                    self.log.info('Using executable %s from the build cache.' % key)
+                    os.chmod(tmp, 0o755)
+                    os.replace(tmp, self.executable_fullpath)
+                    self._write_built_key(key)
+                    return
+
+            self.write_path_names(self.path_names)
+            path_names_str = P(self.builddir, 'path_names')
+            # make only rebuilds objects older than their source, so start
+            # again if the flags are not those of the objects in the directory
+            self._clean_if_flags_changed(' '.join([variant['template'], compile_flags_str, other_flags_str]))
+
+            makefile_key = None
+            if self.reuse_makefile:
+                makefile_key = self.makefile_key(compile_flags_str, variant['template'], other_flags_str)
+            run_mkmf = makefile_key is None or self._read_key('makefile_key') != makefile_key \
+                or not os.path.exists(P(self.builddir, 'Makefile'))
+            if not run_mkmf:
+                self.log.info('Makefile is up to date, not running mkmf.')
+
+            vars = {
+                'execdir': self.builddir,
+                'template_dir': self.templatedir,
+                'srcdir': self.srcdir,
+                'workdir': self.workdir,
+                'compile_flags': compile_flags_str,
+                'other_flags': other_flags_str,
+                'template': variant['template'],
+                'env_source': env,
+                'path_names': path_names_str,
+                'executable_name': self.executable_name,
+                'make_jobs': self.make_jobs or os.cpu_count() or 1,
+                'fc': self._fc_wrapper(variant['template']),
+                'run_mkmf': run_mkmf,
+            }
+
+            self.templates.get_template('compile.sh').stream(**vars).dump(P(self.builddir, 'compile.sh'))
+            self.log.info('Running compiler')
+            # the executable no longer matches the cache until make succeeds
+            self._write_built_key(None)
+            if run_mkmf:
+                self._write_key('makefile_key', None)
+            profile_log = P(self.builddir, buildprofile.PROFILE_LOG)
+            if os.path.exists(profile_log):
+                os.remove(profile_log)
+            for line in sh.bash(P(self.builddir, 'compile.sh'), _iter=True, _err_to_out=True):
+                self._log_line(line)
+            if run_mkmf and makefile_key is not None:
+                self._write_key('makefile_key', makefile_key)
+            if self.profile_compile and os.path.exists(profile_log):
+                report = buildprofile.profile_report(self.builddir, jobs=vars['make_jobs'])
+                for line in buildprofile.summary(report):
+                    self.log.info(line)
+
+            if key is not None:
+                self.build_cache.add(key, self.executable_fullpath)
+                self._write_built_key(key)
+        if self.object_cache is not None:
+            removed = objcache.prune(self.object_cache, self.object_cache_size)
+            if removed:
+                self.log.info('Removed %d objects from the object cache' % removed)
         self.log.info('Compilation complete.')
 
+    def _build_postprocessing(self, env):
+        """Compile the tool that combines distributed output, if needed, and
+        link it into the build directory, where `Experiment.combine_output`
+        runs it."""
+        if all(os.path.exists(P(self.builddir, name)) for name in ('mppnccombine.x', 'mppnccombine_run.sh')):
+            return
+        vars = {'execdir': self.builddir, 'srcdir': self.srcdir, 'env_source': env}
+        script = P(self.builddir, 'compile_postprocessing.sh')
+        self.templates.get_template('compile_postprocessing.sh').stream(**vars).dump(script)
+        for line in sh.bash(script, _iter=True, _err_to_out=True):
+            self._log_line(line)
+
+    def _host_flag(self, env, template):
+        """The flag that optimises for this cpu for the Fortran compiler of the
+        mkmf `template`, found with `--version` in the environment `env`."""
+        compiler = template_compiler(P(self.templatedir, template))
+        version = ''
+        if compiler is not None:
+            # FC may be a make variable set by the environment, e.g. $(F90)
+            compiler = re.sub(r'\$\((\w+)\)', r'${\1}', compiler)
+            try:
+                version = str(sh.bash('-c', 'source %s >/dev/null 2>&1; %s --version' % (env, compiler), _err_to_out=True))
+            except sh.ErrorReturnCode:
+                pass
+        flag = host_flag(version)
+        if flag is None:
+            self.log.warning('Unknown Fortran compiler %r, compiling without a flag for this cpu' % compiler)
+        return flag
+
+    def _fc_wrapper(self, template):
+        """The Fortran compiler of the mkmf `template`, run through
+        `isca.objcache`, or None to use the compiler of the template as it is."""
+        if self.object_cache is None and not self.profile_compile:
+            return None
+        compiler = template_compiler(P(self.templatedir, template))
+        if compiler is None:
+            return None
+        wrapper = [sys.executable, P(_module_directory, 'objcache.py')]
+        if self.object_cache is not None:
+            wrapper += ['--cachedir', self.object_cache]
+        if self.profile_compile:
+            wrapper += ['--profile', P(self.builddir, buildprofile.PROFILE_LOG)]
+        return ' '.join(wrapper + [compiler])
+
+    def build_sources(self):
+        """The files that make up a build, as a dict of {path relative to srcdir: path}.
+
+        These are the files in `path_names` and every other file in their
+        directories and the include directories, which may be included by them.
+        """
+        directories = set(['shared/include', 'shared/mpp/include'])
+        sources = {}
+        for name in self.path_names:
+            if os.path.isfile(P(self.srcdir, name)):
+                sources[name] = P(self.srcdir, name)
+                directories.add(os.path.dirname(name))
+        for directory in directories:
+            if not os.path.isdir(P(self.srcdir, directory)):
+                continue
+            for name in os.listdir(P(self.srcdir, directory)):
+                path = P(self.srcdir, directory, name)
+                if os.path.isfile(path):
+                    sources[P(directory, name)] = path
+        return sources
+
+    def build_key(self, env, compile_flags_str, template='mkmf.template.ia64', other_flags_str=''):
+        """The key of the executable built from the current source with
+        environment file `env`, `compile_flags_str`, mkmf `template` and
+        `other_flags_str` in the build cache."""
+        inputs = [self.executable_name, compile_flags_str, other_flags_str]
+        for filename in (env, P(self.templatedir, 'compile.sh'), P(self.templatedir, template)):
+            with open(filename) as f:
+                inputs.append(f.read())
+        return self.build_cache.key(self.build_sources(), *inputs)
+
+    def makefile_key(self, compile_flags_str, template='mkmf.template.ia64', other_flags_str=''):
+        """A hash of everything mkmf writes into the Makefile: the source
+        files and their dependencies, the flags and the templates."""
+        sources = dict((name, P(self.srcdir, name)) for name in self.path_names)
+        # mkmf also adds every file in the include directories to the Makefile
+        for directory in ('shared/include', 'shared/mpp/include'):
+            if os.path.isdir(P(self.srcdir, directory)):
+                for name in os.listdir(P(self.srcdir, directory)):
+                    sources[P(directory, name)] = P(self.srcdir, directory, name)
+        h = hashlib.sha1()
+        for value in (self.executable_name, self.srcdir, compile_flags_str, other_flags_str):
+            h.update((value + '\n').encode())
+        for filename in (P(self.templatedir, 'compile.sh'), P(self.templatedir, template), P(self.srcdir, '..', 'bin', 'mkmf')):
+            if os.path.isfile(filename):
+                with open(filename, 'rb') as f:
+                    h.update(hashlib.sha1(f.read()).hexdigest().encode())
+        h.update(DependencyScan(self.builddir).digest(sources).encode())
+        return h.hexdigest()
+
+    def _clean_if_flags_changed(self, flags):
+        flags_file = P(self.builddir, 'build_flags')
+        try:
+            with open(flags_file) as f:
+                previous = f.read()
+        except IOError:
+            previous = None
+        if previous is not None and previous != flags:
+            self.log.info('Compiler flags have changed, removing the objects in %s' % self.builddir)
+            for name in os.listdir(self.builddir):
+                if name.endswith(('.o', '.mod')):
+                    os.remove(P(self.builddir, name))
+        with open(flags_file, 'w') as f:
+            f.write(flags)
+
+    def variant(self, name):
+        """A copy of this codebase that compiles and runs the build variant `name`.
+
+        Each variant is compiled in its own build directory, so switching
+        between them never rebuilds.  e.g.
+            cb.variant('aggressive').compile()
+            exp = Experiment('fast_exp', codebase=cb.variant('aggressive'))
+        """
+        if name not in self.BUILD_VARIANTS:
+            raise ValueError('Unknown build variant %r. Choose from %r' % (name, sorted(self.BUILD_VARIANTS)))
+        cb = copy.copy(self)
+        cb._set_variant(name)
+        cb.compile_flags = list(self.compile_flags)
+        return cb
+
+    def _set_variant(self, name):
+        self.build_variant = name
+        self.builddir = self._variant_builddir(name)
+        self.executable_fullpath = P(self.builddir, self.executable_name)
+
+    def _variant_builddir(self, name):
+        builddir = P(self.workdir, 'build', self.executable_name.split('.')[0])
+        # the default variant is built where all builds were before variants
+        return builddir if name == 'default' else builddir + '-' + name
+
+    def _built_key(self):
+        return self._read_key('build_key')
+
+    def _write_built_key(self, key):
+        self._write_key('build_key', key)
+
+    def _read_key(self, name):
+        try:
+            with open(P(self.builddir, name)) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def _write_key(self, name, key):
+        with open(P(self.builddir, name), 'w') as f:
+            f.write(key or '')
+
 
 
 class IscaCodeBase(CodeBase):
@@ -0,0 +1,217 @@
+"""Combine the distributed netcdf output of a multi-core run.
+
+When run on more than one core, FMS writes one netcdf fragment per processor:
+`atmos_monthly.nc.0000`, `atmos_monthly.nc.0001`, ...  Every axis that has been
+split between processors carries a `domain_decomposition` attribute of four
+1-based indices:
+
+    [global_start, global_end, local_start, local_end]
+
+This module is a native python replacement for `postprocessing/mppnccombine.c`.
+Fragments are opened as memory-mapped NETCDF3 files and each variable is
+streamed into the combined file one record at a time, so memory use is bounded
+by a single record of the largest variable rather than the size of the file.
+Any part of the domain that no fragment covers, e.g. with a masked domain,
+holds the variable's `_FillValue` or `missing_value`, or the netcdf default
+fill value.
+
+Only the NETCDF3 classic and 64-bit offset formats can be memory-mapped.
+Fragments in any other format, such as NetCDF4/HDF5, raise a `CombineError`
+naming the format; combine those with mppnccombine.  For this reason, and
+because mppnccombine is what existing output has been checked against,
+`Experiment.combine_tool` defaults to 'mppnccombine'.  Set it to 'python' to
+use this module after checking that it gives the same files for your output,
+e.g. with `benchmarks/combine_benchmark.py --fragments`.
+
+    from isca.combine import combine
+    combine('/path/to/run/atmos_monthly.nc', remove_fragments=True)
+
+It can also be used from the command line:
+
+    $ python -m isca.combine -r atmos_monthly.nc
+"""
+import glob
+import os
+
+import numpy as np
+import netCDF4
+from scipy.io import netcdf_file
+
+from isca.loghandler import log
+
+# attributes that only make sense on the distributed files
+_FRAGMENT_ONLY_ATTRS = ('domain_decomposition', 'NumFilesInSet')
+
+
+class CombineError(Exception):
+    pass
+
+
+def find_fragments(filename):
+    """Return the sorted list of `filename.NNNN` fragments."""
+    return sorted(glob.glob(filename + '.[0-9][0-9][0-9][0-9]'))
+
+
+# the first bytes of each netcdf format, see `check_format`
+_FORMATS = {
+    b'CDF\x01': 'NETCDF3_CLASSIC',
+    b'CDF\x02': 'NETCDF3_64BIT_OFFSET',
+    b'CDF\x05': 'NETCDF3_64BIT_DATA',
+    b'\x89HDF': 'NETCDF4/HDF5',
+}
+_SUPPORTED_FORMATS = ('NETCDF3_CLASSIC', 'NETCDF3_64BIT_OFFSET')
+
+
+def check_format(fragment_file):
+    """Raise a `CombineError` if `fragment_file` is not a netcdf file in a
+    format that can be combined."""
+    with open(fragment_file, 'rb') as f:
+        magic = f.read(4)
+    fmt = _FORMATS.get(magic)
+    if fmt is None:
+        raise CombineError('%s is not a netcdf file' % fragment_file)
+    if fmt not in _SUPPORTED_FORMATS:
+        raise CombineError('%s is in the %s format, which the python combiner can\'t read.  '
+                           'Combine it with mppnccombine instead' % (fragment_file, fmt))
+
+
+def _decomposition(fragment):
+    """Returns {dimension name: (output slice, full size)} for all decomposed
+    dimensions in the fragment."""
+    decomp = {}
+    for dim in fragment.dimensions:
+        var = fragment.variables.get(dim)
+        if var is None or not hasattr(var, 'domain_decomposition'):
+            continue
+        gstart, gend, lstart, lend = [int(x) for x in var.domain_decomposition]
+        decomp[dim] = (slice(lstart - gstart, lend - gstart + 1), gend - gstart + 1)
+    return decomp
+
+
+def combine(filename, fragment_files=None, remove_fragments=False):
+    """Combine the distributed fragments of `filename` into `filename`.
+
+    `fragment_files` (optional): The list of fragments to combine.  Defaults to
+                                 all `filename.NNNN` files.
+    `remove_fragments`: If True, delete the fragments once the combined file
+                        has been successfully written.
+    """
+    if fragment_files is None:
+        fragment_files = find_fragments(filename)
+    if not fragment_files:
+        raise CombineError('No fragments found for %r' % filename)
+
+    for f in fragment_files:
+        check_format(f)
+
+    # the data is read from memory-mapped fragments, the attributes from the
+    # first fragment with netCDF4, which lists them
+    fragments = [netcdf_file(f, 'r', mmap=True, maskandscale=False) for f in fragment_files]
+    try:
+        with netCDF4.Dataset(fragment_files[0]) as meta:
+            _combine_fragments(fragments, meta, filename)
+    finally:
+        for f in fragments:
+            f.close()
+
+    if remove_fragments:
+        for f in fragment_files:
+            os.remove(f)
+    log.debug('Combined %d fragments into %s' % (len(fragment_files), filename))
+    return filename
+
+
+def _num_records(fragment):
+    """The number of records in `fragment`, or None if it has no record variables."""
+    for var in fragment.variables.values():
+        if var.isrec:
+            return var.shape[0]
+    return None
+
+
+def _combine_fragments(fragments, meta, filename):
+    first = fragments[0]
+    decomps = [_decomposition(f) for f in fragments]
+    recdim = next((d for d, size in first.dimensions.items() if size is None), None)
+    nrecs = _num_records(first)
+    if any(_num_records(f) != nrecs for f in fragments[1:]):
+        raise CombineError('Fragments of %r have differing numbers of records' % filename)
+
+    out = netCDF4.Dataset(filename, 'w', format='NETCDF3_64BIT_OFFSET')
+    try:
+        out.set_fill_off()
+
+        for dim, size in first.dimensions.items():
+            if dim in decomps[0]:
+                size = decomps[0][dim][1]
+            out.createDimension(dim, size)
+
+        for name in meta.ncattrs():
+            if name in _FRAGMENT_ONLY_ATTRS:
+                continue
+            value = meta.getncattr(name)
+            if name == 'filename':
+                value = os.path.basename(filename)
+            out.setncattr(name, value)
+
+        for name, var in first.variables.items():
+            metavar = meta.variables[name]
+            attrs = {k: metavar.getncattr(k) for k in metavar.ncattrs()
+                     if k not in _FRAGMENT_ONLY_ATTRS}
+            outvar = out.createVariable(name, var.data.dtype.newbyteorder('='), var.dimensions,
+                                        fill_value=attrs.pop('_FillValue', None))
+            outvar.set_auto_maskandscale(False)
+            outvar.setncatts(attrs)
+
+        for name, outvar in out.variables.items():
+            dims = first.variables[name].dimensions
+            decomposed = any(d in decomps[0] for d in dims)
+            fill = _fill_value(meta.variables[name], outvar.dtype)
+            if dims and dims[0] == recdim:
+                for r in range(nrecs):
+                    outvar[r] = _slab(fragments, decomps, name, outvar, decomposed, fill, r)
+            else:
+                outvar[...] = _slab(fragments, decomps, name, outvar, decomposed, fill)
+    finally:
+        out.close()
+
+
+def _fill_value(var, dtype):
+    """The value of the parts of `var` that no fragment covers."""
+    for attr in ('_FillValue', 'missing_value'):
+        if attr in var.ncattrs():
+            return np.asarray(var.getncattr(attr)).ravel()[0]
+    # None for character data, which is left as zero bytes
+    return netCDF4.default_fillvals.get(dtype.str[1:])
+
+
+def _slab(fragments, decomps, name, outvar, decomposed, fill, record=None):
+    """Assemble the full data for variable `name` (at a single `record`, for
+    record variables) from all fragments.  `fill` is the value of the parts
+    that no fragment covers."""
+    first = fragments[0].variables[name]
+    if not decomposed:
+        data = first.data if record is None else first.data[record]
+        return np.array(data)
+
+    dims = first.dimensions if record is None else first.dimensions[1:]
+    shape = outvar.shape if record is None else outvar.shape[1:]
+    buf = np.zeros(shape, dtype=outvar.dtype) if fill is None else np.full(shape, fill, dtype=outvar.dtype)
+    for fragment, decomp in zip(fragments, decomps):
+        data = fragment.variables[name].data
+        if record is not None:
+            data = data[record]
+        index = tuple(decomp[d][0] if d in decomp else slice(None) for d in dims)
+        buf[index] = data
+    return buf
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Combine distributed FMS netcdf output.')
+    parser.add_argument('-r', dest='remove', action='store_true',
+                        help='Remove the ".NNNN" fragments after a successful combine.')
+    parser.add_argument('filename', help='The combined file to create, e.g. atmos_monthly.nc')
+    parser.add_argument('fragments', nargs='*', help='Fragments to combine.  Defaults to filename.NNNN')
+    args = parser.parse_args()
+    combine(args.filename, args.fragments or None, remove_fragments=args.remove)
@@ -0,0 +1,113 @@
+"""Rewrite combined diagnostic files as compressed, chunked NetCDF4.
+
+The combined output of a run is an uncompressed NETCDF3 file, in which each
+record holds every variable at one time.  Reading a long time series of one
+variable means reading through the whole of every file.  `compress` rewrites a
+file as NetCDF4/HDF5 with every variable compressed and chunked for
+time-series access: each chunk holds all of the file's times for one model
+level, split in latitude and longitude only if needed to keep chunks near
+`chunk_bytes`.
+
+    from isca.compress import compress
+    compress('/path/to/run0001/atmos_monthly.nc', complevel=4)
+
+It can also be used from the command line:
+
+    $ python -m isca.compress atmos_monthly.nc atmos_daily.nc
+
+Compression is lossless.  The file is replaced only once the compressed copy
+has been completely written.
+"""
+import itertools
+import os
+
+import numpy as np
+import netCDF4
+
+from isca.loghandler import log
+
+# dimensions of the horizontal grid, the last to be split up when chunking
+HORIZONTAL_DIMS = ('lat', 'lon', 'latb', 'lonb', 'grid_yt', 'grid_xt', 'yaxis_1', 'xaxis_1')
+
+
+def choose_chunks(dims, shape, itemsize, recdim=None, chunk_bytes=2**22):
+    """Chunk sizes for a variable that favour reading all times at once.
+
+    Non-record, non-horizontal dimensions (such as pressure level) are chunked
+    one at a time; the record dimension and the horizontal dimensions are kept
+    whole, halving latitude/longitude and then time until a chunk is no
+    larger than `chunk_bytes`.
+    """
+    chunks = [n if (d == recdim or d in HORIZONTAL_DIMS) else 1 for d, n in zip(dims, shape)]
+    chunks = [max(c, 1) for c in chunks]
+    order = [i for i, d in enumerate(dims) if d in HORIZONTAL_DIMS]
+    order += [i for i, d in enumerate(dims) if d == recdim]
+    for i in order:
+        while chunks[i] > 1 and np.prod(chunks) * itemsize > chunk_bytes:
+            chunks[i] = (chunks[i] + 1) // 2
+    return chunks
+
+
+def compress(filename, complevel=1, shuffle=True, chunk_bytes=2**22):
+    """Rewrite `filename` in place as a compressed NetCDF4 file."""
+    tmp = filename + '.compressing'
+    src = netCDF4.Dataset(filename, 'r')
+    try:
+        src.set_auto_maskandscale(False)
+        dst = netCDF4.Dataset(tmp, 'w', format='NETCDF4')
+        try:
+            _copy(src, dst, complevel, shuffle, chunk_bytes)
+        finally:
+            dst.close()
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        src.close()
+    before, after = os.path.getsize(filename), os.path.getsize(tmp)
+    os.replace(tmp, filename)
+    log.debug('Compressed %s from %.1f MB to %.1f MB' % (filename, before / 1e6, after / 1e6))
+    return filename
+
+
+def _copy(src, dst, complevel, shuffle, chunk_bytes):
+    recdim = next((name for name, dim in src.dimensions.items() if dim.isunlimited()), None)
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, None if dim.isunlimited() else len(dim))
+    dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+
+    for name, var in src.variables.items():
+        attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+        fill_value = attrs.pop('_FillValue', None)
+        if var.ndim > 1 or (var.ndim == 1 and var.dimensions[0] == recdim):
+            chunks = choose_chunks(var.dimensions, var.shape, var.dtype.itemsize, recdim, chunk_bytes)
+            out = dst.createVariable(name, var.dtype, var.dimensions, zlib=complevel > 0, complevel=complevel,
+                                     shuffle=shuffle, chunksizes=chunks, fill_value=fill_value)
+        else:
+            # coordinate variables are small, store them contiguously
+            chunks = None
+            out = dst.createVariable(name, var.dtype, var.dimensions, fill_value=fill_value)
+        out.set_auto_maskandscale(False)
+        out.setncatts(attrs)
+
+        if chunks is None or var.ndim < 2:
+            out[...] = var[...]
+            continue
+        # copy one chunk-aligned slab at a time to bound memory use
+        slab_dims = [i for i, c in enumerate(chunks) if c == 1 and var.shape[i] > 1]
+        for index in itertools.product(*[range(var.shape[i]) for i in slab_dims]):
+            key = [slice(None)] * var.ndim
+            for i, n in zip(slab_dims, index):
+                key[i] = n
+            out[tuple(key)] = var[tuple(key)]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Rewrite netcdf files as compressed, chunked NetCDF4.')
+    parser.add_argument('-l', dest='complevel', type=int, default=1, help="zlib compression level (1-9)")
+    parser.add_argument('filenames', nargs='+')
+    args = parser.parse_args()
+    for f in args.filenames:
+        compress(f, complevel=args.complevel)
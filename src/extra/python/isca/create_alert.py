@@ -24,6 +24,25 @@ def disk_space_alert(dir, exp_name, month, recipient_email_address, limit, cutof
         print('Disk space more than ' + str(limit) + 'Gb - not sending alert email.')
 
 
+def predicted_disk_space_alert(dir, exp_name, month, recipient_email_address, run_bytes, alert_runs=10, cutoff_limit=5):
+    """Alert before a run if `dir` doesn't have space for the next `alert_runs`
+    runs, each predicted to write `run_bytes`.  If the next run would leave
+    less than `cutoff_limit` Gb free, the run is stopped before it starts."""
+    free_space=disk_usage(dir).free
+    runs_left=int(free_space // run_bytes) if run_bytes > 0 else None
+
+    if (free_space-run_bytes)/1e9 < cutoff_limit:
+        alert_message="Run number "+str(month)+" in experiment "+exp_name+" is predicted to write "+str(round(run_bytes/1e9, 2))+"Gb, which would leave less than the cutoff limit of "+str(cutoff_limit)+"Gb free, therefore run will be killed."
+        send.send_email_fn(recipient_email_address, alert_message)
+        raise IOError(alert_message)
+    elif runs_left is not None and runs_left < alert_runs:
+        alert_message="Disk space for only "+str(runs_left)+" more runs of "+str(round(run_bytes/1e9, 2))+"Gb before running month number "+str(month)+" in experiment "+exp_name
+        print(alert_message+", sending email")
+        send.send_email_fn(recipient_email_address, alert_message)
+    else:
+        print('Disk space for more than ' + str(alert_runs) + ' runs - not sending alert email.')
+
+
 if __name__ == '__main__':
 
     dir=os.getcwd()
@@ -1,6 +1,72 @@
 import copy
 from jinja2 import Template
 
+# dimensions, other than time, of the fields most often written by Isca.
+# Fields not listed here are assumed to be on full model levels.
+SURFACE = ('lat', 'lon')
+FULL = ('pfull', 'lat', 'lon')
+HALF = ('phalf', 'lat', 'lon')
+
+FIELD_DIMS = {
+    # dynamics
+    'ps': SURFACE, 'slp': SURFACE, 'zsurf': SURFACE,
+    'bk': ('phalf',), 'pk': ('phalf',),
+    'pres_half': HALF, 'height_half': HALF,
+    'EKE': (), 'vort_norm': (),
+    # atmosphere, mixed_layer and radiation
+    'precipitation': SURFACE, 'condensation_rain': SURFACE, 'convection_rain': SURFACE,
+    'bucket_depth': SURFACE, 'cape': SURFACE, 'cin': SURFACE,
+    't_surf': SURFACE, 'delta_t_surf': SURFACE, 'flux_lhe': SURFACE, 'flux_t': SURFACE,
+    'flux_oceanq': SURFACE, 'albedo': SURFACE, 'ice_conc': SURFACE, 'h_trop': SURFACE,
+    'olr': SURFACE, 'swdn_sfc': SURFACE, 'swdn_toa': SURFACE, 'lwdn_sfc': SURFACE,
+    'lwup_sfc': SURFACE, 'net_lw_surf': SURFACE, 'coszen': SURFACE,
+    'flux_lw': HALF, 'flux_sw': HALF, 'flux_rad': HALF,
+    'co2': (),
+}
+
+# fields written once per file rather than at every output time
+STATIC_FIELDS = ('bk', 'pk', 'zsurf')
+
+# output is written in single precision (precision 2 in the diag_table)
+BYTES_PER_VALUE = 4
+
+# the time axis and time averaging variables written with every record, in double precision
+TIME_BYTES = 6 * 8
+
+SECONDS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+YEAR_DAYS = {None: 360, 'no_calendar': 360, 'thirty_day': 360, 'noleap': 365, 'julian': 365.25, 'gregorian': 365.25}
+
+
+def interval_seconds(n, units, calendar=None):
+    """The length in seconds of `n` `units` of time, with months and years
+    given their average length in `calendar`."""
+    units = units.lower().rstrip('s')
+    if units in SECONDS:
+        return n * SECONDS[units]
+    year = YEAR_DAYS.get(calendar and calendar.lower(), 365.25) * 86400
+    if units == 'month':
+        return n * year / 12.0
+    if units == 'year':
+        return n * year
+    raise ValueError('Unknown time units %r' % units)
+
+
+def run_seconds(namelist):
+    """The length in seconds of one run, from `main_nml`."""
+    main = namelist.get('main_nml', {})
+    calendar = main.get('calendar')
+    return sum(interval_seconds(main.get(units, 0), units, calendar)
+               for units in ('years', 'months', 'days', 'hours', 'minutes', 'seconds'))
+
+
+def grid_sizes(namelist):
+    """The length of each dimension of the model grid, from `spectral_dynamics_nml`."""
+    spectral = namelist.get('spectral_dynamics_nml', {})
+    # the model defaults
+    nlon, nlat, nlev = spectral.get('lon_max', 128), spectral.get('lat_max', 64), spectral.get('num_levels', 18)
+    return {'lon': nlon, 'lat': nlat, 'lonb': nlon + 1, 'latb': nlat + 1, 'pfull': nlev, 'phalf': nlev + 1}
+
 _TEMPLATE = Template("""
 {%- macro fortrantrue(t) -%}
 {%- if t -%}
@@ -49,7 +115,13 @@ class DiagTable(object):
             'fields': []
         }
 
-    def add_field(self, module, name, time_avg=False, files=None):
+    def add_field(self, module, name, time_avg=False, files=None, dims=None):
+        """Add a field to the output `files`, or all files if None.
+
+            `dims`: The dimensions of the field other than time, used only to
+                    estimate the volume of output.  e.g. ('pfull', 'lat', 'lon').
+                    Looked up in `FIELD_DIMS` if not given.
+        """
         if files is None:
             files = self.files.keys()
 
@@ -57,7 +129,8 @@ class DiagTable(object):
             self.files[fname]['fields'].append({
                 'module': module,
                 'name': name,
-                'time_avg': time_avg
+                'time_avg': time_avg,
+                'dims': dims,
                 })
 
     def copy(self):
@@ -78,6 +151,43 @@ class DiagTable(object):
     def is_valid(self):
         return len(self.files) > 0
 
+    def output_volume(self, namelist):
+        """Estimate the number of bytes written to each output file in one run.
+
+        The resolution is read from `spectral_dynamics_nml` and the run length
+        from `main_nml` of `namelist`.  Returns a dict of {file name: bytes}.
+        `DiagTableFile.output_volume` returns None, as it can't be estimated.
+        """
+        sizes = grid_sizes(namelist)
+        length = run_seconds(namelist)
+        main = namelist.get('main_nml', {})
+        coords = 8 * sum(sizes.values())
+
+        volume = {}
+        for name, file in self.files.items():
+            if file['freq'] < 0:
+                # written only at the end of the run
+                records = 1
+            elif file['freq'] == 0:
+                # written every timestep
+                records = int(length // main.get('dt_atmos', 1))
+            else:
+                records = int(length // interval_seconds(file['freq'], file['units'], main.get('calendar')))
+            static = record = 0
+            for field in file['fields']:
+                dims = field.get('dims')
+                if dims is None:
+                    dims = FIELD_DIMS.get(field['name'], FULL)
+                nbytes = BYTES_PER_VALUE
+                for dim in dims:
+                    nbytes *= sizes[dim]
+                if field['name'] in STATIC_FIELDS:
+                    static += nbytes
+                else:
+                    record += nbytes
+            volume[name] = coords + static + records * (record + TIME_BYTES)
+        return volume
+
 class DiagTableFile(object):
     def __init__(self, filename):
         self.infile = filename
@@ -93,3 +203,7 @@ class DiagTableFile(object):
 
     def is_valid(self):
         return True
+
+    def output_volume(self, namelist):
+        # the fields of a diag_table file are not parsed, so no estimate can be made
+        return None
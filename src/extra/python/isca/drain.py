@@ -0,0 +1,92 @@
+"""Move files from node-local scratch to shared storage in the background.
+
+When an experiment runs in a scratch directory (`exp.scratchdir`), each
+finished output file is handed to a Drainer, which copies it to its place in
+GFDL_DATA on a background thread while the experiment carries on.  Every copy
+is verified: the source is hashed as it is read, the copy is read back and
+hashed, and the copy only appears under its final name once both match.
+
+    drainer = Drainer()
+    drainer.submit(1, '/tmp/isca/exp/run/atmos_monthly.nc', '/data/exp/run0001/atmos_monthly.nc')
+    ...
+    drainer.wait(1)   # raises DrainError if any file of run 1 failed to drain
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+import threading
+
+from isca.helpers import rm
+from isca.loghandler import Logger
+from isca.staging import file_digest
+
+
+class DrainError(IOError):
+    pass
+
+
+def copy_verified(src, dst, blocksize=2**22):
+    """Copy file `src` to `dst`, verifying the copy against a checksum of `src`.
+    Returns the sha1 digest of the file."""
+    tmp = dst + '.draining'
+    h = hashlib.sha1()
+    with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+        for block in iter(lambda: fsrc.read(blocksize), b''):
+            h.update(block)
+            fdst.write(block)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    digest = h.hexdigest()
+    if file_digest(tmp) != digest:
+        os.remove(tmp)
+        raise DrainError('Checksum of %s does not match %s' % (dst, src))
+    shutil.copymode(src, tmp)
+    os.replace(tmp, dst)
+    return digest
+
+
+def drain(src, dst):
+    """Move a file or directory `src` to `dst`, verifying every file copied."""
+    if os.path.isdir(src):
+        if not os.path.isdir(dst):
+            os.makedirs(dst)
+        for name in os.listdir(src):
+            drain(os.path.join(src, name), os.path.join(dst, name))
+    else:
+        copy_verified(src, dst)
+    rm(src)
+
+
+class Drainer(Logger):
+    """Drains files to shared storage on `workers` background threads."""
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, run, src, dst):
+        """Start moving `src` to `dst` as part of the output of `run`."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            job = self._pool.submit(drain, src, dst)
+            self._jobs.setdefault(run, []).append((dst, job))
+        return job
+
+    def wait(self, run):
+        """Wait for every file of `run` to drain.  Raises DrainError if any failed."""
+        with self._lock:
+            jobs = self._jobs.pop(run, [])
+        failed = []
+        for dst, job in jobs:
+            try:
+                job.result()
+            except (IOError, OSError) as e:
+                self.log.error('Failed to drain %s: %s' % (dst, e))
+                failed.append(dst)
+        if failed:
+            raise DrainError('Run %r: %d files failed to drain to %s' % (run, len(failed), os.path.dirname(failed[0])))
+        if jobs:
+            self.log.debug('Run %r: %d files drained' % (run, len(jobs)))
@@ -0,0 +1,181 @@
+"""Backends that execute the run script of an Experiment.
+
+The executor used by an experiment is set with
+
+    exp.executor = LocalExecutor()          # the default
+
+    LocalExecutor:  runs `run.sh` directly as a child of the python process.
+    BatchExecutor:  wraps `run.sh` in a job script, submits it to a batch
+                    queue and polls until the job has finished, following the
+                    model output as it is written.  SlurmExecutor and
+                    PBSExecutor preset the commands for those schedulers, and
+                    LocalQueueExecutor uses the queue simulator bundled in
+                    `isca.localqueue`, so batch runs can be tried out on any
+                    machine.
+
+An executor's `execute` method is given the run directory and a
+`isca.runoutput.RunOutput` to pass the model output to, and returns the exit
+code of the run script.
+"""
+import os
+import subprocess
+import sys
+import time
+
+from jinja2 import Environment, FileSystemLoader
+
+from isca import _module_directory
+from isca.loghandler import Logger
+
+P = os.path.join
+
+
+class Executor(Logger):
+    """Base class for executor backends."""
+    def execute(self, rundir, output, num_cores=1):
+        """Run `rundir`/run.sh, passing its output to `output`.  Returns the exit code."""
+        raise NotImplementedError
+
+
+class LocalExecutor(Executor):
+    """Runs the model directly on this machine."""
+    def execute(self, rundir, output, num_cores=1):
+        proc = subprocess.Popen(['bash', P(rundir, 'run.sh')], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.log.info('process running as {}'.format(proc.pid))
+        try:
+            output.read_from(proc.stdout.fileno())
+            return proc.wait()
+        except BaseException as e:
+            # e.g. from a `run:output` handler, or writing the log to a full disk.
+            # Never leave the model running on cores the next run will use.
+            if isinstance(e, KeyboardInterrupt):
+                self.log.error("Manual interrupt, killing process.")
+            else:
+                self.log.error("Killing process after error: %r" % e)
+            raise
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+            proc.stdout.close()
+
+
+class BatchExecutor(Executor):
+    """Submits each run to a batch queue as a job script.
+
+        `submit`:     Command that submits a job script given as its last
+                      argument, and prints the job id as the last word of its
+                      output.
+        `status`:     Command that, given a job id, exits successfully with
+                      some output while the job is queued or running.
+        `cancel`:     Command that cancels a job, given its id.
+        `directives`: Lines added to the top of the job script, e.g.
+                      ['#SBATCH --time=12:00:00'].  `{num_cores}` is
+                      replaced with the number of cores of the run.
+        `poll_interval`: Seconds between checks on the job.
+
+    The python process still controls the experiment: it waits for each job to
+    finish, following its output, and then post-processes the run and submits
+    the next one.  It has to keep running, e.g. on a login node or in a job of
+    its own, for the whole length of the experiment; it can't submit a chain
+    of runs and exit.  Should it be stopped, `Experiment.resume` carries on
+    from the first run that did not complete.
+    """
+    submit = None
+    status = None
+    cancel = None
+    directives = ()
+
+    def __init__(self, submit=None, status=None, cancel=None, directives=None, poll_interval=10.0):
+        if submit is not None:
+            self.submit = submit
+        if status is not None:
+            self.status = status
+        if cancel is not None:
+            self.cancel = cancel
+        if directives is not None:
+            self.directives = directives
+        self.poll_interval = poll_interval
+        self.templates = Environment(loader=FileSystemLoader(P(_module_directory, 'templates')))
+
+    def write_job_script(self, rundir, num_cores):
+        jobscript = P(rundir, 'job.sh')
+        self.templates.get_template('job.sh').stream(
+            rundir=rundir,
+            directives=[d.format(num_cores=num_cores) for d in self.directives],
+        ).dump(jobscript)
+        return jobscript
+
+    def submit_job(self, jobscript):
+        """Submit `jobscript` and return the job id."""
+        out = subprocess.check_output(list(self.submit) + [jobscript], cwd=os.path.dirname(jobscript))
+        # `sbatch --parsable` prints 'jobid;cluster'
+        return out.decode().split()[-1].split(';')[0]
+
+    def job_active(self, job_id):
+        """Returns True while the job is queued or running."""
+        proc = subprocess.run(list(self.status) + [job_id], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return proc.returncode == 0 and bool(proc.stdout.strip())
+
+    def execute(self, rundir, output, num_cores=1):
+        jobout, exitfile = P(rundir, 'job.out'), P(rundir, 'job.exitcode')
+        for f in (jobout, exitfile):
+            if os.path.exists(f):
+                os.remove(f)
+        job_id = self.submit_job(self.write_job_script(rundir, num_cores))
+        self.log.info('Submitted job %s' % job_id)
+
+        offset = 0
+        try:
+            while True:
+                # read the exit code before following the output, so no output is missed
+                finished = os.path.exists(exitfile) or not self.job_active(job_id)
+                if os.path.exists(jobout):
+                    with open(jobout, 'rb') as f:
+                        f.seek(offset)
+                        data = f.read()
+                    offset += len(data)
+                    output.feed(data)
+                if finished:
+                    break
+                output.flush()
+                time.sleep(self.poll_interval)
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                self.log.error("Manual interrupt, cancelling job %s." % job_id)
+            else:
+                self.log.error("Cancelling job %s after error: %r" % (job_id, e))
+            if self.cancel:
+                subprocess.call(list(self.cancel) + [job_id])
+            raise
+
+        try:
+            with open(exitfile) as f:
+                return int(f.read())
+        except (IOError, ValueError):
+            self.log.error('Job %s ended without reporting an exit code' % job_id)
+            return 1
+
+
+class SlurmExecutor(BatchExecutor):
+    submit = ('sbatch', '--parsable')
+    status = ('squeue', '--noheader', '--job')
+    cancel = ('scancel',)
+    directives = ('#SBATCH --ntasks={num_cores}',)
+
+
+class PBSExecutor(BatchExecutor):
+    submit = ('qsub',)
+    status = ('qstat',)
+    cancel = ('qdel',)
+    directives = ('#PBS -l ncpus={num_cores}',)
+
+
+class LocalQueueExecutor(BatchExecutor):
+    """Submits jobs to the local queue simulator in `isca.localqueue`."""
+    submit = (sys.executable, '-m', 'isca.localqueue', 'submit')
+    status = (sys.executable, '-m', 'isca.localqueue', 'status')
+    cancel = (sys.executable, '-m', 'isca.localqueue', 'cancel')
+
+    def __init__(self, poll_interval=1.0, **kwargs):
+        super(LocalQueueExecutor, self).__init__(poll_interval=poll_interval, **kwargs)
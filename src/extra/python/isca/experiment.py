@@ -1,27 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import copy
+import json
 import os
 import re
+import sys
+import time
 
 from f90nml import Namelist
 from jinja2 import Environment, FileSystemLoader
 import glob
 import sh
 import pdb
-import tarfile
 
 # from gfdl import create_alert
 # import getpass
 
 from isca import GFDL_WORK, GFDL_DATA, GFDL_BASE, _module_directory, get_env_file, EventEmitter
-from isca.diagtable import DiagTable
+from isca.archive import get_codec, detect_codec, find_archive, remove_archive, replacing
+from isca.campaign import CampaignState, namelist_hash
+from isca.catalog import RestartCatalog
+from isca.combine import combine
+from isca.diagtable import DiagTable, run_seconds
+from isca.drain import Drainer, drain
+from isca.executor import LocalExecutor
 from isca.loghandler import Logger, clean_log_debug
-from isca.helpers import destructive, useworkdir, mkdir
+from isca.runoutput import RunOutput
+from isca.staging import InputCache
+from isca.helpers import destructive, useworkdir, mkdir, rm, cp, mv, ln, link_tree
 
 P = os.path.join
 
 class CompilationError(Exception):
     pass
 
-class FailedRunError(Exception): pass
+class FailedRunError(Exception):
+    def __init__(self, message='', output=()):
+        super(FailedRunError, self).__init__(message)
+        self.output = list(output)  # the last lines printed by the model
 
 class Experiment(Logger, EventEmitter):
     """A basic GFDL experiment"""
@@ -50,7 +66,18 @@ class Experiment(Logger, EventEmitter):
     }
 
     runfmt = 'run%04d'
-    restartfmt = 'res%04d.tar.gz'
+
+    # settings copied by `derive`
+    DERIVED_SETTINGS = ('field_table_file', 'combine_workers', 'combine_tool', 'compress_output',
+                        'compress_level', 'restart_codec', 'restart_archive_interval',
+                        'restart_archive_async', 'output_log', 'output_tail', 'executor',
+                        'scratchdir', 'input_cache')
+
+    # the phases of a run that are timed and reported with the `run:phase` event.
+    # `run_many` combines the restart files before starting the next run, and
+    # the diagnostic files in the background, as `combine_restarts` and `combine`.
+    RUN_PHASES = ('setup', 'stage_inputs', 'extract_restart', 'execute', 'combine_restarts',
+                  'combine', 'archive_restart', 'copy_output', 'cleanup')
 
     def __init__(self, name, codebase, safe_mode=False, workbase=GFDL_WORK, database=GFDL_DATA):
         super(Experiment, self).__init__()
@@ -74,21 +101,81 @@ class Experiment(Logger, EventEmitter):
         self.diag_table = DiagTable()
         self.field_table_file = P(self.codebase.srcdir, 'extra', 'model', self.codebase.name, 'field_table')
         self.inputfiles = []
+        # input files are linked into each run from a content-hashed cache.
+        # Set to None to copy the input files for every run instead.
+        self.input_cache = InputCache()
 
         self.namelist = Namelist()
 
+        # number of output files combined concurrently after a multi-core run.
+        # None uses one worker per available cpu.
+        self.combine_workers = None
+        # tool used to combine the distributed output: 'mppnccombine' shells
+        # out to the compiled postprocessing/mppnccombine.x, 'python' uses the
+        # faster in-process combiner in `isca.combine`.  Check that 'python'
+        # gives the same files for your output with benchmarks/combine_benchmark.py
+        # --fragments before switching to it.
+        self.combine_tool = 'mppnccombine'
+        # set to True to rewrite each combined diagnostic file as compressed
+        # NetCDF4, chunked for reading time series.  See `isca.compress`.
+        self.compress_output = False
+        self.compress_level = 1
+
+        # codec used to store restart files between runs.  See `isca.archive`
+        # for the available options.  Existing restarts are always readable
+        # whatever the codec.
+        self.restart_codec = 'gz'
+
+        # restart archive policy.  After each run the restart files are handed
+        # to the next run without copying; they are also archived to `restartdir`
+        # every `restart_archive_interval` runs.  If `restart_archive_async` is
+        # True, archives are written on a background thread.
+        self.restart_archive_interval = 1
+        self.restart_archive_async = False
+        self._archive_jobs = []
+        self._archiver = None
+        # index of the model time, resolution and commit of every restart archive
+        self.restart_catalog = RestartCatalog(self.restartdir)
+
+        self._timings = {}  # phase timings of runs in progress
+
+        # the model's stdout is written in full to `output_log` in the run
+        # directory and kept with the run output.  The last `output_tail`
+        # lines are logged if the run fails.
+        self.output_log = 'model.log'
+        self.output_tail = 200
+
+        # backend that runs the model.  See `isca.executor` for the options.
+        self.executor = LocalExecutor()
+
+        # set to a directory on node-local storage (e.g. '/tmp' or a tmpfs) to
+        # run the model, combine the output and keep restarts there.  Finished
+        # files are drained to GFDL_DATA in the background and verified against
+        # checksums; a run only completes once all of its files have drained.
+        self.scratchdir = None
+        self._drainer = Drainer()
+
+        # number of cores of the run being performed, set before `run:ready`
+        # is emitted.  None before the first run.
+        self.num_cores = None
+
+        # the status of every run is recorded here, see `resume`
+        self.state = CampaignState(P(self.datadir, 'campaign.db'))
+
     @destructive
     def rm_workdir(self):
         try:
-            sh.rm(['-r', self.workdir])
-        except sh.ErrorReturnCode:
+            rm(self.workdir)
+        except OSError:
             self.log.warning('Tried to remove working directory but it doesnt exist')
 
     @destructive
     def rm_datadir(self):
+        # the state database is in the data directory
+        self.state.close()
         try:
-            sh.rm(['-r', self.datadir])
-        except sh.ErrorReturnCode:
+            rm(self.datadir)
+        except OSError:
             self.log.warning('Tried to remove data directory but it doesnt exist')
 
     @destructive
@@ -100,17 +187,28 @@ class Experiment(Logger, EventEmitter):
 
     @destructive
     @useworkdir
-    def clear_rundir(self):
+    def clear_rundir(self, rundir=None):
         #sh.cd(self.workdir)
+        if rundir is None:
+            rundir = self.rundir
         try:
-            sh.rm(['-r', self.rundir])
-        except sh.ErrorReturnCode:
+            rm(rundir)
+        except OSError:
             self.log.warning('Tried to remove run directory but it doesnt exist')
-        mkdir(self.rundir)
-        self.log.info('Emptied run directory %r' % self.rundir)
+        mkdir(rundir)
+        self.log.info('Emptied run directory %r' % rundir)
+
+    @property
+    def restartfmt(self):
+        return 'res%04d' + get_codec(self.restart_codec).extension
 
     def get_restart_file(self, i):
-        return P(self.restartdir, self.restartfmt % i)
+        """Returns the path of the restart archive for run `i`.  If an archive
+        written with a different codec already exists, that is returned instead."""
+        restart_file = P(self.restartdir, self.restartfmt % i)
+        if not os.path.exists(restart_file):
+            restart_file = find_archive(P(self.restartdir, 'res%04d' % i)) or restart_file
+        return restart_file
 
     def get_outputdir(self, run):
         return P(self.datadir, self.runfmt % run)
@@ -154,7 +252,7 @@ class Experiment(Logger, EventEmitter):
 
     def write_field_table(self, outdir):
         self.log.info('Writing field_table to %r' % P(outdir, 'field_table'))
-        sh.cp(self.field_table_file, P(outdir, 'field_table'))
+        cp(self.field_table_file, P(outdir, 'field_table'))
 
     def log_output(self, outputstring):
         line = outputstring.strip()
@@ -166,8 +264,9 @@ class Experiment(Logger, EventEmitter):
 
     def delete_restart(self, run):
         resfile = self.get_restart_file(run)
-        if os.path.isfile(resfile):
-            sh.rm(resfile)
+        if os.path.exists(resfile):
+            remove_archive(resfile)
+            self.restart_catalog.remove(resfile)
             self.log.info('Deleted restart file %s' % resfile)
 
     def get_calendar(self):
@@ -178,9 +277,44 @@ class Experiment(Logger, EventEmitter):
         else:
             return None
 
+    def estimate_output(self, runs=1, num_cores=8, days_per_hour=None):
+        """Estimate the volume of diagnostic output, in bytes, before running.
+
+        The estimate is made from the fields, output frequencies and run length
+        in the diag_table and namelist.  Returns a dict of:
+            `files`:   bytes of each output file in one run
+            `run`:     bytes stored in the data directory by one run
+            `total`:   bytes stored by `runs` runs
+            `combine`: bytes read and written combining one run on `num_cores` cores
+            `copy`:    bytes moved from the run directory to the data directory by one
+                       run.  This is a copy if they are on different filesystems.
+            `peak`:    the most bytes of output in the run directory during a run
+            `write_rate`: bytes per second of wall time, if the model runs at
+                       `days_per_hour` model days per hour.  See `isca.monitor`.
+        Restart files are not included.  Returns None if the output can't be
+        estimated, as when the diag_table is a `DiagTableFile`.
+        """
+        files = self.diag_table.output_volume(self.namelist)
+        if files is None:
+            return None
+        run = sum(files.values())
+        estimate = {
+            'files': files,
+            'run': run,
+            'total': run * runs,
+            # the distributed output is read once and the combined file written once
+            'combine': 2 * run if num_cores > 1 else 0,
+            'copy': run,
+            'peak': 2 * run if num_cores > 1 else run,
+        }
+        if days_per_hour:
+            wall_seconds = run_seconds(self.namelist) / 86400.0 / days_per_hour * 3600
+            estimate['write_rate'] = run / wall_seconds
+        return estimate
+
     @destructive
     @useworkdir
-    def run(self, i, restart_file=None, use_restart=True, multi_node=False, num_cores=8, overwrite_data=False, save_run=False, run_idb=False, nice_score=0, mpirun_opts=''):
+    def run(self, i, restart_file=None, use_restart=True, multi_node=False, num_cores=8, overwrite_data=False, save_run=False, run_idb=False, nice_score=0, mpirun_opts='', force=False):
         """Run the model.
             `num_cores`: Number of mpi cores to distribute over.
             `restart_file` (optional): A path to a valid restart archive.  If None and `use_restart=True`,
@@ -188,54 +322,265 @@ class Experiment(Logger, EventEmitter):
             `save_run`:  If True, copy the entire working directory over to GFDL_DATA
                          so that the run can rerun without the python script.
                          (This uses a lot of data storage!)
+            `force`: Perform the run even if the state database shows another
+                     controller performing it, e.g. one that crashed on another node.
 
         """
+        rundir = self.rundir if self.scratchdir is None else self._scratch_path('run')
+        if not self._prepare_run(i, rundir, restart_file=restart_file, use_restart=use_restart, overwrite_data=overwrite_data, force=force):
+            return False
+        self._execute_run(i, rundir, multi_node=multi_node, num_cores=num_cores, run_idb=run_idb, nice_score=nice_score, mpirun_opts=mpirun_opts)
+        self._finish_run(i, rundir, num_cores=num_cores, save_run=save_run)
+        return True
 
-        self.clear_rundir()
-
-        indir =  P(self.rundir, 'INPUT')
-        outdir = P(self.datadir, self.runfmt % i)
-        resdir = P(self.rundir, 'RESTART')
+    @destructive
+    @useworkdir
+    def run_many(self, start, end, restart_file=None, use_restart=True, max_pending=1, overwrite_data=False, save_run=False, num_cores=8, **run_kwargs):
+        """Run the model for runs `start` to `end` inclusive, overlapping the
+        post-processing of each run with the execution of the next.
+
+        As soon as the model has finished run i, its restart files are combined
+        and handed directly to run i+1.  Combining the diagnostic output, copying
+        to the data directory, archiving the restart and clearing the run directory
+        all happen on a background worker while run i+1 executes.
+
+        Each run uses one of `max_pending`+1 staging directories in the workdir,
+        so consecutive runs never share a run directory.  At most `max_pending`
+        runs are waiting to be post-processed; if the background worker falls
+        further behind, the next run does not start until it has caught up.
+
+        A run whose post-processing fails is recorded as failed, and its error
+        is raised before any further run starts.  If a run fails in the
+        foreground, its error is raised once the background work has finished;
+        any background errors are then only logged.
+
+            `restart_file`, `use_restart`: As for `run`, applied to the first run only.
+            Other keyword arguments are passed to `run`.
+        """
+        if max_pending < 1:
+            raise ValueError('max_pending must be at least 1')
+        stages = [self._scratch_path('run_stage%d' % n) for n in range(max_pending + 1)]
+        stage_jobs = {}
+
+        with ThreadPoolExecutor(max_workers=1) as post:
+            try:
+                for i in range(start, end + 1):
+                    # stop as soon as the post-processing of an earlier run has failed
+                    for job in stage_jobs.values():
+                        if job.done():
+                            job.result()
+                    rundir = stages[i % len(stages)]
+                    # the staging directory can only be reused once its previous
+                    # run has been fully post-processed
+                    if rundir in stage_jobs:
+                        stage_jobs.pop(rundir).result()
+
+                    prepared = self._prepare_run(i, rundir, restart_file=restart_file,
+                        use_restart=use_restart, overwrite_data=overwrite_data)
+                    restart_file, use_restart = None, True
+                    if not prepared:
+                        continue
+
+                    self._execute_run(i, rundir, num_cores=num_cores, **run_kwargs)
+                    with self._failing(i):
+                        if num_cores > 1:
+                            with self._timed(i, 'combine_restarts'):
+                                self.combine_output(rundir, self.get_outputdir(i), diag=False)
+                        # hand the restart over to the next run.  The final run is
+                        # always archived so the experiment can be continued later.
+                        self._store_restart(i, rundir, archive=True if i == end else None, background=True)
+
+                    # finish the run in the background, waiting first if too many
+                    # runs are already queued for post-processing
+                    waiting = [job for job in stage_jobs.values() if not job.done()]
+                    if len(waiting) >= max_pending:
+                        self.log.info('Waiting for post-processing to catch up before starting run %d' % (i + 1))
+                        wait(waiting, return_when=FIRST_COMPLETED)
+                    stage_jobs[rundir] = post.submit(self._finish_run, i, rundir, num_cores=num_cores,
+                                                     save_run=save_run, store_restart=False)
+            except BaseException as e:
+                # let the post-processing of earlier runs finish, but don't let
+                # its errors mask the one that stopped the experiment
+                for job in stage_jobs.values():
+                    if job.exception() not in (None, e):
+                        self.log.error('Post-processing in the background also failed: %r' % job.exception())
+                try:
+                    self.wait_for_archives()
+                except Exception as archive_error:
+                    self.log.error('Archiving a restart in the background also failed: %r' % archive_error)
+                raise
+
+            # wait for all post-processing, re-raising the first error encountered
+            for job in stage_jobs.values():
+                job.result()
+            self.wait_for_archives()
+
+        self.clear_handoffs()
+        return True
 
-        if os.path.isdir(outdir):
-            if overwrite_data:
-                self.log.warning('Data for run %d already exists and overwrite_data is True. Overwriting.' % i)
-                sh.rm('-r', outdir)
+    def resume(self, end, restart_file=None, use_restart=True, force=False, **run_kwargs):
+        """Continue the experiment up to run `end`, starting from the first run
+        that has not completed.
+
+        Runs are looked up in the state database, so no run directory or output
+        is touched for the runs already done.  Runs that failed or crashed are
+        cleaned up and performed again.  Output from before the experiment
+        had a state database is treated as complete.
+
+            `restart_file`, `use_restart`: As for `run`, used if run 1 is the
+                                           first to be performed.
+            `force`: Take over runs that another controller is recorded as
+                     performing.  Use when it is known to have stopped.
+            `overwrite_data`: As for `run`.  The output of a run that failed
+                              or crashed is always overwritten.
+            Other keyword arguments are passed to `run`.
+        """
+        overwrite_data = run_kwargs.pop('overwrite_data', False)
+        start = 1
+        while start <= end:
+            status = self.state.status(start)
+            if status == 'completed' or (status is None and os.path.isdir(self.get_outputdir(start))):
+                start += 1
             else:
-                self.log.warn('Data for run %d already exists but overwrite_data is False. Stopping.' % i)
-                return False
-
-        # make the output run folder and copy over the input files
-        mkdir([indir, resdir, self.restartdir])
+                break
+        if start > end:
+            self.log.info('All runs up to %d have completed' % end)
+            return True
+
+        current = namelist_hash(self.namelist)
+        previous = self.state.get(start - 1)
+        if previous and previous['namelist_hash'] and previous['namelist_hash'] != current:
+            self.log.warning('The namelist has changed since run %d' % (start - 1))
+
+        self.log.info('Resuming from run %d' % start)
+        for i in range(start, end + 1):
+            if i > 1:
+                restart_file, use_restart = None, True
+            # any existing output of an incomplete run is stale
+            self.run(i, restart_file=restart_file, use_restart=use_restart,
+                     overwrite_data=overwrite_data or self.state.status(i) is not None, force=force, **run_kwargs)
+        self.clear_handoffs()
+        return True
 
-        self.codebase.write_source_control_status(P(self.rundir, 'git_hash_used.txt'))
-        self.write_namelist(self.rundir)
-        self.write_field_table(self.rundir)
-        self.write_diag_table(self.rundir)
+    def _prepare_run(self, i, rundir, restart_file=None, use_restart=True, overwrite_data=False, force=False):
+        """Claim run `i` in the state database, then create the run directory and
+        stage the input and restart files.
+        Returns False if output for the run already exists and should not be overwritten.
+        """
+        self._timings[i] = {'started': time.time(), 'phases': {}}
+        outdir = self.get_outputdir(i)
+
+        with self._timed(i, 'setup'):
+            previous = self.state.get(i)
+            crashed = self.state.status(i) == 'crashed' or (force and previous is not None and previous['status'] == 'running')
+            # claim the run before touching the run directory, so that two
+            # controllers can never perform the same run
+            self.state.claim(i, namelist_hash(self.namelist), force=force)
+            # from here on the run is held by this controller, so any error must fail it
+            with self._failing(i):
+                if crashed and os.path.isdir(outdir):
+                    self.log.warning('Run %d was left incomplete by %s. Removing its output.' % (i, previous['controller']))
+                    rm(outdir)
+
+                if os.path.isdir(outdir):
+                    if overwrite_data:
+                        self.log.warning('Data for run %d already exists and overwrite_data is True. Overwriting.' % i)
+                        rm(outdir)
+                    else:
+                        self.log.warn('Data for run %d already exists but overwrite_data is False. Stopping.' % i)
+                        self.state.release(i, previous)
+                        del self._timings[i]
+                        return False
+
+        with self._failing(i):
+            self._stage_run(i, rundir, restart_file, use_restart)
+        return True
 
-        for filename in self.inputfiles:
-            sh.cp([filename, P(indir, os.path.split(filename)[1])])
+    def _stage_run(self, i, rundir, restart_file=None, use_restart=True):
+        """Fill the run directory of run `i` with everything the model needs."""
+        indir =  P(rundir, 'INPUT')
+        resdir = P(rundir, 'RESTART')
+
+        with self._timed(i, 'setup'):
+            self.clear_rundir(rundir)
+
+            # make the output run folder and copy over the input files
+            mkdir([indir, resdir, self.restartdir])
+
+            self.codebase.write_source_control_status(P(rundir, 'git_hash_used.txt'))
+            self.write_namelist(rundir)
+            self.write_field_table(rundir)
+            self.write_diag_table(rundir)
+
+        with self._timed(i, 'stage_inputs'):
+            for filename in self.inputfiles:
+                if self.input_cache is not None:
+                    self.input_cache.stage(filename, indir)
+                else:
+                    cp(filename, P(indir, os.path.split(filename)[1]))
+
+        with self._timed(i, 'extract_restart'):
+            handoff = self._handoff_path(i - 1)
+            if use_restart and not restart_file and os.path.isdir(handoff):
+                # restart files kept in the workdir by the previous run
+                self.log.info('Using restart files handed over from run %d' % (i - 1))
+                link_tree(handoff, indir)
+            elif use_restart:
+                if not restart_file:
+                    # get the restart from previous iteration
+                    restart_file = self.get_restart_file(i - 1)
+                if not os.path.exists(restart_file):
+                    self.log.error('Restart file not found, expecting file %r' % restart_file)
+                    raise IOError('Restart file not found, expecting file %r' % restart_file)
+                else:
+                    self.log.info('Using restart file %r' % restart_file)
+
+                self.extract_restart_archive(restart_file, indir)
+            else:
+                self.log.info('Running without restart file')
 
+    @contextmanager
+    def _failing(self, i):
+        """Record run `i` as failed if the body raises."""
+        try:
+            yield
+        except BaseException as e:
+            self.state.fail(i, repr(e))
+            raise
+
+    @contextmanager
+    def _timed(self, i, phase):
+        """Time a phase of run `i`, adding it to the run's timings and
+        emitting a `run:phase` event with the elapsed seconds."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            phases = self._timings.setdefault(i, {'started': start, 'phases': {}})['phases']
+            phases[phase] = phases.get(phase, 0.0) + elapsed
+            self.emit('run:phase', self, i, phase, elapsed)
+
+    def _write_timings(self, i, outdir, num_cores):
+        """Write the phase timings of run `i` to `timings.json` in `outdir`."""
+        record = self._timings.pop(i, {'started': None, 'phases': {}})
+        record.update({
+            'run': i,
+            'num_cores': num_cores,
+            'finished': time.time(),
+            'total': sum(record['phases'].values()),
+        })
+        with open(P(outdir, 'timings.json'), 'w') as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        return record
+
+    def _execute_run(self, i, rundir, multi_node=False, num_cores=8, run_idb=False, nice_score=0, mpirun_opts=''):
+        """Run the model executable in a prepared run directory."""
         if multi_node:
             mpirun_opts += ' -bootstrap pbsdsh -f $PBS_NODEFILE'
 
-        if use_restart:
-            if not restart_file:
-                # get the restart from previous iteration
-                restart_file = self.get_restart_file(i - 1)
-            if not os.path.isfile(restart_file):
-                self.log.error('Restart file not found, expecting file %r' % restart_file)
-                raise IOError('Restart file not found, expecting file %r' % restart_file)
-            else:
-                self.log.info('Using restart file %r' % restart_file)
-
-            self.extract_restart_archive(restart_file, indir)
-        else:
-            self.log.info('Running without restart file')
-            restart_file = None
-
         vars = {
-            'rundir': self.rundir,
+            'rundir': rundir,
             'execdir': self.codebase.builddir,
             'executable': self.codebase.executable_name,
             'env_source': self.env_source,
@@ -248,100 +593,314 @@ class Experiment(Logger, EventEmitter):
         runscript = self.templates.get_template('run.sh')
 
         # employ the template to create a runscript
-        t = runscript.stream(**vars).dump(P(self.rundir, 'run.sh'))
+        t = runscript.stream(**vars).dump(P(rundir, 'run.sh'))
 
         def _outhandler(line):
             handled = self.emit('run:output', self, line)
             if not handled: # only log the output when no event handler is used
                 self.log_output(line)
 
-        self.emit('run:ready', self, i)
+        def _progresshandler(line):
+            self.emit('run:progress', self, line)
+
+        # only pass the output line by line through python when something is listening
+        output = RunOutput(P(rundir, self.output_log), tail=self.output_tail,
+                           on_line=_outhandler if self._events['run:output'] else None,
+                           on_progress=_progresshandler if self._events['run:progress'] else None)
+
+        self.num_cores = num_cores
+        with self._failing(i):
+            # handlers may stop the run, e.g. `util.email_alerts`
+            self.emit('run:ready', self, i)
         self.log.info("Beginning run %d" % i)
-        try:
-            #for line in sh.bash(P(self.rundir, 'run.sh'), _iter=True, _err_to_out=True):
-            proc = sh.bash(P(self.rundir, 'run.sh'), _bg=True, _out=_outhandler, _err_to_out=True)
-            self.log.info('process running as {}'.format(proc.process.pid))
-            proc.wait()
-            completed = True
-        except KeyboardInterrupt as e:
-            self.log.error("Manual interrupt, killing process.")
-            proc.process.terminate()
-            proc.wait()
-            #log.info("Cleaning run directory.")
-            #self.clear_rundir()
-            raise e
-        except sh.ErrorReturnCode as e:
-            completed = False
-            self.log.error("Run %d failed. See log for details." % i)
-            self.log.error("Error: %r" % e)
+        with output, self._timed(i, 'execute'), self._failing(i):
+            returncode = self.executor.execute(rundir, output, num_cores=num_cores)
+
+        if returncode != 0:
+            self.log.error("Run %d failed with exit code %d. See %s for details." % (i, returncode, P(rundir, self.output_log)))
+            self.log.error("Last %d lines of output:\n%s" % (len(output.tail), '\n'.join(output.tail)))
+            self.state.fail(i, 'exit code %d' % returncode)
             self.emit('run:failed', self)
-            raise FailedRunError()
+            raise FailedRunError('Run %d failed with exit code %d' % (i, returncode), output.tail)
 
         self.emit('run:completed', self, i)
         self.log.info('Run %d complete' % i)
-        mkdir(outdir)
 
-        if num_cores > 1:
-            # use postprocessing tool to combine the output from several cores
+    def _finish_run(self, i, rundir, num_cores=8, save_run=False, store_restart=True):
+        """Combine, archive and copy the output of a completed run to the data
+        directory, then clear the run directory.
+
+            `store_restart`: Set to False if `_store_restart` has already been called.
+        """
+        with self._failing(i):
+            outdir = self.get_outputdir(i)
+            resdir = P(rundir, 'RESTART')
+            mkdir(outdir)
+
+            if num_cores > 1:
+                # use postprocessing tool to combine the output from several cores
+                with self._timed(i, 'combine'):
+                    self.combine_output(rundir, outdir)
+                self.emit('run:combined', self)
+
+            if store_restart:
+                self._store_restart(i, rundir)
+
+            with self._timed(i, 'copy_output'):
+                if save_run:
+                    # copy the complete run directory to GFDL_DATA so that the run can
+                    # be recreated without the python script if required
+                    mkdir(resdir)
+                    cp(rundir, P(outdir, 'run'))
+                else:
+                    # just save some useful diagnostic information
+                    self.write_namelist(outdir)
+                    self.write_field_table(outdir)
+                    self.write_diag_table(outdir)
+                    self.codebase.write_source_control_status(P(outdir, 'git_hash_used.txt'))
+                    if os.path.exists(P(rundir, self.output_log)):
+                        self._save_output(P(rundir, self.output_log), P(outdir, self.output_log))
+                # the run isn't complete until all of its output is safely stored
+                self._drainer.wait(outdir)
+
+            with self._timed(i, 'cleanup'):
+                self.clear_rundir(rundir)
+
+            timings = self._write_timings(i, outdir, num_cores)
+        self.state.complete(i, timings)
+        self._drop_handoffs()
+
+    def _scratch_path(self, *parts):
+        """A path in the experiment's area of `scratchdir`, or in the workdir
+        if no scratch directory is used."""
+        base = self.workdir if self.scratchdir is None else P(self.scratchdir, 'isca', self.name)
+        return P(base, *parts)
+
+    def _save_output(self, src, dst):
+        """Move a finished file from the run directory to the data directory.
+        From scratch, the file is drained in the background; `_finish_run`
+        waits for it."""
+        if self.scratchdir is None:
+            mv(src, dst)
+        else:
+            self._drainer.submit(os.path.dirname(dst), src, dst)
+
+    def _handoff_path(self, i):
+        return self._scratch_path('handoff', 'res%04d' % i)
+
+    def _handoffs(self):
+        """The restart files in the handoff area, as {run: path}."""
+        handoffdir = os.path.dirname(self._handoff_path(0))
+        if not os.path.isdir(handoffdir):
+            return {}
+        handoffs = {}
+        for name in os.listdir(handoffdir):
+            match = re.match(r'res(\d+)$', name)
+            if match:
+                handoffs[int(match.group(1))] = P(handoffdir, name)
+        return handoffs
+
+    def _drop_handoffs(self):
+        """Remove the handed over restart files that no run needs any more:
+        those whose next run has completed."""
+        for run, handoff in self._handoffs().items():
+            if self.state.status(run + 1) == 'completed':
+                rm(handoff)
+
+    def clear_handoffs(self):
+        """Remove the handed over restart files that have been archived to
+        `restartdir`, such as that of the final run of an experiment.
+
+        The restart of the last run performed is otherwise kept in the workdir
+        until a next run completes.  `run_many` and `resume` call this once
+        their last run has finished; call it after a series of `run` calls to
+        free the space.  Restarts that have not been archived are kept, as the
+        experiment can't be continued without them.
+        """
+        self.wait_for_archives()
+        for run, handoff in self._handoffs().items():
+            record = self.state.get(run)
+            if record and record['restart_file'] and os.path.exists(record['restart_file']):
+                rm(handoff)
+            else:
+                self.log.info('Keeping the restart of run %d in %s as it has not been archived' % (run, handoff))
+
+    def _store_restart(self, i, rundir, archive=None, background=None):
+        """Keep the restart files of run `i` for the next run, and archive them
+        according to the restart archive policy.
+
+        The RESTART directory is renamed into the handoff area of the workdir,
+        from which the next run hard-links the files into its INPUT directory.
+        Each restart is kept there until the next run has completed, so that a
+        run that fails in post-processing can be performed again from it
+        even if it was not archived, or until `clear_handoffs` is called.
+
+            `archive`: Archive to `restartdir`.  Defaults to every
+                       `restart_archive_interval` runs.
+            `background`: Archive on a background thread.  Defaults to
+                          `restart_archive_async`.
+        """
+        if archive is None:
+            archive = i % self.restart_archive_interval == 0
+        if background is None:
+            background = self.restart_archive_async
+
+        with self._timed(i, 'archive_restart'):
+            self._check_archives()
+
+            handoff = self._handoff_path(i)
+            mkdir(os.path.dirname(handoff))
+            # restarts of this and later runs are left from an earlier attempt
+            rm([path for run, path in self._handoffs().items() if run >= i])
+            mv(P(rundir, 'RESTART'), handoff)
+
+            if not archive:
+                return
+            archive_file = P(self.restartdir, self.restartfmt % i)
+            self.state.set_restart_file(i, archive_file)
+            if background:
+                # the handoff is removed once the next run completes, which may be
+                # before the archive is written, so archive from a snapshot
+                snapshot = self._scratch_path('archiving', 'res%04d' % i)
+                if os.path.exists(snapshot):
+                    rm(snapshot)
+                link_tree(handoff, snapshot)
+                if self._archiver is None:
+                    self._archiver = ThreadPoolExecutor(max_workers=1)
+                self._archive_jobs.append(self._archiver.submit(self._archive_snapshot, archive_file, snapshot))
+            else:
+                self.make_restart_archive(archive_file, handoff)
+
+    def _archive_snapshot(self, archive_file, snapshot):
+        self.make_restart_archive(archive_file, snapshot)
+        rm(snapshot)
+
+    def _check_archives(self):
+        """Re-raise any error from a completed background archive."""
+        done = [job for job in self._archive_jobs if job.done()]
+        self._archive_jobs = [job for job in self._archive_jobs if not job.done()]
+        for job in done:
+            job.result()
+
+    def wait_for_archives(self):
+        """Block until all background restart archives have been written."""
+        jobs, self._archive_jobs = self._archive_jobs, []
+        for job in jobs:
+            job.result()
+
+    def combine_output(self, rundir, outdir, diag=True, restarts=True):
+        """Combine the distributed netcdf output of a multi-core run.
+
+        Diagnostic files and restart files are combined concurrently on a pool of
+        `self.combine_workers` threads.  Each diagnostic file is compressed, if
+        `self.compress_output` is set, and moved to `outdir` as soon as it has
+        been combined.  Returns once all files are combined.
+
+            `diag`, `restarts`: Set to False to skip combining the diagnostic or
+                                restart files respectively.
+        """
+        if self.combine_tool == 'python':
+            def combinetool(filename):
+                combine(filename)
+        elif self.combine_tool == 'mppnccombine':
             codebase_combine_script = P(self.codebase.builddir, 'mppnccombine_run.sh')
             if not os.path.exists(codebase_combine_script):
                 self.log.warning('combine script does not exist in the commit you are running Isca from.  Falling back to using $GFDL_BASE mppnccombine_run.sh script')
-                sh.ln('-s',  P(GFDL_BASE, 'postprocessing', 'mppnccombine_run.sh'), codebase_combine_script)
-            combinetool = sh.Command(codebase_combine_script)
-            for file in self.diag_table.files:
-                netcdf_file = '%s.nc' % file
-                filebase = P(self.rundir, netcdf_file)
-                combinetool(self.codebase.builddir, filebase)
-                # copy the combined netcdf file into the data archive directory
-                sh.cp(filebase, P(outdir, netcdf_file))
-                # remove all netcdf fragments from the run directory
-                sh.rm(glob.glob(filebase+'*'))
-                self.log.debug('%s combined and copied to data directory' % netcdf_file)
-
-            for restart in glob.glob(P(resdir, '*.res.nc.0000')):
-                restartfile = restart.replace('.0000', '')
-                combinetool(self.codebase.builddir, restartfile)
-                sh.rm(glob.glob(restartfile+'.????'))
-                self.log.debug("Restart file %s combined" % restartfile)
-
-            self.emit('run:combined', self)
-
-        # make the restart archive and delete the restart files
-        self.make_restart_archive(self.get_restart_file(i), resdir)
-        sh.rm('-r', resdir)
-
-        if save_run:
-            # copy the complete run directory to GFDL_DATA so that the run can
-            # be recreated without the python script if required
-            mkdir(resdir)
-            sh.cp(['-a', self.rundir, outdir])
+                ln(P(GFDL_BASE, 'postprocessing', 'mppnccombine_run.sh'), codebase_combine_script)
+            combinetool = sh.Command(codebase_combine_script).bake(self.codebase.builddir)
         else:
-            # just save some useful diagnostic information
-            self.write_namelist(outdir)
-            self.write_field_table(outdir)
-            self.write_diag_table(outdir)
-            self.codebase.write_source_control_status(P(outdir, 'git_hash_used.txt'))
-
-        self.clear_rundir()
-
-        return True
+            raise ValueError('Unknown combine_tool %r' % self.combine_tool)
+
+        def combine_diag(file):
+            netcdf_file = '%s.nc' % file
+            filebase = P(rundir, netcdf_file)
+            combinetool(filebase)
+            # remove all netcdf fragments from the run directory
+            rm(glob.glob(filebase+'.????'))
+            if compresstool is not None:
+                compresstool(filebase)
+            # move the combined netcdf file into the data archive directory
+            self._save_output(filebase, P(outdir, netcdf_file))
+            self.log.debug('%s combined and saved to data directory' % netcdf_file)
+
+        def combine_restart(restart):
+            restartfile = restart.replace('.0000', '')
+            combinetool(restartfile)
+            rm(glob.glob(restartfile+'.????'))
+            self.log.debug("Restart file %s combined" % restartfile)
+
+        # compression is CPU bound, so each file is compressed by `python -m isca.compress`
+        # in a process of its own.  A new interpreter is started rather than forking this
+        # multithreaded one, whose other threads may be holding netcdf/HDF5 locks.
+        compresstool = None
+        if diag and self.compress_output:
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+                [os.path.dirname(_module_directory)] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]))
+            compresstool = sh.Command(sys.executable).bake('-m', 'isca.compress', '-l', self.compress_level, _env=env)
+
+        workers = self.combine_workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            jobs = []
+            if diag:
+                jobs += [pool.submit(combine_diag, file) for file in self.diag_table.files]
+            if restarts:
+                jobs += [pool.submit(combine_restart, restart) for restart in glob.glob(P(rundir, 'RESTART', '*.res.nc.0000'))]
+            # wait for all files, re-raising the first error encountered
+            for job in jobs:
+                job.result()
 
     def make_restart_archive(self, archive_file, restart_directory):
-        with tarfile.open(archive_file, 'w:gz') as tar:
-            tar.add(restart_directory, arcname='.')
+        codec = get_codec(self.restart_codec)
+        # the archive already exists if the run is being repeated
+        with replacing(archive_file) as tmp:
+            if self.scratchdir is None:
+                codec.archive(tmp, restart_directory)
+            else:
+                # write the archive on scratch, then drain it to the restart directory
+                local = self._scratch_path('archives', os.path.basename(archive_file))
+                mkdir(os.path.dirname(local))
+                if os.path.exists(local):
+                    rm(local)
+                codec.archive(local, restart_directory)
+                drain(local, tmp)
+        self.restart_catalog.add(archive_file, restart_directory, self.namelist, self._code_commit())
         self.log.info("Restart archive created at %s" % archive_file)
 
+    def _code_commit(self):
+        try:
+            return self.codebase.git_commit.strip().strip('"')
+        except Exception:
+            return None
+
+    def get_restart_at(self, days=None, date=None):
+        """Returns the path of the restart archive written at model day `days`
+        or at `date` ([year, month, day, ...]), found in the restart catalog.
+        Raises KeyError if there is no such restart."""
+        entry = self.restart_catalog.find(days=days, date=date)
+        return P(self.restartdir, entry['file'])
+
     def extract_restart_archive(self, archive_file, input_directory):
-        with tarfile.open(archive_file, 'r:gz') as tar:
-            tar.extractall(path=input_directory)
+        # detect the codec from the archive so that restarts written
+        # with a different codec can still be used
+        detect_codec(archive_file).extract(archive_file, input_directory)
         self.log.info("Restart %s extracted to %s" % (archive_file, input_directory))
 
     def derive(self, new_experiment_name):
-        """Derive a new experiment based on this one."""
-        new_exp = Experiment(new_experiment_name, self.codebase)
-        new_exp.namelist = self.namelist.copy()
+        """Derive a new experiment based on this one.
+
+        The new experiment has its own copy of the namelist, diag_table and
+        input files, and the same settings (`DERIVED_SETTINGS`).  Its working
+        and data directories are alongside those of this experiment.
+        """
+        new_exp = Experiment(new_experiment_name, self.codebase, safe_mode=self.safe_mode,
+                             workbase=os.path.dirname(os.path.dirname(self.workdir)),
+                             database=os.path.dirname(self.datadir))
+        # sections are updated in place by `update_namelist`
+        new_exp.namelist = copy.deepcopy(self.namelist)
         new_exp.diag_table = self.diag_table.copy()
         new_exp.inputfiles = self.inputfiles[:]
+        for name in self.DERIVED_SETTINGS:
+            setattr(new_exp, name, getattr(self, name))
 
         return new_exp
 
@@ -1,14 +1,108 @@
+from contextlib import contextmanager
+import errno
+import fcntl
 import os
+import shutil
 from functools import wraps
 
 import sh
 
-mkdir = sh.mkdir.bake('-p')
 cd = sh.cd
 git = sh.git.bake('--no-pager')
 
 P = os.path.join
 
+# FILESYSTEM OPERATIONS
+# These run in-process rather than forking `mkdir`, `cp`, `rm` etc. for every call.
+def _paths(paths):
+    return [paths] if isinstance(paths, str) else paths
+
+def mkdir(paths):
+    """Create one or a list of directories, including parents.
+    Existing directories are left untouched (like `mkdir -p`)."""
+    for path in _paths(paths):
+        os.makedirs(path, exist_ok=True)
+
+def rm(paths):
+    """Remove one or a list of files or directory trees (like `rm -r`).
+    Raises OSError if a path does not exist."""
+    for path in _paths(paths):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+def copy_file(src, dst):
+    """Copy the contents and permissions of file `src` to `dst`.
+
+    Uses `copy_file_range` where available, so that the copy stays in the
+    kernel (and can be a reflink or server-side copy on filesystems that
+    support it).  Falls back to `shutil.copyfile` otherwise.
+
+    An existing `dst` is unlinked rather than overwritten in place, so that
+    a file hard-linked to it, such as an `InputCache` object, is untouched."""
+    if os.path.realpath(src) == os.path.realpath(dst):
+        raise shutil.SameFileError('%r and %r are the same file' % (src, dst))
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+    except (AttributeError, OSError):
+        # no copy_file_range on this platform, or not supported between these filesystems
+        shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+    return dst
+
+def cp(src, dst):
+    """Copy a file or directory tree `src` to `dst`.  If `dst` is an existing
+    directory, `src` is copied into it (like `cp -a`)."""
+    if os.path.isdir(dst):
+        dst = P(dst, os.path.basename(src.rstrip(os.sep)))
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, symlinks=True, copy_function=copy_file)
+    else:
+        copy_file(src, dst)
+        shutil.copystat(src, dst)
+    return dst
+
+def mv(src, dst):
+    """Move `src` to `dst`.  This is an atomic rename when both are on the same
+    filesystem, otherwise a copy followed by removal of `src`."""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        cp(src, dst)
+        rm(src)
+    return dst
+
+def ln(src, dst):
+    """Create a symbolic link at `dst` pointing to `src` (like `ln -s`)."""
+    os.symlink(src, dst)
+    return dst
+
+@contextmanager
+def file_lock(filename):
+    """Hold an exclusive lock on `filename`, waiting until it is free.
+    Serializes processes on the same host, and on shared filesystems that
+    support `flock`."""
+    mkdir(os.path.dirname(filename))
+    with open(filename, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
 # DECORATORS
 def destructive(fn):
     """functions decorated with `@destructive` are prevented from running
@@ -38,6 +132,18 @@ def useworkdir(fn):
         return fn(*args, **kwargs)
     return _useworkdir
 
+def link_tree(src, dst):
+    """Hard-link every file in directory `src` into directory `dst`, creating `dst`
+    if needed.  Files are copied instead where hard links are not possible, for
+    example when `src` and `dst` are on different filesystems."""
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+    for name in os.listdir(src):
+        try:
+            os.link(P(src, name), P(dst, name))
+        except OSError:
+            copy_file(P(src, name), P(dst, name))
+
 def url_to_folder(url):
         """Convert a url to a valid folder name."""
         for sym in ('/:@'):
@@ -0,0 +1,136 @@
+"""A minimal batch queue that runs jobs on the local machine.
+
+This stands in for a real scheduler such as Slurm or PBS, so that the
+`BatchExecutor` can be used and tested anywhere.  Jobs are queued in a spool
+directory (`$ISCA_LOCALQUEUE_DIR`, default `GFDL_WORK/localqueue`) and at most
+`$ISCA_LOCALQUEUE_SLOTS` (default 1) run at once; the rest wait in the queue.
+
+    $ python -m isca.localqueue submit job.sh
+    1
+    $ python -m isca.localqueue status 1
+    RUNNING
+    $ python -m isca.localqueue cancel 1
+
+`status` exits with 0 while a job is PENDING or RUNNING and 1 once it is
+COMPLETED, FAILED or CANCELLED.
+"""
+import fcntl
+import os
+import signal
+import subprocess
+import sys
+import time
+
+P = os.path.join
+
+ACTIVE = ('PENDING', 'RUNNING')
+
+
+def spooldir():
+    default = P(os.environ.get('GFDL_WORK', os.path.expanduser('~')), 'localqueue')
+    return os.environ.get('ISCA_LOCALQUEUE_DIR', default)
+
+
+def _set_state(jobdir, state):
+    with open(P(jobdir, 'state.tmp'), 'w') as f:
+        f.write(state)
+    os.replace(P(jobdir, 'state.tmp'), P(jobdir, 'state'))
+
+
+def get_state(job_id):
+    jobdir = P(spooldir(), 'jobs', job_id)
+    try:
+        with open(P(jobdir, 'state')) as f:
+            state = f.read().strip()
+    except IOError:
+        return None
+    if state in ACTIVE:
+        try:
+            with open(P(jobdir, 'pid')) as f:
+                pid = int(f.read())
+        except (IOError, ValueError):
+            return state  # still being submitted
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            # the queue process has died without recording the outcome
+            return 'FAILED'
+    return state
+
+
+def submit(script):
+    """Queue `script` to be run with bash and return its job id."""
+    jobs = P(spooldir(), 'jobs')
+    if not os.path.isdir(jobs):
+        os.makedirs(jobs)
+    job_id = 1
+    while True:
+        try:
+            os.mkdir(P(jobs, str(job_id)))
+            break
+        except OSError:
+            job_id += 1
+    job_id = str(job_id)
+    jobdir = P(jobs, job_id)
+    _set_state(jobdir, 'PENDING')
+    with open(P(jobdir, 'output'), 'wb') as out:
+        proc = subprocess.Popen([sys.executable, '-m', 'isca.localqueue', '_run', job_id, os.path.abspath(script)],
+                                cwd=os.path.dirname(os.path.abspath(script)), stdout=out, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+    with open(P(jobdir, 'pid'), 'w') as f:
+        f.write(str(proc.pid))
+    return job_id
+
+
+def _run(job_id, script):
+    """Wait for a free slot, then run the job.  Runs in the background, started by `submit`."""
+    jobdir = P(spooldir(), 'jobs', job_id)
+    slots = int(os.environ.get('ISCA_LOCALQUEUE_SLOTS', 1))
+    lock = None
+    while lock is None:
+        if get_state(job_id) == 'CANCELLED':
+            return
+        for n in range(slots):
+            f = open(P(spooldir(), 'slot%d.lock' % n), 'w')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                lock = f
+                break
+            except IOError:
+                f.close()
+        else:
+            time.sleep(0.5)
+    _set_state(jobdir, 'RUNNING')
+    returncode = subprocess.call(['bash', script])
+    if get_state(job_id) != 'CANCELLED':
+        _set_state(jobdir, 'COMPLETED' if returncode == 0 else 'FAILED')
+    lock.close()
+
+
+def cancel(job_id):
+    jobdir = P(spooldir(), 'jobs', job_id)
+    if get_state(job_id) not in ACTIVE:
+        return
+    _set_state(jobdir, 'CANCELLED')
+    with open(P(jobdir, 'pid')) as f:
+        pid = int(f.read())
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except OSError:
+        pass
+
+
+if __name__ == '__main__':
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == 'submit':
+        print(submit(args[0]))
+    elif command == 'status':
+        state = get_state(args[0])
+        print(state or 'UNKNOWN')
+        sys.exit(0 if state in ACTIVE else 1)
+    elif command == 'cancel':
+        cancel(args[0])
+    elif command == '_run':
+        _run(args[0], args[1])
+    else:
+        sys.exit('Unknown command %r.  Use submit, status or cancel.' % command)
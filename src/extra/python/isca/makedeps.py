@@ -0,0 +1,92 @@
+"""Find out whether the Makefile of a build has to be written again.
+
+mkmf reads every source file listed in `path_names` to find the modules it
+defines and uses and the files it includes, and writes these dependencies
+into the Makefile along with the cpp flags and the template.  For the full
+model this is over 400 files, read on every compile.
+
+The Makefile only changes when the list of files, the flags, the template or
+the dependencies between the files change.  `DependencyScan` keeps the
+dependencies of each source file in `dependencies.json` in the build
+directory, and only reads a file again when its size or modification time
+has changed.  `CodeBase.compile` hashes the dependencies with everything else
+mkmf is given, and skips mkmf when the hash is that of the existing Makefile.
+Editing the body of one file then costs a single read of that file.
+
+    scan = DependencyScan(builddir)
+    deps = scan.scan({'atmos_spectral/model/spectral_dynamics.F90': '/path/to/src/...'})
+    deps['atmos_spectral/model/spectral_dynamics.F90']
+    # {'modules': ['spectral_dynamics_mod'], 'uses': ['constants_mod', ...], 'includes': []}
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from isca.objcache import USE_RE, MODULE_RE, INCLUDE_RE
+
+P = os.path.join
+
+DEPENDENCIES_FILE = 'dependencies.json'
+
+CPP_INCLUDE_RE = re.compile(r'''^\s*#\s*include\s*["<]([^">]+)[">]''', re.M)
+
+
+def scan_source(filename):
+    """The modules defined and used and the files included by the source `filename`."""
+    with open(filename, 'rb') as f:
+        text = f.read().decode('utf8', 'replace')
+    modules = set(m.lower() for m in MODULE_RE.findall(text))
+    return {
+        'modules': sorted(modules),
+        'uses': sorted(set(m.lower() for m in USE_RE.findall(text)) - modules),
+        'includes': sorted(set(INCLUDE_RE.findall(text)) | set(CPP_INCLUDE_RE.findall(text))),
+    }
+
+
+class DependencyScan(object):
+    """The dependencies of the source files of a build, rescanned only when they change."""
+    def __init__(self, builddir):
+        self.filename = P(builddir, DEPENDENCIES_FILE)
+
+    def _read(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write(self, cache):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.filename), prefix='.dependencies')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, self.filename)
+
+    def scan(self, sources):
+        """The dependencies of each of `sources`, a dict of {name: path}.
+        Missing files have no dependencies and are given as None."""
+        cache = self._read()
+        updated = {}
+        for name, path in sources.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                updated[name] = None
+                continue
+            stamp = [st.st_size, st.st_mtime_ns]
+            entry = cache.get(name)
+            if entry is None or entry['stamp'] != stamp:
+                entry = dict(scan_source(path), stamp=stamp)
+            updated[name] = entry
+        # files no longer in the build are dropped from the cache
+        if updated != cache:
+            self._write(updated)
+        return {name: entry and {k: v for k, v in entry.items() if k != 'stamp'}
+                for name, entry in updated.items()}
+
+    def digest(self, sources):
+        """A hash of the dependencies of `sources`, which changes only when
+        the Makefile written by mkmf would."""
+        deps = self.scan(sources)
+        return hashlib.sha1(json.dumps(deps, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,144 @@
+"""Monitor the throughput of a running model.
+
+With `spectral_dynamics_nml: json_logging = .true.`, the root processor prints
+one JSON line at the end of each model day, in one of two formats depending on
+the calendar:
+
+    {"day":    12  ,"second":     0  ,"max_speed": 0.406000E+02   ,"avg_T": 0.261000E+03   }
+    {"date": "2000-01-12", "time": "00:00:00", "max_speed":  40.6   ,"avg_T": 261.0   }
+
+The ThroughputMonitor parses both, converts the model date to simulated days
+using the experiment's calendar, and records the simulated days per wall-clock
+hour along with `max_speed` and `avg_T`.  The live rate is published with a
+`run:throughput` event and each run's time series is saved to
+`throughput.csv` in the run's output directory.  The monitor only handles
+these lines, which the experiment passes on with a `run:progress` event, so
+the rest of the output is still logged in batches.
+
+    monitor = ThroughputMonitor(exp)
+
+    @exp.on('run:throughput')
+    def check_rate(exp, run, sample):
+        if sample['days_per_hour'] < 100:
+            exp.log.warning('Run %d is slowing down' % run)
+
+    exp.run(1, use_restart=False)
+"""
+import csv
+import json
+import os
+import time
+
+_MONTH_DAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+
+def model_day(date, calendar):
+    """Convert a model (year, month, day, hour, minute, second) to a number of
+    days since 0001-01-01 in the given FMS calendar.  Dates before then, in year 0,
+    give negative days."""
+    year, month, day, hour, minute, second = date
+    fraction = (hour * 3600 + minute * 60 + second) / 86400.0
+    if calendar == 'thirty_day':
+        days = (year - 1) * 360 + (month - 1) * 30 + (day - 1)
+    elif calendar == 'noleap':
+        days = (year - 1) * 365 + sum(_MONTH_DAYS[:month - 1]) + (day - 1)
+    elif calendar == 'julian':
+        leap = year % 4 == 0
+        days = ((year - 1) * 365 + (year - 1) // 4 + sum(_MONTH_DAYS[:month - 1])
+                + (1 if leap and month > 2 else 0) + (day - 1))
+    elif calendar == 'gregorian':
+        # `datetime` can't represent year 0
+        leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+        days = ((year - 1) * 365 + (year - 1) // 4 - (year - 1) // 100 + (year - 1) // 400
+                + sum(_MONTH_DAYS[:month - 1]) + (1 if leap and month > 2 else 0) + (day - 1))
+    else:
+        raise ValueError('Unknown calendar %r' % calendar)
+    return days + fraction
+
+
+def parse_progress(line, calendar=None):
+    """Parse a json_logging line from spectral_dynamics.
+
+    Returns a dict with the simulated `day` (a float), `max_speed` and `avg_T`,
+    or None if the line isn't a json_logging line.
+    """
+    line = line.strip()
+    if not line.startswith('{'):
+        return None
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if 'day' in data:
+        day = data['day'] + data.get('second', 0) / 86400.0
+    elif 'date' in data:
+        date = [int(x) for x in data['date'].split('-') + data.get('time', '0:0:0').split(':')]
+        day = model_day(date, (calendar or 'gregorian').lower())
+    else:
+        return None
+    return {'day': day, 'max_speed': data.get('max_speed'), 'avg_T': data.get('avg_T')}
+
+
+class ThroughputMonitor(object):
+    """Records the simulated-days-per-wall-hour of each run of an Experiment.
+
+        `window`: The number of model days over which the live rate is averaged.
+    """
+    columns = ('wall_seconds', 'day', 'days_per_hour', 'max_speed', 'avg_T')
+
+    def __init__(self, exp, window=5):
+        self.exp = exp
+        self.window = window
+        self.samples = []
+        self.run = None
+        self._start = None
+
+        exp.update_namelist({'spectral_dynamics_nml': {'json_logging': True}})
+        exp.on('run:ready', self._on_ready)
+        exp.on('run:progress', self._on_progress)
+        exp.on('run:completed', self._on_completed)
+
+    def detach(self):
+        """Stop monitoring the experiment."""
+        self.exp._events['run:ready'].remove(self._on_ready)
+        self.exp._events['run:progress'].remove(self._on_progress)
+        self.exp._events['run:completed'].remove(self._on_completed)
+
+    @property
+    def days_per_hour(self):
+        """The most recent simulated-days-per-wall-hour, or None."""
+        return self.samples[-1]['days_per_hour'] if self.samples else None
+
+    def _on_ready(self, exp, run):
+        self.run = run
+        self.samples = []
+        self._start = time.time()
+
+    def _on_progress(self, exp, line):
+        data = parse_progress(line, exp.get_calendar())
+        if data is None:
+            return
+        wall = time.time() - self._start
+        sample = dict(data, wall_seconds=wall, days_per_hour=None)
+        if self.samples:
+            previous = self.samples[-min(self.window, len(self.samples))]
+        else:
+            previous = None
+        if previous is not None and wall > previous['wall_seconds']:
+            sample['days_per_hour'] = 3600.0 * (sample['day'] - previous['day']) / (wall - previous['wall_seconds'])
+        self.samples.append(sample)
+        exp.emit('run:throughput', exp, self.run, sample)
+
+    def _on_completed(self, exp, run):
+        outdir = exp.get_outputdir(run)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        self.save(os.path.join(outdir, 'throughput.csv'))
+
+    def save(self, filename):
+        """Write the time series of the current run to a csv file."""
+        with open(filename, 'w') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns, extrasaction='ignore')
+            writer.writeheader()
+            for sample in self.samples:
+                writer.writerow({k: round(v, 3) if isinstance(v, float) else v for k, v in sample.items()})
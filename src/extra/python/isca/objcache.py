@@ -0,0 +1,246 @@
+"""A cache of compiled Fortran objects, shared between codebases.
+
+`CodeBase.compile` runs make with this script wrapped around the Fortran
+compiler:
+
+    make FC='python objcache.py --cachedir $GFDL_WORK/objcache $(F90)'
+
+For each source file compiled with `-c`, the script hashes
+    - the source, after preprocessing with the `-D`, `-U` and `-I` flags given
+    - any files it `include`s
+    - the compiler and the rest of its flags
+    - the module files of every module the source uses
+and looks the hash up in the cache.  If it is found, the object and module
+files are copied into the build directory instead of compiling.  Otherwise
+the compiler is run and what it produces is added to the cache.
+
+Include paths and the path of the source are left out of the hash, so builds
+of different commits and checkouts share objects: when two commits differ in
+one file, only that file and the files that use its modules are recompiled.
+
+With `--profile FILE`, the start and end time of each compile and whether
+it came from the cache are appended to FILE as a line of JSON.  This works
+with or without `--cachedir`.  See `isca.buildprofile`.
+
+The modification time of an entry is updated whenever it is used, and `prune`
+removes the least recently used entries until the cache is below a size.
+`CodeBase.compile` prunes the cache after each build.
+
+The script is run by make for every file, so it only uses the standard library.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+P = os.path.join
+
+FORTRAN_SUFFIXES = ('.f', '.F', '.f90', '.F90')
+# sources the compiler runs through the preprocessor
+PREPROCESSED_SUFFIXES = ('.F', '.F90')
+
+USE_RE = re.compile(r'^\s*use\b\s*(?:,\s*\w+\s*)?(?:::)?\s*(\w+)', re.I | re.M)
+MODULE_RE = re.compile(r'^\s*module\s+(?!procedure\b)(\w+)', re.I | re.M)
+INCLUDE_RE = re.compile(r'''^\s*include\s*['"]([^'"]+)['"]''', re.I | re.M)
+
+
+def parse_command(args):
+    """Returns the source file, object file and the flags of the compiler
+    arguments `args`, or None if they don't compile a single Fortran file."""
+    if '-c' not in args:
+        return None
+    sources = [a for a in args if a.endswith(FORTRAN_SUFFIXES) and not a.startswith('-')]
+    if len(sources) != 1:
+        return None
+    source = sources[0]
+    output = os.path.splitext(os.path.basename(source))[0] + '.o'
+    flags, includes, cpp_flags = [], [], []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ('-o', '-I') and i + 1 < len(args):
+            if arg == '-o':
+                output = args[i + 1]
+            else:
+                includes.append(args[i + 1])
+            i += 2
+            continue
+        if arg.startswith('-I'):
+            includes.append(arg[2:])
+        elif arg != source:
+            flags.append(arg)
+            if arg.startswith(('-D', '-U')):
+                cpp_flags.append(arg)
+        i += 1
+    return source, output, flags, includes, cpp_flags
+
+
+def compiler_id(compiler):
+    """Identifies the compiler executable, so a change of compiler changes the hash."""
+    path = shutil.which(compiler)
+    if path is None:
+        return compiler
+    st = os.stat(os.path.realpath(path))
+    return '%s %d %d' % (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+
+def preprocess(source, includes, cpp_flags):
+    if not source.endswith(PREPROCESSED_SUFFIXES):
+        with open(source, 'rb') as f:
+            return f.read()
+    # -P leaves out line markers, which contain the path of the source
+    command = ['cpp', '-traditional-cpp', '-P', '-w'] + cpp_flags
+    command += ['-I' + d for d in [os.path.dirname(source) or '.'] + includes] + [source]
+    return subprocess.check_output(command, stderr=subprocess.DEVNULL)
+
+
+def find_file(name, directories):
+    for d in directories:
+        if os.path.isfile(P(d, name)):
+            return P(d, name)
+    return None
+
+
+def object_key(compiler, source, flags, includes, cpp_flags):
+    """The hash of a compile of `source`, and the names of the modules it defines."""
+    text = preprocess(source, includes, cpp_flags)
+    h = hashlib.sha1()
+    h.update(compiler_id(compiler).encode())
+    h.update(' '.join(flags).encode())
+    h.update(text)
+
+    decoded = text.decode('utf8', 'replace')
+    defined = set(m.lower() for m in MODULE_RE.findall(decoded))
+    search = ['.', os.path.dirname(source) or '.'] + includes
+    for name in sorted(set(INCLUDE_RE.findall(decoded))):
+        h.update(('include %s\n' % name).encode())
+        filename = find_file(name, search)
+        if filename is not None:
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+    for module in sorted(set(m.lower() for m in USE_RE.findall(decoded)) - defined):
+        h.update(('use %s\n' % module).encode())
+        # modules are written to the build directory
+        if os.path.isfile(module + '.mod'):
+            with open(module + '.mod', 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest(), sorted(defined)
+
+
+def restore(entry, output):
+    for name in os.listdir(entry):
+        dst = output if name.endswith('.o') else name
+        shutil.copyfile(P(entry, name), dst)
+    # the entry was just used, see `prune`
+    os.utime(entry)
+
+
+def store(entry, output, modules):
+    """Add the object `output` and the module files of `modules` to the cache as `entry`."""
+    if os.path.isdir(entry) or not os.path.isfile(output):
+        return
+    if not os.path.isdir(os.path.dirname(entry)):
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp')
+    try:
+        shutil.copyfile(output, P(tmp, os.path.basename(output)))
+        for module in modules:
+            if os.path.isfile(module + '.mod'):
+                shutil.copyfile(module + '.mod', P(tmp, module + '.mod'))
+        os.rename(tmp, entry)
+    except OSError:
+        # another build stored the same object first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def run_compile(command, cachedir=None):
+    """Run the compile `command`, using the cache in `cachedir` if given.
+    Returns the return code of the compiler, the object file and whether it
+    came from the cache."""
+    parsed = parse_command(command[1:])
+    if parsed is None:
+        return subprocess.call(command), None, False
+    source, output, flags, includes, cpp_flags = parsed
+    if cachedir is None:
+        return subprocess.call(command), output, False
+    try:
+        key, modules = object_key(command[0], source, flags, includes, cpp_flags)
+    except (OSError, subprocess.CalledProcessError):
+        # can't preprocess the file, so compile it without the cache
+        return subprocess.call(command), output, False
+
+    entry = P(cachedir, key[:2], key)
+    if os.path.isdir(entry):
+        try:
+            restore(entry, output)
+        except OSError:
+            # removed by `prune` while it was being copied
+            pass
+        else:
+            print('Using cached %s' % output)
+            return 0, output, True
+    returncode = subprocess.call(command)
+    if returncode == 0:
+        store(entry, output, modules)
+    return returncode, output, False
+
+
+def prune(cachedir, max_bytes):
+    """Remove the least recently used entries of the cache in `cachedir`
+    until it holds at most `max_bytes`.  Returns the number of entries removed."""
+    entries = []
+    for prefix in os.listdir(cachedir) if os.path.isdir(cachedir) else []:
+        if prefix.startswith('.') or not os.path.isdir(P(cachedir, prefix)):
+            continue
+        for key in os.listdir(P(cachedir, prefix)):
+            entry = P(cachedir, prefix, key)
+            if key.startswith('.'):
+                continue
+            try:
+                size = sum(os.path.getsize(P(entry, name)) for name in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        # move the entry aside first, so it is never seen half removed
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp')
+        try:
+            os.rename(entry, P(tmp, 'entry'))
+        except OSError:
+            os.rmdir(tmp)
+            continue
+        shutil.rmtree(tmp, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compile a Fortran file, reusing cached objects.')
+    parser.add_argument('--cachedir', default=None)
+    parser.add_argument('--profile', default=None, help='Append the timing of the compile to this file')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='The compiler and its arguments')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    returncode, output, cached = run_compile(args.command, args.cachedir)
+    if args.profile and output is not None:
+        record = {'object': output, 'start': start, 'end': time.time(), 'cached': cached, 'returncode': returncode}
+        # a single short write in append mode, so concurrent compiles don't interleave
+        with open(args.profile, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
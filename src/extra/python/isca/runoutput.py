@@ -0,0 +1,113 @@
+"""Buffered handling of the stdout of a running model.
+
+Verbose models can print many thousands of lines a second.  Rather than
+passing each line through a callback and the logging module, RunOutput reads
+the stream in large blocks and:
+
+    * writes it unchanged to a log file in the run directory,
+    * keeps the last `tail` lines in a ring buffer, to report if the run fails,
+    * echoes the output to the `isca` logger in batches, at most once every
+      `interval` seconds, with lines containing 'warning' logged individually
+      at WARNING level (up to `max_warnings` per batch).
+
+If `on_line` is given, it is called with each line instead of echoing the
+output to the logger.  This is how `run:output` event handlers are supported.
+If `on_progress` is given, it is called with each line that starts with '{',
+such as the json_logging lines of spectral_dynamics, and the output is still
+echoed in batches.  This is how `run:progress` event handlers are supported.
+"""
+import codecs
+from collections import deque
+import os
+import select
+import time
+
+from isca.loghandler import Logger
+
+
+class RunOutput(Logger):
+    def __init__(self, logfile, tail=200, interval=1.0, max_warnings=20, on_line=None, on_progress=None):
+        self.logfile = logfile
+        self.tail = deque(maxlen=tail)
+        self.interval = interval
+        self.max_warnings = max_warnings
+        self.on_line = on_line
+        self.on_progress = on_progress
+        self._file = None
+        self._partial = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending = []
+        self._last_flush = 0.0
+
+    def __enter__(self):
+        self._file = open(self.logfile, 'w')
+        self._last_flush = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_from(self, fd, blocksize=2**16):
+        """Read from file descriptor `fd` until it is closed."""
+        while True:
+            # wake up periodically so that output isn't held back when the model goes quiet
+            ready, _, _ = select.select([fd], [], [], self.interval)
+            if not ready:
+                self.flush()
+                continue
+            data = os.read(fd, blocksize)
+            if not data:
+                break
+            self.feed(data)
+
+    def feed(self, data):
+        """Handle a block of output bytes, which may begin or end part way through a line."""
+        text = self._decoder.decode(data)
+        self._file.write(text)
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        self._handle(lines)
+
+    def _handle(self, lines):
+        self.tail.extend(lines)
+        if self.on_progress is not None:
+            for line in lines:
+                if line.lstrip().startswith('{'):
+                    self.on_progress(line)
+        if self.on_line is not None:
+            for line in lines:
+                self.on_line(line)
+            return
+        self._pending.extend(lines)
+        if time.time() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Echo the pending output to the logger."""
+        self._last_flush = time.time()
+        lines = [line.strip() for line in self._pending if line.strip()]
+        self._pending = []
+        if not lines:
+            return
+        text = '\n'.join(lines)
+        if 'warning' not in text.lower():
+            self.log.debug(text)
+            return
+        other, warnings = [], []
+        for line in lines:
+            (warnings if 'warning' in line.lower() else other).append(line)
+        if other:
+            self.log.debug('\n'.join(other))
+        for line in warnings[:self.max_warnings]:
+            self.log.warning(line)
+        if len(warnings) > self.max_warnings:
+            self.log.warning('... %d more warnings, see %s' % (len(warnings) - self.max_warnings, self.logfile))
+
+    def close(self):
+        if self._partial:
+            self._handle([self._partial])
+            self._partial = ''
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
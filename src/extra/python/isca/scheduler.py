@@ -0,0 +1,170 @@
+"""Run an ensemble of experiments side by side on the cores of one node.
+
+Each job is a sequence of runs of one Experiment using a fixed number of
+cores.  The runs of a job are performed in order, each restarting from the
+previous one, but runs of different jobs are independent.  The scheduler
+starts as many runs as fit on the available cores and, as each one finishes,
+starts the next run of that job or any queued run that now fits.
+
+    scheduler = EnsembleScheduler(num_cores=32)
+    for omega in [0.5, 1.0, 2.0]:
+        exp = base.derive('om_%.1f' % omega)
+        exp.update_namelist({'constants_nml': {'omega': omega * 7.292e-5}})
+        scheduler.add(exp, runs=range(1, 11), num_cores=16, use_restart=False)
+    results = scheduler.run()
+
+A job whose run fails is abandoned, leaving the other jobs running.
+
+Each run is given its own set of cores, which are passed to `mpirun` so that
+runs side by side never share cores.  By default MPI pins rank i of every job
+to core i, so without this all jobs would run on the lowest numbered cores.
+The options depend on the MPI library: it is found from `mpirun --version` in
+the environment of the experiments, or can be given as `mpi='intel'` or
+`mpi='openmpi'`.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+import re
+import subprocess
+
+from isca.loghandler import Logger, log
+
+# mpirun options that run a job on the comma separated list of `cores`
+PINNING = {
+    'intel': '-genv I_MPI_PIN_PROCESSOR_LIST {cores}',
+    'openmpi': '--cpu-set {cores} --bind-to core',
+}
+
+
+def mpi_library(version):
+    """The MPI library that printed `version` from `mpirun --version`, as a
+    key of PINNING.  None if it isn't known."""
+    if re.search(r'Intel\(R\) MPI', version):
+        return 'intel'
+    if re.search(r'Open MPI|OpenRTE', version):
+        return 'openmpi'
+    return None
+
+
+def detect_mpi(env_source):
+    """The MPI library of `mpirun` in the environment file `env_source`."""
+    try:
+        proc = subprocess.run(['bash', '-c', 'source %s >/dev/null 2>&1; mpirun --version' % env_source],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+    except (OSError, subprocess.SubprocessError) as e:
+        log.warning('Could not run mpirun --version: %r' % e)
+        return None
+    return mpi_library(proc.stdout.decode('utf8', 'replace'))
+
+
+class EnsembleJob(object):
+    """The runs of one experiment in an ensemble."""
+    def __init__(self, exp, runs, num_cores, restart_file=None, use_restart=True, run_kwargs=None):
+        self.exp = exp
+        self.runs = list(runs)
+        self.num_cores = num_cores
+        self.restart_file = restart_file
+        self.use_restart = use_restart
+        self.run_kwargs = run_kwargs or {}
+        self.completed = []
+        self.error = None
+
+    @property
+    def next_run(self):
+        """The next run to perform, or None if the job is finished."""
+        if self.error is not None or len(self.completed) == len(self.runs):
+            return None
+        return self.runs[len(self.completed)]
+
+    def run_next(self, mpirun_opts=''):
+        """Perform the next run, adding `mpirun_opts` to those of the job."""
+        i = self.next_run
+        run_kwargs = dict(self.run_kwargs)
+        if mpirun_opts:
+            run_kwargs['mpirun_opts'] = ' '.join(filter(None, [run_kwargs.get('mpirun_opts', ''), mpirun_opts]))
+        if not self.completed:
+            # only the first run of the job takes the user's restart options
+            self.exp.run(i, restart_file=self.restart_file, use_restart=self.use_restart,
+                         num_cores=self.num_cores, **run_kwargs)
+        else:
+            self.exp.run(i, num_cores=self.num_cores, **run_kwargs)
+        self.completed.append(i)
+
+
+class EnsembleScheduler(Logger):
+    """Packs the runs of several experiments onto the cores of a node.
+
+        `num_cores`: The number of cores available to the ensemble.  Defaults
+                     to the number of cpus on this machine.
+        `mpi`: The MPI library, 'intel' or 'openmpi', or a format string of
+               mpirun options that pin a run to `{cores}`.  Found from the
+               environment of the first experiment if None.  Set to False to
+               leave the binding of runs to MPI.
+        `first_core`: The number of the first core of the ensemble's cores.
+    """
+    def __init__(self, num_cores=None, mpi=None, first_core=0):
+        self.num_cores = num_cores or os.cpu_count() or 1
+        self.mpi = mpi
+        self.cores = list(range(first_core, first_core + self.num_cores))
+        self.jobs = []
+
+    def add(self, exp, runs, num_cores=8, restart_file=None, use_restart=True, **run_kwargs):
+        """Add a job performing `runs` of `exp` on `num_cores` cores.
+
+        `restart_file` and `use_restart` apply to the first run of the job;
+        every later run restarts from the one before.  Other keyword arguments
+        are passed to `Experiment.run`.
+        """
+        if num_cores > self.num_cores:
+            raise ValueError('Job %r needs %d cores but only %d are available' % (exp.name, num_cores, self.num_cores))
+        if any(job.exp.workdir == exp.workdir for job in self.jobs):
+            raise ValueError('Experiment %r is already part of the ensemble' % exp.name)
+        job = EnsembleJob(exp, runs, num_cores, restart_file, use_restart, run_kwargs)
+        self.jobs.append(job)
+        return job
+
+    def run(self):
+        """Run all jobs, returning a dict of experiment name to the exception
+        that stopped the job, or None if all its runs completed."""
+        pinning = self._pinning()
+        free = list(self.cores)
+        running = {}
+        waiting = [job for job in self.jobs if job.next_run is not None]
+        with ThreadPoolExecutor(max_workers=len(self.jobs) or 1) as pool:
+            while waiting or running:
+                # start, in the order the jobs were added, every job that fits
+                for job in list(waiting):
+                    if job.num_cores <= len(free):
+                        waiting.remove(job)
+                        cores, free = free[:job.num_cores], free[job.num_cores:]
+                        self.log.info('Starting %s run %d on cores %d-%d (%d cores free)' % (job.exp.name, job.next_run, cores[0], cores[-1], len(free)))
+                        opts = pinning.format(cores=','.join(str(c) for c in cores)) if pinning else ''
+                        running[pool.submit(job.run_next, opts)] = (job, cores)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, cores = running.pop(future)
+                    free = sorted(free + cores)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.log.error('%s run %d failed, abandoning its remaining runs' % (job.exp.name, job.next_run))
+                        job.error = e
+                    if job.next_run is not None:
+                        # the next run of this job goes ahead of later jobs so it can't be starved
+                        waiting.insert(0, job)
+        return {job.exp.name: job.error for job in self.jobs}
+
+    def _pinning(self):
+        """The mpirun options that pin a run to `{cores}`, or None."""
+        mpi = self.mpi
+        if mpi is False:
+            return None
+        if mpi is None:
+            env_source = getattr(self.jobs[0].exp, 'env_source', None) if self.jobs else None
+            mpi = detect_mpi(env_source) if env_source else None
+            if mpi is None:
+                self.log.warning('Unknown MPI library, runs side by side may share cores. '
+                                 "Pass mpi= to EnsembleScheduler to pin each run to its own cores.")
+                return None
+        return PINNING.get(mpi, mpi)
@@ -0,0 +1,137 @@
+"""A content-addressed cache for staging experiment input files.
+
+Input files such as SST climatologies, ozone and q-flux files are used
+unchanged by every run of an experiment.  Rather than copying them into the
+run directory each time, the InputCache keeps a single copy of each distinct
+file under `GFDL_WORK/inputcache`, indexed by the hash of its contents, and
+links that copy into the run's INPUT directory.
+
+A file is only re-hashed when its size or modification time changes, and only
+copied into the cache when its contents have changed, so staging an unchanged
+input file costs a `stat` and a hard link.
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+
+from isca import GFDL_WORK
+from isca.helpers import file_lock
+from isca.loghandler import Logger
+
+P = os.path.join
+
+
+def file_digest(filename, blocksize=2**22):
+    """Returns the sha1 hex digest of the contents of `filename`."""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class InputCache(Logger):
+    """A content-hashed store of input files, shared between experiments.
+
+        cache = InputCache()
+        cache.stage('/data/sst_clim_amip.nc', '/work/exp/run/INPUT')
+    """
+    def __init__(self, cachedir=P(GFDL_WORK, 'inputcache')):
+        self.cachedir = cachedir
+        self.objectdir = P(cachedir, 'objects')
+        self.index_file = P(cachedir, 'index.json')
+
+    def _lock(self):
+        # held while reading, changing and writing back the index
+        return file_lock(P(self.cachedir, 'index.lock'))
+
+    def _read_index(self):
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        # write atomically so concurrent experiments never read a partial index
+        fd, tmp = tempfile.mkstemp(dir=self.cachedir, prefix='.index')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_file)
+
+    def digest(self, filename, index=None):
+        """Returns the content digest of `filename`, hashing it only if it has
+        changed since it was last seen."""
+        if index is None:
+            index = self._read_index()
+        source = os.path.realpath(filename)
+        st = os.stat(source)
+        entry = index.get(source)
+        if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return entry['digest']
+        digest = file_digest(source)
+        index[source] = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'digest': digest}
+        return digest
+
+    def add(self, filename, index=None):
+        """Add `filename` to the cache if it isn't already there and return the
+        path of the cached copy."""
+        if index is None:
+            index = self._read_index()
+        digest = self.digest(filename, index)
+        cached = P(self.objectdir, digest)
+        if not os.path.exists(cached):
+            if not os.path.isdir(self.objectdir):
+                os.makedirs(self.objectdir)
+            self.log.info('Adding %s to the input cache' % filename)
+            fd, tmp = tempfile.mkstemp(dir=self.objectdir, prefix='.tmp')
+            os.close(fd)
+            shutil.copyfile(filename, tmp)
+            # cached files are shared between runs, so must never be modified in place
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp, cached)
+        return cached
+
+    def stage(self, filename, directory, name=None):
+        """Place `filename` in `directory`, linking to the cached copy.
+
+        A hard link is used where possible, otherwise a symbolic link.
+        Returns the path of the staged file.
+        """
+        with self._lock():
+            index = self._read_index()
+            before = dict(index)
+            cached = self.add(filename, index)
+            if index != before:
+                self._write_index(index)
+
+        target = P(directory, name or os.path.basename(filename))
+        if os.path.lexists(target):
+            if os.path.realpath(target) == os.path.realpath(filename) or os.path.samefile(target, cached):
+                return target
+            os.remove(target)
+        try:
+            os.link(cached, target)
+        except OSError:
+            os.symlink(cached, target)
+        return target
+
+    def prune(self):
+        """Remove cached files that no longer correspond to the current contents
+        of any indexed input file."""
+        with self._lock():
+            index = self._read_index()
+            live = set()
+            for source in list(index):
+                if os.path.exists(source):
+                    live.add(self.digest(source, index))
+                else:
+                    del index[source]
+            self._write_index(index)
+            for digest in os.listdir(self.objectdir):
+                if digest not in live and not digest.startswith('.'):
+                    os.remove(P(self.objectdir, digest))
+                    self.log.info('Removed %s from the input cache' % digest)
@@ -4,7 +4,7 @@
 
 # 1. Configuration
 hostname=`hostname`
-template={{ template_dir }}/mkmf.template.ia64
+template={{ template_dir }}/{{ template }}
 mkmf={{ srcdir }}/../bin/mkmf                             # path to executable mkmf
 sourcedir={{ srcdir }}                             # path to directory containing model source code
 pathnames={{ path_names }}                      # path to file containing list of source paths
@@ -24,35 +24,17 @@ module list
 ulimit -s unlimited # Set stack size to unlimited
 export MALLOC_CHECK_=0
 
-# 3. compile the mppncombine tool if it hasn't yet been done.
-if [ ! -e "{{ execdir }}/mppnccombine.x" ]; then
-  echo "Compiling postprocessing tools"
-  cd $ppdir
-  ./compile_mppn.sh
-  # cc -O -c `nc-config --cflags` mppnccombine.c
-  # if [ $? != 0 ]; then
-  #     echo "ERROR: could not compile combine tool"
-  #     exit 1
-  # fi
-  # cc -O -o mppnccombine.x `nc-config --libs`  mppnccombine.o
-  # if [ $? != 0 ]; then
-  #     echo "ERROR: could not compile combine tool"
-  #     exit 1
-  # fi
-
-  ln -s $ppdir/mppnccombine.x {{ execdir }}/mppnccombine.x
-  ln -s $ppdir/mppnccombine_run.sh {{ execdir }}/mppnccombine_run.sh
-fi
+# 3. the postprocessing tools are compiled and linked by compile_postprocessing.sh
 
 cd $execdir
 
 echo $pathnames
 
+{% if run_mkmf -%}
 # execute mkmf to create makefile
 cppDefs="-Duse_libMPI -Duse_netCDF -Duse_LARGEFILE -DINTERNAL_FILE_NML -DOVERLOAD_C8 {{compile_flags}}"
-$mkmf  -a $sourcedir -t $template -p $executable -c "$cppDefs" $pathnames $sourcedir/shared/include $sourcedir/shared/mpp/include
-
-make
+# flags of the build variant go in OTHERFLAGS, after those of the template
+$mkmf  -a $sourcedir -t $template -p $executable -c "$cppDefs" -o "{{ other_flags }}" $pathnames $sourcedir/shared/include $sourcedir/shared/mpp/include
 
 # $mkmf $make_flags -a $source_dir  -p fms_moist.x -t   $template \
 #     -c "-Duse_libMPI -Duse_netCDF -Duse_LARGEFILE -DINTERNAL_FILE_NML -DOVERLOAD_C8" $pathnames $sourcedir/shared/mpp/include $sourcedir/shared/constants $sourcedir/include
@@ -62,9 +44,19 @@ if [ $? != 0 ]; then
    echo "ERROR: mkmf failed for $executable"
    exit 1
 fi
+{%- else -%}
+# the files, flags and dependencies are those of the existing Makefile
+echo "Makefile is up to date, not running mkmf"
+{%- endif %}
 
 # --- execute make ---
-make $executable
+{% if fc -%}
+# compile Fortran through isca/objcache.py, which caches and times each object.
+# the compiler is FC of the template, expanded by make e.g. $(F90).
+make -j {{ make_jobs }} FC='{{ fc }}' $executable
+{%- else -%}
+make -j {{ make_jobs }} $executable
+{%- endif %}
 if [ $? != 0 ]; then
     echo "ERROR: make failed for $executable"
     exit 1
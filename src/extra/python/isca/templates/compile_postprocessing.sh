@@ -0,0 +1,25 @@
+#!/usr/bin/env bash
+# Compiles the tool for combining distributed diagnostic output, if it hasn't
+# yet been done, and links it into the build directory.
+
+ppdir={{ srcdir }}/../postprocessing                      # path to directory containing the tool for combining distributed diagnostic output files
+execdir={{ execdir }}        # where code is compiled and executable is created
+
+# 1. Load the necessary tools into the environment
+module purge
+source {{ env_source }}
+module list
+
+# 2. compile the mppncombine tool if it hasn't yet been done.
+if [ ! -e "$ppdir/mppnccombine.x" ]; then
+  echo "Compiling postprocessing tools"
+  cd $ppdir
+  ./compile_mppn.sh
+  if [ $? != 0 ]; then
+      echo "ERROR: could not compile combine tool"
+      exit 1
+  fi
+fi
+
+ln -sf $ppdir/mppnccombine.x $execdir/mppnccombine.x
+ln -sf $ppdir/mppnccombine_run.sh $execdir/mppnccombine_run.sh
@@ -0,0 +1,12 @@
+#!/usr/bin/env bash
+{% for directive in directives -%}
+{{ directive }}
+{% endfor %}
+# Batch job wrapper for a single run.  The model output is written to job.out
+# and the exit code of the run to job.exitcode when the run has finished.
+
+cd {{ rundir }}
+
+bash {{ rundir }}/run.sh > {{ rundir }}/job.out 2>&1
+echo $? > {{ rundir }}/job.exitcode.tmp
+mv {{ rundir }}/job.exitcode.tmp {{ rundir }}/job.exitcode
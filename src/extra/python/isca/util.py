@@ -2,15 +2,20 @@ from contextlib import contextmanager
 import json
 import os
 from os.path import join as P
+import re
 import tarfile
 
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
 import xarray as xr
 import sh
 
 from isca import GFDL_BASE
-from isca.create_alert import disk_space_alert
+from isca.archive import remove_archive
+from isca.helpers import cp, rm
+from isca.monitor import ThroughputMonitor
+from isca.create_alert import disk_space_alert, predicted_disk_space_alert
 
 @contextmanager
 def exp_progress(exp, description='DAY {n}'):
@@ -57,22 +62,55 @@ def exp_progress(exp, description='DAY {n}'):
 
 
 @contextmanager
-def email_alerts(exp, email_address, limit=2000, cutoff=5):
+def exp_throughput(exp, window=5):
+    """Record the model throughput of each run in `throughput.csv` and emit
+    `run:throughput` events while the model is running.
+
+    Works with all calendars.  Use as a context manager.  e.g.
+    with exp_throughput(exp) as monitor:
+        exp.run(1)
+        print(monitor.days_per_hour)
+
+    """
+    monitor = ThroughputMonitor(exp, window=window)
+    yield monitor
+    monitor.detach()
+
+
+@contextmanager
+def email_alerts(exp, email_address, limit=None, cutoff=5, alert_runs=10, fallback_limit=2000):
     """A context manager for email alerts.
     e.g.
 
     with email_alerts(exp, 'myemail@example.com'):
         ...
         exp.run(...)
+
+    Before each run, the volume of output it will write is estimated with
+    `exp.estimate_output` for the number of cores of the run.  An email is
+    sent if there is only space left for `alert_runs` more runs, and the run
+    is stopped if it would leave less than `cutoff` Gb free.  The scratch directory is checked too, if one is used.
+    Pass `limit` (Gb) to alert on a fixed amount of free space instead.  This
+    is also done, with a limit of `fallback_limit` Gb, when the output can't
+    be estimated, e.g. for a diag_table file.
     """
     # add a handler to ready events
     @exp.on('run:ready')
     def check_disk_space(exp, month):
-        dir = exp.datadir
-        disk_space_alert(exp.datadir, exp.name, month, email_address, limit, cutoff)
+        estimate = None
+        if limit is None:
+            # the scratch space needed depends on the cores of the run, see `estimate_output`
+            estimate = exp.estimate_output() if exp.num_cores is None else exp.estimate_output(num_cores=exp.num_cores)
+        if estimate is None:
+            disk_space_alert(exp.datadir, exp.name, month, email_address,
+                             fallback_limit if limit is None else limit, cutoff)
+            return
+        predicted_disk_space_alert(exp.datadir, exp.name, month, email_address, estimate['run'], alert_runs, cutoff)
+        if exp.scratchdir is not None:
+            predicted_disk_space_alert(exp.scratchdir, exp.name, month, email_address, estimate['peak'], alert_runs, cutoff)
     yield
 
-    exp._events.remove(check_disk_space)
+    exp._events['run:ready'].remove(check_disk_space)
 
 def keep_only_certain_restart_files(exp, max_num_files, interval=12):
     try:
@@ -102,23 +140,45 @@ def clean_datadir(exp, run, keep_files=['input.nml', 'diag_table', 'field_table'
     for file in keep_files:
         filepath = P(outdir, 'run', file)
         if os.path.isfile(filepath):
-            sh.cp(filepath, P(outdir, file))
+            cp(filepath, P(outdir, file))
             exp.log.info('Copied %s to %s' % (file, outdir))
-    sh.rm('-r', P(outdir, 'run'))
+    rm(P(outdir, 'run'))
     exp.log.info('Deleted %s directory' % P(outdir, 'run'))
 
 def delete_all_restarts(exp, exceptions=None):
     """Remove the restart files for a given experiment except those given.
 
-    e.g. remove_restarts(exp, [3,6,9,12])"""
-    if exceptions:
-        exceptions = [exp.restartfmt % i for i in exceptions]
-    all_restarts = os.listdir(exp.restartdir)
+    e.g. remove_restarts(exp, [3,6,9,12])
+
+    Only restart archives (res0001.tar.gz etc.) are removed, and their entries
+    are removed from the restart catalog."""
+    exceptions = [os.path.basename(exp.get_restart_file(i)) for i in exceptions or []]
+    all_restarts = [file for file in os.listdir(exp.restartdir) if re.match(r'res\d+', file)]
     restarts_to_remove = [file for file in all_restarts if file not in exceptions]
     for file in restarts_to_remove:
-        sh.rm(P(exp.restartdir, file))
+        remove_archive(P(exp.restartdir, file))
+        exp.restart_catalog.remove(file)
         exp.log.info('Deleted restart file %s' % file)
 
+def run_timings(exp):
+    """Collect the per-phase timings of every completed run of an experiment.
+
+    Returns a pandas DataFrame indexed by run number, with one column of
+    seconds for each phase in `Experiment.RUN_PHASES` plus the total.
+    The data is read from the `timings.json` file written to each run's output
+    directory.  For a per-experiment summary use e.g. `run_timings(exp).describe()`.
+    """
+    records = {}
+    for run in sorted(os.listdir(exp.datadir)) if os.path.isdir(exp.datadir) else []:
+        filename = P(exp.datadir, run, 'timings.json')
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                record = json.load(f)
+            records[record['run']] = dict(record['phases'], total=record['total'])
+    columns = [p for p in exp.RUN_PHASES] + ['total']
+    df = pd.DataFrame.from_dict(records, orient='index').reindex(columns=columns)
+    df.index.name = 'run'
+    return df.sort_index()
 
 
 
@@ -0,0 +1,152 @@
+"""Check out commits of a repository as worktrees of a shared mirror.
+
+A CodeBase created with `from_repo` needs the source at one commit.  Rather
+than cloning the whole repository for every commit, the WorktreePool keeps one
+bare mirror of each repository under `GFDL_WORK/codebase/mirrors` and adds a
+git worktree for each commit that is checked out.  A worktree shares the
+objects of the mirror, so it costs only the size of the checked out files.
+
+The mirror is cloned once.  It is fetched again when a commit that isn't in
+it is asked for, and always for a branch, tag or `HEAD`, which may have moved.
+The pool keeps at most `max_worktrees` worktrees; when there are more, the
+least recently used are removed.  A worktree is never removed while a process
+holds a `lease` on it, as every CodeBase does for its lifetime.  A removed
+worktree is checked out again when its CodeBase is next created.
+
+    pool = WorktreePool()
+    pool.add('https://github.com/ExeClim/Isca', 'a1b2c3d', '/work/codebase/isca-a1b2c3d/code')
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+import sh
+
+from isca import GFDL_WORK
+from isca.helpers import git, file_lock, url_to_folder, rm, mkdir
+from isca.loghandler import Logger
+
+P = os.path.join
+
+FULL_SHA_RE = re.compile(r'^[0-9a-f]{40}$')
+
+
+class WorktreePool(Logger):
+    """Worktrees of bare mirror repositories, removed least recently used first."""
+    def __init__(self, pooldir=P(GFDL_WORK, 'codebase', 'mirrors'), max_worktrees=20):
+        self.pooldir = pooldir
+        self.max_worktrees = max_worktrees
+        self.index_file = P(pooldir, 'worktrees.json')
+
+    def mirror_path(self, repo):
+        return P(self.pooldir, url_to_folder(repo) + '.git')
+
+    def _lock(self):
+        # held while changing any mirror or the index
+        return file_lock(P(self.pooldir, 'pool.lock'))
+
+    def _read_index(self):
+        try:
+            with open(self.index_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        fd, tmp = tempfile.mkstemp(dir=self.pooldir, prefix='.worktrees')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_file)
+
+    def update_mirror(self, repo, commit=None):
+        """Clone the mirror of `repo`, or fetch into it if `commit` isn't there
+        yet or isn't a full commit hash.  Returns the path of the mirror."""
+        mirror = self.mirror_path(repo)
+        mirror_git = git.bake('--git-dir=' + mirror)
+        if not os.path.isdir(mirror):
+            self.log.info('Creating a mirror of %r' % repo)
+            git.clone('--mirror', repo, mirror)
+        elif commit is not None and (not FULL_SHA_RE.match(commit) or not self._has_commit(mirror_git, commit)):
+            self.log.info('Fetching %r into the mirror' % repo)
+            mirror_git.fetch('--prune', 'origin')
+        return mirror
+
+    def _has_commit(self, mirror_git, commit):
+        try:
+            mirror_git('cat-file', '-e', commit + '^{commit}')
+        except sh.ErrorReturnCode:
+            return False
+        return True
+
+    def add(self, repo, commit, path):
+        """Check out `commit` of `repo` as a worktree at `path`."""
+        with self._lock():
+            mirror = self.update_mirror(repo, commit)
+            mirror_git = git.bake('--git-dir=' + mirror)
+            # forget worktrees whose directories have been deleted
+            mirror_git.worktree('prune')
+            self.log.info('Checking out commit %r as a worktree at %r' % (commit, path))
+            mirror_git.worktree('add', '--detach', path, commit)
+            index = self._read_index()
+            index[path] = {'repo': repo, 'commit': commit, 'last_used': time.time()}
+            self._gc(index, keep=path)
+            self._write_index(index)
+
+    def touch(self, path):
+        """Mark the worktree at `path` as just used."""
+        with self._lock():
+            index = self._read_index()
+            if path in index:
+                index[path]['last_used'] = time.time()
+                self._write_index(index)
+
+    def _lease_file(self, path):
+        return P(self.pooldir, 'leases', hashlib.sha1(path.encode()).hexdigest())
+
+    def lease(self, path):
+        """Keep the worktree at `path` from being removed until the returned
+        file is closed, or this process exits."""
+        filename = self._lease_file(path)
+        mkdir(os.path.dirname(filename))
+        f = open(filename, 'a')
+        fcntl.flock(f, fcntl.LOCK_SH)
+        return f
+
+    def gc(self):
+        """Remove the least recently used worktrees until at most `max_worktrees` remain."""
+        with self._lock():
+            index = self._read_index()
+            self._gc(index)
+            self._write_index(index)
+
+    def _gc(self, index, keep=None):
+        for path in [p for p in index if not os.path.isdir(p)]:
+            del index[path]
+        by_age = sorted((p for p in index if p != keep), key=lambda p: index[p]['last_used'])
+        while len(index) > self.max_worktrees and by_age:
+            path = by_age.pop(0)
+            filename = self._lease_file(path)
+            mkdir(os.path.dirname(filename))
+            with open(filename, 'a') as f:
+                # fails while any process holds a lease.  Held during the removal,
+                # so that a new lease waits and then finds the worktree gone.
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue
+                self.remove(index.pop(path)['repo'], path)
+
+    def remove(self, repo, path):
+        """Remove the worktree at `path`."""
+        self.log.info('Removing worktree %r' % path)
+        mirror_git = git.bake('--git-dir=' + self.mirror_path(repo))
+        try:
+            mirror_git.worktree('remove', '--force', path)
+        except sh.ErrorReturnCode:
+            if os.path.exists(path):
+                rm(path)
+            mirror_git.worktree('prune')
@@ -23,6 +23,12 @@ setup(name='Isca',
         'f90nml',
         'numpy',
         'pandas',
-        'xarray'
-      ]
+        'xarray',
+        'scipy',
+        'netCDF4'
+      ],
+      extras_require={
+        # the 'zstd' restart codec, see isca/archive.py
+        'zstd': ['zstandard'],
+      }
      )
\ No newline at end of file
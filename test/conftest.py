@@ -0,0 +1,81 @@
+"""Settings shared by the tests.
+
+isca reads GFDL_BASE, GFDL_WORK, GFDL_DATA and GFDL_ENV when it is imported.
+When they are not set, as on a machine without the model, they point to a
+temporary directory with an empty environment file, so that the tests that
+neither compile nor run the model can still be run.
+"""
+import os
+import tempfile
+import types
+
+import pytest
+
+if 'GFDL_BASE' not in os.environ:
+    _root = tempfile.mkdtemp(prefix='isca_test_')
+    os.environ['GFDL_BASE'] = os.path.join(_root, 'base')
+    os.environ.setdefault('GFDL_WORK', os.path.join(_root, 'work'))
+    os.environ.setdefault('GFDL_DATA', os.path.join(_root, 'data'))
+    os.environ['GFDL_ENV'] = 'test'
+    os.makedirs(os.path.join(os.environ['GFDL_BASE'], 'src', 'extra', 'env'))
+    open(os.path.join(os.environ['GFDL_BASE'], 'src', 'extra', 'env', 'test'), 'w').close()
+
+
+@pytest.fixture
+def exp(tmp_path):
+    """An Experiment with its workdir and data directory in `tmp_path`, and a
+    codebase that is never compiled."""
+    from isca.experiment import Experiment
+    codebase = types.SimpleNamespace(srcdir=str(tmp_path / 'src'), name='dry')
+    return Experiment('test_experiment', codebase, workbase=str(tmp_path / 'work'), database=str(tmp_path / 'data'))
+
+
+@pytest.fixture
+def local_git(monkeypatch):
+    """Run git only in the code directory of a CodeBase, as GFDL_BASE isn't a
+    git repository when testing."""
+    from isca import codebase
+    from isca.helpers import git
+    monkeypatch.setattr(codebase, 'gfdl_base_commit', lambda: 'base')
+    monkeypatch.setattr(codebase, 'git_run_in_directory', lambda base, directory: git.bake('-C', directory))
+
+
+@pytest.fixture
+def codebase(tmp_path, local_git):
+    """A DryCodeBase of a source directory in `tmp_path` with one source file
+    and a ready built mppnccombine.x, using a build cache in `tmp_path`.
+    Running make would fail, so compile only from the build cache."""
+    from isca.buildcache import BuildCache
+    from isca.codebase import DryCodeBase
+    source = tmp_path / 'source'
+    files = {
+        'src/extra/python/__init__.py': '',
+        'src/extra/model/dry/path_names': 'atmos/model.F90\n',
+        'src/atmos/model.F90': 'program model\nend program\n',
+        'postprocessing/mppnccombine.x': '',
+        'postprocessing/mppnccombine_run.sh': '',
+        'postprocessing/compile_mppn.sh': 'exit 1\n',
+    }
+    for name, text in files.items():
+        (source / name).parent.mkdir(parents=True, exist_ok=True)
+        (source / name).write_text(text)
+    cb = DryCodeBase.from_directory(str(source), storedir=str(tmp_path / 'codebase'))
+    cb.build_cache = BuildCache(str(tmp_path / 'buildcache'))
+    cb.object_cache = None
+    return cb
+
+
+@pytest.fixture
+def cache_executable(codebase, tmp_path):
+    """A function that adds an executable of `codebase`, built with an mkmf
+    template, to its build cache, so that compiling doesn't run make."""
+    from isca import get_env_file
+    def cache(template='mkmf.template.ia64', other_flags=''):
+        codebase.path_names = codebase.read_path_names(
+            os.path.join(codebase.srcdir, 'extra', 'model', codebase.name, 'path_names'))
+        key = codebase.build_key(get_env_file(), ' '.join(codebase.compile_flags), template, other_flags)
+        built = tmp_path / 'built' / key
+        built.mkdir(parents=True)
+        (built / codebase.executable_name).write_text('built with ' + template)
+        codebase.build_cache.add(key, str(built / codebase.executable_name))
+    return cache
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from isca.archive import CODECS, get_codec, detect_codec, replacing
+
+
+def make_restarts(directory, value):
+    os.makedirs(directory)
+    for name in ('coupler.res', 'atmosphere.res.nc'):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write('%s %s\n' % (name, value))
+
+
+def read_restarts(directory):
+    contents = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name)) as f:
+            contents[name] = f.read()
+    return contents
+
+
+def available_codec(name):
+    codec = CODECS[name]()
+    if not codec.is_available():
+        pytest.skip('restart codec %r is not available' % name)
+    return codec
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_round_trip(tmp_path, name):
+    codec = available_codec(name)
+    make_restarts(str(tmp_path / 'RESTART'), 1)
+    archive_file = str(tmp_path / ('res0001' + codec.extension))
+    with replacing(archive_file) as tmp:
+        codec.archive(tmp, str(tmp_path / 'RESTART'))
+    detect_codec(archive_file).extract(archive_file, str(tmp_path / 'INPUT'))
+    assert read_restarts(str(tmp_path / 'INPUT')) == read_restarts(str(tmp_path / 'RESTART'))
+
+
+@pytest.mark.parametrize('name', sorted(CODECS))
+def test_overwrite(tmp_path, name):
+    codec = available_codec(name)
+    archive_file = str(tmp_path / ('res0001' + codec.extension))
+    for value in (1, 2):
+        restarts = str(tmp_path / ('RESTART%d' % value))
+        make_restarts(restarts, value)
+        with replacing(archive_file) as tmp:
+            codec.archive(tmp, restarts)
+    detect_codec(archive_file).extract(archive_file, str(tmp_path / 'INPUT'))
+    assert read_restarts(str(tmp_path / 'INPUT')) == read_restarts(str(tmp_path / 'RESTART2'))
+    # nothing is left beside the archive
+    assert not [n for n in os.listdir(str(tmp_path)) if n.startswith('.archive')]
+
+
+def test_failed_archive_keeps_existing(tmp_path):
+    archive_file = str(tmp_path / 'res0001.tar')
+    make_restarts(str(tmp_path / 'RESTART'), 1)
+    with replacing(archive_file) as tmp:
+        get_codec('tar').archive(tmp, str(tmp_path / 'RESTART'))
+    with pytest.raises(IOError):
+        with replacing(archive_file) as tmp:
+            raise IOError('disk full')
+    detect_codec(archive_file).extract(archive_file, str(tmp_path / 'INPUT'))
+    assert read_restarts(str(tmp_path / 'INPUT')) == read_restarts(str(tmp_path / 'RESTART'))
+
+
+@pytest.mark.parametrize('name', ['dir', 'tar', 'gz'])
+def test_repeated_run_overwrites_restart_archive(exp, tmp_path, name):
+    exp.restart_codec = name
+    os.makedirs(exp.restartdir)
+    archive_file = os.path.join(exp.restartdir, 'res0002' + CODECS[name].extension)
+    for value in (1, 2):
+        restarts = str(tmp_path / ('RESTART%d' % value))
+        make_restarts(restarts, value)
+        exp.make_restart_archive(archive_file, restarts)
+    detect_codec(archive_file).extract(archive_file, str(tmp_path / 'INPUT'))
+    assert read_restarts(str(tmp_path / 'INPUT')) == read_restarts(str(tmp_path / 'RESTART2'))
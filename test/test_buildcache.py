@@ -0,0 +1,69 @@
+import os
+import time
+
+from isca.buildcache import BuildCache
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_key(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache'))
+    source = str(tmp_path / 'atmos.F90')
+    write(source, 'module atmos\nend module\n')
+    sources = {'atmos/atmos.F90': source}
+    key = cache.key(sources, '-O2', 'env')
+    assert cache.key(sources, '-O2', 'env') == key
+    # the same content with a new modification time
+    os.utime(source, (time.time() + 10, time.time() + 10))
+    assert cache.key(sources, '-O2', 'env') == key
+    assert cache.key(sources, '-O3', 'env') != key
+    assert cache.key(sources, '-O2', 'other env') != key
+    assert cache.key({'atmos/other.F90': source}, '-O2', 'env') != key
+    write(source, 'module atmos\n  implicit none\nend module\n')
+    assert cache.key(sources, '-O2', 'env') != key
+
+
+def test_get_and_add(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache'))
+    executable = str(tmp_path / 'isca.x')
+    write(executable, 'binary')
+    assert cache.get('abc', 'isca.x') is None
+    cached = cache.add('abc', executable)
+    assert cache.get('abc', 'isca.x') == cached
+    with open(cached) as f:
+        assert f.read() == 'binary'
+    # shared executables are read only
+    assert not os.stat(cached).st_mode & 0o222
+
+
+def test_prune_least_recently_used(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache'), max_entries=2)
+    executable = str(tmp_path / 'isca.x')
+    write(executable, 'binary')
+    now = time.time()
+    for i, key in enumerate(['first', 'second']):
+        cache.add(key, executable)
+        os.utime(os.path.join(cache.objectdir, key), (now - 100 + i, now - 100 + i))
+    # using the first makes the second the least recently used
+    assert cache.get('first', 'isca.x') is not None
+    cache.add('third', executable)
+    assert cache.get('second', 'isca.x') is None
+    assert cache.get('first', 'isca.x') is not None
+    assert cache.get('third', 'isca.x') is not None
+    assert sorted(os.listdir(cache.objectdir)) == ['first', 'third']
+
+
+def test_cache_hit_links_postprocessing(codebase, cache_executable):
+    cache_executable()
+    assert not os.path.exists(codebase.builddir)
+    codebase.compile()
+    with open(codebase.executable_fullpath) as f:
+        assert f.read() == 'built with mkmf.template.ia64'
+    # make wasn't run
+    assert not os.path.exists(os.path.join(codebase.builddir, 'Makefile'))
+    ppdir = os.path.join(codebase.codedir, 'postprocessing')
+    for name in ('mppnccombine.x', 'mppnccombine_run.sh'):
+        assert os.path.samefile(os.path.join(codebase.builddir, name), os.path.join(ppdir, name))
@@ -0,0 +1,79 @@
+import json
+import os
+
+from isca.buildprofile import critical_path, makefile_dependencies, profile_report, read_profile_log
+
+# a.o <- b.o <- d.o and a.o <- c.o <- d.o: the path through c.o is the longer
+DEPS = {'d.o': ['b.o', 'c.o'], 'b.o': ['a.o'], 'c.o': ['a.o'], 'a.o': []}
+SECONDS = {'a.o': 1.0, 'b.o': 2.0, 'c.o': 5.0, 'd.o': 1.5}
+
+MAKEFILE = """\
+FFLAGS = -O2
+
+a.o: ./a.F90
+\t$(FC) $(FFLAGS) -c ./a.F90
+b.o: ./b.F90 a.o
+\t$(FC) $(FFLAGS) -c ./b.F90
+c.o: ./c.F90 a.o inc.h
+\t$(FC) $(FFLAGS) -c ./c.F90
+d.o: ./d.F90 b.o \\
+\tc.o
+\t$(FC) $(FFLAGS) -c ./d.F90
+"""
+
+
+def test_critical_path():
+    path, seconds = critical_path(SECONDS, DEPS)
+    assert path == ['a.o', 'c.o', 'd.o']
+    assert seconds == 7.5
+
+
+def test_critical_path_unlisted_objects_take_no_time():
+    path, seconds = critical_path({'b.o': 2.0, 'd.o': 0.5}, DEPS)
+    assert path == ['a.o', 'b.o', 'd.o']
+    assert seconds == 2.5
+    assert critical_path({}, {}) == ([], 0.0)
+
+
+def test_critical_path_ignores_cycles():
+    path, seconds = critical_path({'a.o': 1.0, 'b.o': 2.0}, {'a.o': ['b.o'], 'b.o': ['a.o']})
+    assert seconds == 3.0
+    assert sorted(path) == ['a.o', 'b.o']
+
+
+def test_makefile_dependencies(tmp_path):
+    makefile = tmp_path / 'Makefile'
+    makefile.write_text(MAKEFILE)
+    assert makefile_dependencies(str(makefile)) == DEPS
+
+
+def write_log(builddir, records):
+    with open(os.path.join(builddir, 'compile_profile.log'), 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.write('not a record\n')
+
+
+def test_profile_report(tmp_path):
+    builddir = str(tmp_path)
+    (tmp_path / 'Makefile').write_text(MAKEFILE)
+    start = 1000.0
+    records = []
+    for obj in ('a.o', 'b.o', 'c.o', 'd.o'):
+        records.append({'object': obj, 'start': start, 'end': start + SECONDS[obj], 'cached': obj == 'b.o'})
+        start += SECONDS[obj]
+    # an object compiled twice is counted once, at its last compile
+    write_log(builddir, [dict(records[0], end=records[0]['start'] + 9.0)] + records)
+
+    units = read_profile_log(os.path.join(builddir, 'compile_profile.log'))
+    assert [u['object'] for u in units] == ['a.o', 'b.o', 'c.o', 'd.o']
+    assert units[0]['seconds'] == 1.0
+
+    report = profile_report(builddir, jobs=4)
+    assert report['critical_path'] == ['a.o', 'c.o', 'd.o']
+    assert report['critical_path_seconds'] == 7.5
+    assert report['compile_seconds'] == 9.5
+    assert report['wall_seconds'] == 9.5
+    assert report['cache_hits'] == 1
+    with open(os.path.join(builddir, 'compile_profile.json')) as f:
+        assert json.load(f) == report
@@ -0,0 +1,167 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from isca.campaign import CampaignState, RunInProgressError, controller_alive
+
+
+def set_running(state, run, controller, heartbeat):
+    state.db.execute('INSERT OR REPLACE INTO runs (run, status, controller, started, heartbeat) VALUES (?, ?, ?, ?, ?)',
+                     (run, 'running', controller, heartbeat, heartbeat))
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def test_claim_and_complete(tmp_path):
+    state = CampaignState(str(tmp_path / 'campaign.db'))
+    assert state.status(1) is None
+    state.claim(1, 'abc')
+    assert state.status(1) == 'running'
+    assert state.get(1)['namelist_hash'] == 'abc'
+    state.complete(1, {'total': 1.0})
+    assert state.status(1) == 'completed'
+    state.claim(2)
+    state.fail(2, 'exit code 1')
+    assert state.status(2) == 'failed'
+
+
+def test_claim_held_by_live_controller(tmp_path):
+    state = CampaignState(str(tmp_path / 'campaign.db'))
+    set_running(state, 1, 'otherhost:1234', time.time())
+    assert state.status(1) == 'running'
+    with pytest.raises(RunInProgressError):
+        state.claim(1)
+
+
+def test_stale_heartbeat_on_other_host(tmp_path):
+    state = CampaignState(str(tmp_path / 'campaign.db'), stale_after=60)
+    set_running(state, 1, 'otherhost:1234', time.time() - 120)
+    assert state.status(1) == 'crashed'
+    state.claim(1)
+    assert state.get(1)['controller'] == '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def test_dead_controller_on_this_host(tmp_path):
+    state = CampaignState(str(tmp_path / 'campaign.db'))
+    set_running(state, 1, '%s:%d' % (socket.gethostname(), dead_pid()), time.time())
+    assert state.status(1) == 'crashed'
+    state.claim(1)
+
+
+def test_force_claim(tmp_path):
+    state = CampaignState(str(tmp_path / 'campaign.db'))
+    set_running(state, 1, 'otherhost:1234', time.time())
+    state.claim(1, force=True)
+    assert state.status(1) == 'running'
+
+
+def test_controller_alive():
+    assert controller_alive('otherhost:1')
+    assert controller_alive('otherhost:1', time.time(), 60)
+    assert not controller_alive('otherhost:1', time.time() - 61, 60)
+    assert controller_alive('%s:%d' % (socket.gethostname(), os.getpid()))
+
+
+def test_heartbeat_from_claim_to_complete(tmp_path):
+    state = CampaignState(str(tmp_path / 'campaign.db'), heartbeat_interval=0.01)
+    state.claim(1)
+    state.claim(2)
+    before = state.get(1)['heartbeat']
+    time.sleep(0.1)
+    assert state.get(1)['heartbeat'] > before
+    state.complete(1)
+    state.fail(2)
+    time.sleep(0.05)
+    finished = state.get(1)['heartbeat'], state.get(2)['heartbeat']
+    time.sleep(0.05)
+    assert (state.get(1)['heartbeat'], state.get(2)['heartbeat']) == finished
+    assert state._beating is None
+
+
+def test_no_heartbeat_for_run_taken_over(tmp_path):
+    state = CampaignState(str(tmp_path / 'campaign.db'), heartbeat_interval=0.01)
+    state.claim(1)
+    set_running(state, 1, 'otherhost:1234', 1000.0)
+    time.sleep(0.05)
+    assert state.get(1)['heartbeat'] == 1000.0
+    state.release(1, state.get(1))
+
+
+def test_reopen_after_removal(tmp_path):
+    datadir = tmp_path / 'data'
+    state = CampaignState(str(datadir / 'campaign.db'))
+    state.claim(1)
+    state.complete(1)
+    for name in os.listdir(str(datadir)):
+        os.remove(str(datadir / name))
+    os.rmdir(str(datadir))
+    assert state.status(1) is None
+    state.claim(1)
+    assert state.status(1) == 'running'
+
+
+def test_heartbeat_column_added_to_old_database(tmp_path):
+    import sqlite3
+    filename = str(tmp_path / 'campaign.db')
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE runs (run INTEGER PRIMARY KEY, status TEXT NOT NULL, controller TEXT, started REAL, '
+               'finished REAL, restart_file TEXT, namelist_hash TEXT, timings TEXT, error TEXT)')
+    db.execute("INSERT INTO runs (run, status, controller) VALUES (1, 'completed', 'otherhost:1')")
+    db.commit()
+    db.close()
+    state = CampaignState(filename)
+    assert state.status(1) == 'completed'
+    state.claim(2)
+
+
+def test_resume_starts_at_first_incomplete_run(exp):
+    runs = []
+    exp.run = lambda i, **kwargs: runs.append((i, kwargs['overwrite_data'], kwargs['force']))
+    for i in (1, 2):
+        exp.state.claim(i)
+        exp.state.complete(i)
+    exp.state.claim(3)
+    exp.state.fail(3)
+
+    assert exp.resume(2)
+    assert runs == []
+    exp.resume(4, force=True)
+    # the failed run is performed again over its output
+    assert runs == [(3, True, True), (4, False, True)]
+    del runs[:]
+    exp.resume(4, overwrite_data=True)
+    assert runs == [(3, True, False), (4, True, False)]
+
+
+def test_resume_refuses_run_held_by_another_controller(exp):
+    set_running(exp.state, 1, 'otherhost:1234', time.time())
+    with pytest.raises(RunInProgressError):
+        exp._prepare_run(1, exp.rundir, use_restart=False)
+
+
+def test_rm_datadir_then_run_again(exp):
+    exp.state.claim(1)
+    exp.state.complete(1)
+    exp.rm_datadir()
+    assert exp.state.status(1) is None
+    exp.state.claim(1)
+
+
+def test_prepare_run_fails_run_if_output_cannot_be_removed(exp, monkeypatch):
+    from isca import experiment
+    def rm(paths):
+        raise PermissionError('Permission denied: %r' % paths)
+    os.makedirs(exp.get_outputdir(1))
+    monkeypatch.setattr(experiment, 'rm', rm)
+    with pytest.raises(PermissionError):
+        exp._prepare_run(1, exp.rundir, use_restart=False, overwrite_data=True)
+    assert exp.state.status(1) == 'failed'
+    assert 1 not in exp.state._held
@@ -0,0 +1,48 @@
+import os
+
+from isca.util import delete_all_restarts
+
+
+def write_restart(exp, tmp_path, run):
+    restarts = str(tmp_path / ('RESTART%d' % run))
+    os.makedirs(restarts)
+    with open(os.path.join(restarts, 'coupler.res'), 'w') as f:
+        f.write('     0        (Calendar: no_calendar=0, thirty_day_months=1, julian=2, gregorian=3, noleap=4)\n'
+                '     0     0     0     0     0     0        Model start time:   year, month, day, hour, minute, second\n'
+                '     0     0  %4d     0     0     0        Current model time: year, month, day, hour, minute, second\n'
+                % (30 * run))
+    exp.make_restart_archive(exp.get_restart_file(run), restarts)
+
+
+def test_delete_all_restarts_keeps_catalog(exp, tmp_path):
+    os.makedirs(exp.restartdir)
+    for run in (1, 2, 3):
+        write_restart(exp, tmp_path, run)
+    assert [e['run'] for e in exp.restart_catalog.entries()] == [1, 2, 3]
+    assert exp.restart_catalog.find(days=60)['run'] == 2
+
+    delete_all_restarts(exp, [2])
+    assert sorted(os.listdir(exp.restartdir)) == sorted([os.path.basename(exp.get_restart_file(2)), 'catalog.json'])
+    assert [e['run'] for e in exp.restart_catalog.entries()] == [2]
+    assert set(exp.restart_catalog._read()) == {os.path.basename(exp.get_restart_file(2))}
+
+    delete_all_restarts(exp)
+    assert os.listdir(exp.restartdir) == ['catalog.json']
+    assert exp.restart_catalog.entries() == []
+
+
+def test_malformed_time_file_is_catalogued_without_a_date(exp, tmp_path):
+    os.makedirs(exp.restartdir)
+    restarts = str(tmp_path / 'RESTART')
+    os.makedirs(restarts)
+    # written by a run that was cut short
+    with open(os.path.join(restarts, 'coupler.res'), 'w') as f:
+        f.write('     3        (Calendar: no_calendar=0, thirty_day_months=1, julian=2, gregorian=3, noleap=4)\n'
+                '     2000     1     1     0     0     0        Model start time:   year, month, day, hour, minute, second\n'
+                '     2000     1  \n')
+    archive_file = exp.get_restart_file(1)
+    exp.make_restart_archive(archive_file, restarts)
+    assert os.path.exists(archive_file)
+    entry, = exp.restart_catalog.entries()
+    assert entry['run'] == 1
+    assert 'date' not in entry and 'days' not in entry
@@ -0,0 +1,80 @@
+import os
+import subprocess
+
+import pytest
+
+from isca.codebase import CodeBase
+
+
+class SourceCodeBase(CodeBase):
+    executable_name = 'test.x'
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def make_repo(path, source):
+    os.makedirs(os.path.join(path, 'src', 'extra', 'python'))
+    write(os.path.join(path, 'src', 'model.f90'), source)
+    for args in (['init', '-q'], ['add', '.'], ['-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                                                 'commit', '-q', '-m', 'first']):
+        subprocess.check_call(['git', '-C', path] + args)
+    return path
+
+
+def commit(path, message):
+    subprocess.check_call(['git', '-C', path, '-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                           'commit', '-q', '-a', '-m', message])
+    return subprocess.check_output(['git', '-C', path, 'rev-parse', 'HEAD']).decode('utf8').strip()
+
+
+@pytest.fixture
+def reads(monkeypatch, local_git):
+    """A list of the times git is run to read the source control status."""
+    calls = []
+    read = CodeBase._read_source_control_status
+    def _read_source_control_status(self):
+        calls.append(self.codedir)
+        return read(self)
+    monkeypatch.setattr(CodeBase, '_read_source_control_status', _read_source_control_status)
+    return calls
+
+
+def test_source_control_status_cached(tmp_path, reads):
+    repo = make_repo(str(tmp_path / 'repo'), 'program model\nend program\n')
+    cb = SourceCodeBase.from_directory(repo, storedir=str(tmp_path / 'codebase'))
+    status = cb.source_control_status
+    assert cb.source_control_status == status
+    cb.write_source_control_status(str(tmp_path / 'git_hash_used.txt'))
+    assert len(reads) == 1
+    assert 'dirty' not in status
+
+
+def test_source_control_status_invalidated(tmp_path, reads):
+    repo = make_repo(str(tmp_path / 'repo'), 'program model\nend program\n')
+    cb = SourceCodeBase.from_directory(repo, storedir=str(tmp_path / 'codebase'))
+    cb.source_control_status
+
+    # a commit
+    write(os.path.join(repo, 'src', 'model.f90'), 'program model\n  print *, 1\nend program\n')
+    head = commit(repo, 'second')
+    assert head in cb.source_control_status
+    assert len(reads) == 2
+
+    # an edit to the working tree
+    write(os.path.join(repo, 'src', 'model.f90'), 'program model\n  print *, 2\nend program\n')
+    status = cb.source_control_status
+    assert 'dirty' in status and 'print *, 2' in status
+    assert len(reads) == 3
+
+    # the codebase is pointed at another directory
+    other = make_repo(str(tmp_path / 'other'), 'program other\nend program\n')
+    other_head = subprocess.check_output(['git', '-C', other, 'rev-parse', 'HEAD']).decode('utf8').strip()
+    cb.link_source_to(other)
+    status = cb.source_control_status
+    assert other_head in status and 'dirty' not in status
+    assert len(reads) == 4
+    assert cb.source_control_status == status
+    assert len(reads) == 4
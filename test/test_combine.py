@@ -0,0 +1,160 @@
+import os
+
+import netCDF4
+import numpy as np
+import pytest
+from scipy.io import netcdf_file
+
+from isca.combine import CombineError, combine, find_fragments
+
+NLON, NLAT, NLEV, NRECS = 8, 6, 3, 2
+
+
+def field(nrecs=NRECS):
+    return np.arange(nrecs * NLEV * NLAT * NLON, dtype='f4').reshape(nrecs, NLEV, NLAT, NLON)
+
+
+def write_fragments(filename, splits, missing_value=None):
+    """Write `field()` split in latitude at `splits`, as FMS does on more than one core."""
+    data = field()
+    bounds = [0] + list(splits) + [NLAT]
+    for n, (lat0, lat1) in enumerate(zip(bounds[:-1], bounds[1:])):
+        with netcdf_file('%s.%04d' % (filename, n), 'w') as f:
+            f.filename = os.path.basename(filename) + '.%04d' % n
+            f.NumFilesInSet = len(bounds) - 1
+            f.createDimension('time', None)
+            f.createDimension('pfull', NLEV)
+            f.createDimension('lat', lat1 - lat0)
+            f.createDimension('lon', NLON)
+            lat = f.createVariable('lat', 'd', ('lat',))
+            lat[:] = np.arange(lat0, lat1)
+            lat.units = 'degrees_N'
+            lat.domain_decomposition = np.array([1, NLAT, lat0 + 1, lat1], dtype='i4')
+            lon = f.createVariable('lon', 'd', ('lon',))
+            lon[:] = np.arange(NLON)
+            pfull = f.createVariable('pfull', 'd', ('pfull',))
+            pfull[:] = np.arange(NLEV)
+            time = f.createVariable('time', 'd', ('time',))
+            time[:] = np.arange(NRECS)
+            temp = f.createVariable('temp', 'f', ('time', 'pfull', 'lat', 'lon'))
+            temp[:] = data[:, :, lat0:lat1]
+            temp.units = 'K'
+            if missing_value is not None:
+                temp.missing_value = np.float32(missing_value)
+
+
+def test_combine(tmp_path):
+    filename = str(tmp_path / 'atmos_daily.nc')
+    write_fragments(filename, [2, 3])
+    assert len(find_fragments(filename)) == 3
+    combine(filename, remove_fragments=True)
+    assert find_fragments(filename) == []
+
+    with netcdf_file(filename, 'r', mmap=False) as f:
+        assert f.dimensions['lat'] == NLAT
+        assert f.variables['time'].shape == (NRECS,)
+        np.testing.assert_array_equal(f.variables['lat'][:], np.arange(NLAT))
+        np.testing.assert_array_equal(f.variables['lon'][:], np.arange(NLON))
+        np.testing.assert_array_equal(f.variables['temp'][:], field())
+        assert f.variables['temp'].units == b'K'
+        assert not hasattr(f.variables['lat'], 'domain_decomposition')
+        assert not hasattr(f, 'NumFilesInSet')
+        assert f.filename == b'atmos_daily.nc'
+
+
+def test_combine_given_fragments(tmp_path):
+    filename = str(tmp_path / 'atmos_daily.nc')
+    write_fragments(filename, [3])
+    fragments = find_fragments(filename)
+    output = str(tmp_path / 'combined.nc')
+    combine(output, fragments)
+    assert find_fragments(filename) == fragments
+    with netcdf_file(output, 'r', mmap=False) as f:
+        np.testing.assert_array_equal(f.variables['temp'][:], field())
+
+
+def test_combine_without_fragments(tmp_path):
+    with pytest.raises(CombineError):
+        combine(str(tmp_path / 'atmos_daily.nc'))
+
+
+@pytest.mark.parametrize('missing_value', [None, -1e10])
+def test_uncovered_region_is_filled(tmp_path, missing_value):
+    filename = str(tmp_path / 'atmos_daily.nc')
+    write_fragments(filename, [2, 3], missing_value)
+    # the processor of latitude 2 wrote no output, as with a masked domain
+    os.remove(filename + '.0001')
+    combine(filename)
+
+    fill = netCDF4.default_fillvals['f4'] if missing_value is None else missing_value
+    with netcdf_file(filename, 'r', mmap=False) as f:
+        temp = f.variables['temp'][:]
+        np.testing.assert_array_equal(temp[:, :, 2], np.float32(fill))
+        np.testing.assert_array_equal(np.delete(temp, 2, axis=2), np.delete(field(), 2, axis=2))
+        assert f.variables['lat'][2] == netCDF4.default_fillvals['f8']
+
+
+@pytest.fixture
+def multicore_run(exp, tmp_path):
+    """`exp`, combining with the python combiner, and the run directory of a
+    run on several cores with three diagnostic files and a restart file."""
+    exp.combine_tool = 'python'
+    exp.combine_workers = 3
+    exp.codebase.write_source_control_status = lambda filename: open(filename, 'w').close()
+    exp.field_table_file = str(tmp_path / 'field_table')
+    open(exp.field_table_file, 'w').close()
+    rundir = tmp_path / 'run'
+    os.makedirs(str(rundir / 'RESTART'))
+    for name in ('atmos_daily', 'atmos_monthly', 'atmos_4xdaily'):
+        exp.diag_table.add_file(name, 1, 'days')
+        write_fragments(str(rundir / (name + '.nc')), [2, 4])
+    write_fragments(str(rundir / 'RESTART' / 'atmos_model.res.nc'), [3])
+    return str(rundir)
+
+
+def test_combine_output(multicore_run, exp):
+    combined = []
+    exp.on('run:combined', lambda e: combined.append(e))
+    exp.state.claim(1)
+    os.makedirs(exp.restartdir)
+    exp._finish_run(1, multicore_run, num_cores=3)
+
+    assert combined == [exp]
+    outdir = exp.get_outputdir(1)
+    for name in ('atmos_daily', 'atmos_monthly', 'atmos_4xdaily'):
+        assert find_fragments(os.path.join(outdir, name + '.nc')) == []
+        with netcdf_file(os.path.join(outdir, name + '.nc'), 'r', mmap=False) as f:
+            np.testing.assert_array_equal(f.variables['temp'][:], field())
+    restart = os.path.join(exp._handoff_path(1), 'atmos_model.res.nc')
+    assert find_fragments(restart) == []
+    with netcdf_file(restart, 'r', mmap=False) as f:
+        np.testing.assert_array_equal(f.variables['temp'][:], field())
+    assert exp.state.status(1) == 'completed'
+
+
+def test_combine_output_failure(multicore_run, exp):
+    # the model wrote no fragments of one file
+    for fragment in find_fragments(os.path.join(multicore_run, 'atmos_monthly.nc')):
+        os.remove(fragment)
+    outdir = exp.get_outputdir(1)
+    os.makedirs(outdir)
+
+    with pytest.raises(CombineError, match='atmos_monthly'):
+        exp.combine_output(multicore_run, outdir)
+    # the other files are combined and moved all the same
+    assert sorted(os.listdir(outdir)) == ['atmos_4xdaily.nc', 'atmos_daily.nc']
+    assert os.path.exists(os.path.join(multicore_run, 'RESTART', 'atmos_model.res.nc'))
+
+
+def test_unsupported_format(tmp_path):
+    filename = str(tmp_path / 'atmos_daily.nc')
+    write_fragments(filename, [3])
+    with netCDF4.Dataset(filename + '.0001', 'w', format='NETCDF4') as f:
+        f.createDimension('lat', 3)
+    with pytest.raises(CombineError, match=r'atmos_daily\.nc\.0001 is in the NETCDF4/HDF5 format'):
+        combine(filename)
+    with open(filename + '.0001', 'w') as f:
+        f.write('not netcdf')
+    with pytest.raises(CombineError, match='not a netcdf file'):
+        combine(filename)
+    assert not os.path.exists(filename)
@@ -0,0 +1,80 @@
+import numpy as np
+import netCDF4
+import pytest
+
+from isca.compress import choose_chunks, compress
+
+
+def write_netcdf3(filename):
+    with netCDF4.Dataset(filename, 'w', format='NETCDF3_64BIT_OFFSET') as ds:
+        ds.setncatts({'filename': 'atmos_monthly.nc', 'title': 'test'})
+        ds.createDimension('time', None)
+        ds.createDimension('pfull', 3)
+        ds.createDimension('lat', 4)
+        ds.createDimension('lon', 8)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.setncatts({'units': 'days since 0001-01-01 00:00:00', 'calendar_type': 'NO_CALENDAR'})
+        lat = ds.createVariable('lat', 'f8', ('lat',))
+        lat.units = 'degrees_N'
+        temp = ds.createVariable('temp', 'f4', ('time', 'pfull', 'lat', 'lon'), fill_value=-1e10)
+        temp.setncatts({'long_name': 'temperature', 'units': 'deg_k'})
+        ps = ds.createVariable('ps', 'f4', ('time', 'lat', 'lon'))
+        time[:] = np.arange(5) * 30.0
+        lat[:] = np.linspace(-67.5, 67.5, 4)
+        temp[:] = 200 + np.random.RandomState(0).rand(5, 3, 4, 8)
+        temp[0, 0, 0, 0] = np.ma.masked
+        ps[:] = 1e5 * np.ones((5, 4, 8))
+
+
+def read(filename):
+    with netCDF4.Dataset(filename) as ds:
+        ds.set_auto_maskandscale(False)
+        return {
+            'attrs': {k: ds.getncattr(k) for k in ds.ncattrs()},
+            'dims': {name: (len(dim), dim.isunlimited()) for name, dim in ds.dimensions.items()},
+            'vars': {name: (var.dimensions, {k: var.getncattr(k) for k in var.ncattrs()}, var[...])
+                     for name, var in ds.variables.items()},
+        }
+
+
+def test_compress_preserves_contents(tmp_path):
+    filename = str(tmp_path / 'atmos_monthly.nc')
+    write_netcdf3(filename)
+    before = read(filename)
+
+    compress(filename, complevel=4, chunk_bytes=256)
+    after = read(filename)
+    assert after['attrs'] == before['attrs']
+    assert after['dims'] == before['dims']
+    assert after['dims']['time'] == (5, True)
+    assert sorted(after['vars']) == sorted(before['vars'])
+    for name, (dims, attrs, values) in before['vars'].items():
+        assert after['vars'][name][0] == dims
+        assert after['vars'][name][1] == attrs
+        np.testing.assert_array_equal(after['vars'][name][2], values)
+
+    with netCDF4.Dataset(filename) as ds:
+        assert ds.data_model == 'NETCDF4'
+        assert ds['temp'].filters()['zlib']
+        assert ds['temp'].chunking() == [5, 1, 1, 8]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['atmos_monthly.nc']
+
+
+@pytest.mark.parametrize('chunk_bytes', [2**22, 2**12, 2**8, 1])
+def test_choose_chunks(chunk_bytes):
+    dims = ('time', 'pfull', 'lat', 'lon')
+    shape = (120, 25, 64, 128)
+    chunks = choose_chunks(dims, shape, 4, recdim='time', chunk_bytes=chunk_bytes)
+    # levels are chunked one at a time
+    assert chunks[1] == 1
+    assert all(1 <= c <= n for c, n in zip(chunks, shape))
+    if chunks != [1, 1, 1, 1]:
+        assert np.prod(chunks) * 4 <= chunk_bytes
+    # all times are kept in a chunk until the horizontal grid can't be split any further
+    if chunks[0] < 120:
+        assert chunks[2:] == [1, 1]
+
+
+def test_choose_chunks_empty_record_dimension():
+    # an unlimited dimension with no records yet is still chunked with one record
+    assert choose_chunks(('time', 'lat', 'lon'), (0, 64, 128), 4, recdim='time') == [1, 64, 128]
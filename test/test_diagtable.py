@@ -0,0 +1,107 @@
+from isca import DiagTable, Namelist
+from isca.diagtable import DiagTableFile, run_seconds, interval_seconds
+
+
+def t42_namelist(**main):
+    main_nml = {'days': 30, 'calendar': 'thirty_day', 'dt_atmos': 600}
+    main_nml.update(main)
+    return Namelist({
+        'main_nml': main_nml,
+        'spectral_dynamics_nml': {'lon_max': 128, 'lat_max': 64, 'num_levels': 25},
+    })
+
+
+def held_suarez_diag():
+    diag = DiagTable()
+    diag.add_file('atmos_daily', 1, 'days', time_units='days')
+    diag.add_file('atmos_monthly', 30, 'days', time_units='days')
+    diag.add_field('dynamics', 'ps', time_avg=True)
+    diag.add_field('dynamics', 'temp', time_avg=True, files=['atmos_daily'])
+    diag.add_field('dynamics', 'bk', files=['atmos_daily'])
+    return diag
+
+
+# 8 bytes for each value of the lon, lat, lonb, latb, pfull and phalf axes
+COORDS = 8 * (128 + 64 + 129 + 65 + 25 + 26)
+
+
+def test_output_volume():
+    volume = held_suarez_diag().output_volume(t42_namelist())
+    # 30 daily records of ps and temp, with 48 bytes of time axis each, and bk once
+    ps, temp, bk = 4 * 64 * 128, 4 * 25 * 64 * 128, 4 * 26
+    assert volume['atmos_daily'] == COORDS + bk + 30 * (ps + temp + 48)
+    assert volume['atmos_daily'] == 25564080
+    # one monthly record of ps
+    assert volume['atmos_monthly'] == COORDS + ps + 48
+
+
+def test_output_volume_frequencies():
+    diag = DiagTable()
+    diag.add_file('every_step', 0, 'days')
+    diag.add_file('end_of_run', -1, 'days')
+    diag.add_file('custom', 6, 'hours')
+    diag.add_field('mymodule', 'myfield', dims=('lat',))
+    volume = diag.output_volume(t42_namelist(days=1))
+    assert volume['every_step'] == COORDS + 144 * (4 * 64 + 48)
+    assert volume['end_of_run'] == COORDS + 4 * 64 + 48
+    assert volume['custom'] == COORDS + 4 * (4 * 64 + 48)
+
+
+def test_run_length():
+    assert run_seconds(t42_namelist()) == 30 * 86400
+    assert run_seconds(Namelist({'main_nml': {'months': 1, 'calendar': 'thirty_day'}})) == 30 * 86400
+    assert interval_seconds(1, 'years', 'noleap') == 365 * 86400
+
+
+def test_diag_table_file_has_no_estimate(tmp_path):
+    assert DiagTableFile(str(tmp_path / 'diag_table')).output_volume(t42_namelist()) is None
+
+
+def test_estimate_output(exp, tmp_path):
+    exp.namelist = t42_namelist()
+    exp.diag_table = held_suarez_diag()
+    estimate = exp.estimate_output(runs=12, num_cores=16)
+    run = sum(estimate['files'].values())
+    assert estimate['run'] == run
+    assert estimate['total'] == 12 * run
+    assert estimate['peak'] == 2 * run
+
+    exp.diag_table = DiagTableFile(str(tmp_path / 'diag_table'))
+    assert exp.estimate_output() is None
+
+
+def test_email_alerts_without_estimate(exp, tmp_path, monkeypatch):
+    from isca import util
+    calls = []
+    monkeypatch.setattr(util, 'disk_space_alert', lambda *args: calls.append(('fixed',) + args[4:]))
+    monkeypatch.setattr(util, 'predicted_disk_space_alert', lambda *args: calls.append(('predicted',) + args[4:]))
+    exp.namelist = t42_namelist()
+
+    exp.diag_table = DiagTableFile(str(tmp_path / 'diag_table'))
+    with util.email_alerts(exp, 'me@example.com'):
+        exp.emit('run:ready', exp, 1)
+    exp.diag_table = held_suarez_diag()
+    with util.email_alerts(exp, 'me@example.com'):
+        exp.emit('run:ready', exp, 2)
+    with util.email_alerts(exp, 'me@example.com', limit=100):
+        exp.emit('run:ready', exp, 3)
+
+    assert calls == [('fixed', 2000, 5), ('predicted', 25564080 + 36312, 10, 5), ('fixed', 100, 5)]
+    assert not exp._events['run:ready']
+
+
+def test_email_alerts_use_cores_of_run(exp, tmp_path, monkeypatch):
+    from isca import util
+    calls = []
+    monkeypatch.setattr(util, 'predicted_disk_space_alert', lambda directory, *args: calls.append((directory, args[3])))
+    exp.namelist = t42_namelist()
+    exp.diag_table = held_suarez_diag()
+    exp.scratchdir = str(tmp_path / 'scratch')
+    run = exp.estimate_output()['run']
+
+    with util.email_alerts(exp, 'me@example.com'):
+        for num_cores in (1, 16):
+            exp.num_cores = num_cores
+            exp.emit('run:ready', exp, 1)
+    # the distributed output is only on scratch alongside the combined files on many cores
+    assert calls == [(exp.datadir, run), (exp.scratchdir, run), (exp.datadir, run), (exp.scratchdir, 2 * run)]
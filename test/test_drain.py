@@ -0,0 +1,72 @@
+import os
+import stat
+
+import pytest
+
+from isca import drain as drain_module
+from isca.diagtable import DiagTable
+from isca.drain import DrainError, Drainer, copy_verified, drain
+from isca.staging import file_digest
+
+
+def write(path, data):
+    with open(str(path), 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+@pytest.fixture
+def corrupted(monkeypatch):
+    """Every copy reads back with the wrong checksum."""
+    monkeypatch.setattr(drain_module, 'file_digest', lambda filename: '0' * 40)
+
+
+def test_copy_verified(tmp_path):
+    src = write(tmp_path / 'atmos_monthly.nc', os.urandom(2**20 + 3))
+    os.chmod(src, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP)
+    dst = str(tmp_path / 'copy.nc')
+    assert copy_verified(src, dst, blocksize=2**16) == file_digest(src)
+    with open(src, 'rb') as a, open(dst, 'rb') as b:
+        assert a.read() == b.read()
+    assert stat.S_IMODE(os.stat(dst).st_mode) == stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP
+    assert sorted(os.listdir(str(tmp_path))) == ['atmos_monthly.nc', 'copy.nc']
+
+
+def test_corrupted_copy_raises(tmp_path, corrupted):
+    src = write(tmp_path / 'atmos_monthly.nc', b'output')
+    dst = str(tmp_path / 'data' / 'atmos_monthly.nc')
+    os.makedirs(os.path.dirname(dst))
+    with pytest.raises(DrainError):
+        drain(src, dst)
+    # the source is kept and nothing appears at the destination
+    assert os.path.exists(src)
+    assert os.listdir(os.path.dirname(dst)) == []
+
+
+def test_drainer_wait_raises_for_failed_run(tmp_path, corrupted):
+    drainer = Drainer()
+    src = write(tmp_path / 'atmos_monthly.nc', b'output')
+    drainer.submit(1, src, str(tmp_path / 'copy.nc'))
+    with pytest.raises(DrainError):
+        drainer.wait(1)
+    drainer.wait(1)  # the failure is only reported once
+
+
+def test_drain_error_fails_run_and_keeps_scratch(exp, tmp_path, corrupted):
+    exp.codebase.write_source_control_status = lambda filename: open(filename, 'w').close()
+    os.makedirs(os.path.dirname(exp.field_table_file))
+    open(exp.field_table_file, 'w').close()
+    exp.diag_table = DiagTable()
+    exp.diag_table.add_file('atmos_daily', 1, 'days', time_units='days')
+    exp.diag_table.add_field('dynamics', 'ps', time_avg=True)
+    exp.scratchdir = str(tmp_path / 'scratch')
+
+    rundir = exp._scratch_path('run')
+    os.makedirs(rundir)
+    model_log = write(os.path.join(rundir, exp.output_log), b'run 1\n')
+    exp.state.claim(1)
+    with pytest.raises(DrainError):
+        exp._finish_run(1, rundir, num_cores=1, store_restart=False)
+    assert exp.state.status(1) == 'failed'
+    assert os.path.exists(model_log)
+    assert not os.path.exists(os.path.join(exp.get_outputdir(1), exp.output_log))
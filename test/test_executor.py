@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+
+from isca import _module_directory
+from isca import localqueue
+from isca.executor import LocalExecutor, LocalQueueExecutor
+from isca.runoutput import RunOutput
+
+RUN_SH = """\
+echo started
+echo WARNING: a warning
+exit 3
+"""
+
+SLOW_RUN_SH = """\
+echo started
+exec sleep 30
+"""
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    """The local queue, spooled in `tmp_path`, with jobs able to import isca."""
+    monkeypatch.setenv('ISCA_LOCALQUEUE_DIR', str(tmp_path / 'queue'))
+    path = [os.path.dirname(_module_directory)] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join(path))
+    return str(tmp_path / 'queue')
+
+
+def make_rundir(tmp_path, script):
+    rundir = str(tmp_path / 'run')
+    os.makedirs(rundir)
+    with open(os.path.join(rundir, 'run.sh'), 'w') as f:
+        f.write(script)
+    return rundir
+
+
+def interrupt_when_started(line):
+    if line == 'started':
+        raise KeyboardInterrupt
+
+
+@pytest.mark.parametrize('make_executor', [LocalExecutor, lambda: LocalQueueExecutor(poll_interval=0.1)])
+def test_exit_code_and_tail(tmp_path, queue, make_executor):
+    rundir = make_rundir(tmp_path, RUN_SH)
+    output = RunOutput(os.path.join(rundir, 'output.log'), tail=10)
+    with output:
+        returncode = make_executor().execute(rundir, output)
+    assert returncode == 3
+    assert list(output.tail) == ['started', 'WARNING: a warning']
+    with open(os.path.join(rundir, 'output.log')) as f:
+        assert f.read() == 'started\nWARNING: a warning\n'
+
+
+def test_local_executor_interrupt(tmp_path):
+    rundir = make_rundir(tmp_path, SLOW_RUN_SH)
+    output = RunOutput(os.path.join(rundir, 'output.log'), on_line=interrupt_when_started)
+    with pytest.raises(KeyboardInterrupt):
+        with output:
+            LocalExecutor().execute(rundir, output)
+
+
+def test_local_queue_interrupt_cancels_job(tmp_path, queue):
+    rundir = make_rundir(tmp_path, SLOW_RUN_SH)
+    output = RunOutput(os.path.join(rundir, 'output.log'), on_line=interrupt_when_started)
+    with pytest.raises(KeyboardInterrupt):
+        with output:
+            LocalQueueExecutor(poll_interval=0.1).execute(rundir, output)
+    job_id, = os.listdir(os.path.join(queue, 'jobs'))
+    assert localqueue.get_state(job_id) == 'CANCELLED'
+    assert not os.path.exists(os.path.join(rundir, 'job.exitcode'))
+
+
+def test_local_queue_runs_one_job_at_a_time(tmp_path, queue):
+    scripts = []
+    for n in (1, 2):
+        scripts.append(str(tmp_path / ('job%d.sh' % n)))
+        with open(scripts[-1], 'w') as f:
+            f.write('sleep 30\n')
+    jobs = [localqueue.submit(s) for s in scripts]
+    try:
+        for _ in range(100):
+            if 'RUNNING' in [localqueue.get_state(job) for job in jobs]:
+                break
+            time.sleep(0.05)
+        time.sleep(0.5)
+        assert sorted(localqueue.get_state(job) for job in jobs) == ['PENDING', 'RUNNING']
+    finally:
+        for job in jobs:
+            localqueue.cancel(job)
+    assert [localqueue.get_state(job) for job in jobs] == ['CANCELLED', 'CANCELLED']
+
+
+def fail_when_started(line):
+    if line == 'started':
+        raise RuntimeError('output handler failed')
+
+
+def process_gone(pid, timeout=5):
+    for _ in range(int(timeout / 0.05)):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.parametrize('make_executor', [LocalExecutor, lambda: LocalQueueExecutor(poll_interval=0.1)])
+def test_output_error_stops_model(tmp_path, queue, make_executor):
+    pidfile = str(tmp_path / 'run' / 'model.pid')
+    rundir = make_rundir(tmp_path, 'echo $$ > %s\n%s' % (pidfile, SLOW_RUN_SH))
+    output = RunOutput(os.path.join(rundir, 'output.log'), on_line=fail_when_started)
+    with pytest.raises(RuntimeError):
+        with output:
+            make_executor().execute(rundir, output)
+    with open(pidfile) as f:
+        assert process_gone(int(f.read()))
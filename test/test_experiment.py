@@ -0,0 +1,21 @@
+import os
+
+import f90nml
+
+
+def test_derive_copies_settings(exp, tmp_path):
+    exp.namelist = f90nml.Namelist({'constants_nml': {'omega': 1.0}})
+    exp.field_table_file = str(tmp_path / 'field_table')
+    exp.combine_tool = 'python'
+    exp.restart_archive_interval = 10
+    exp.scratchdir = str(tmp_path / 'scratch')
+
+    derived = exp.derive('derived')
+    for name in exp.DERIVED_SETTINGS:
+        assert getattr(derived, name) is getattr(exp, name)
+    assert derived.workdir == os.path.join(os.path.dirname(exp.workdir), 'derived')
+    assert derived.datadir == os.path.join(os.path.dirname(exp.datadir), 'derived')
+
+    # the namelist of the derived experiment is independent of this one
+    derived.update_namelist({'constants_nml': {'omega': 2.0}})
+    assert exp.namelist['constants_nml']['omega'] == 1.0
@@ -0,0 +1,66 @@
+import os
+
+
+def store_restart(exp, tmp_path, run):
+    rundir = str(tmp_path / ('run%d' % run))
+    os.makedirs(os.path.join(rundir, 'RESTART'))
+    with open(os.path.join(rundir, 'RESTART', 'atmos_model.res'), 'w') as f:
+        f.write('run %d\n' % run)
+    exp.state.claim(run)
+    exp._store_restart(run, rundir, archive=False)
+
+
+def test_handoff_kept_until_next_run_completes(exp, tmp_path):
+    exp.restart_archive_interval = 10
+    store_restart(exp, tmp_path, 1)
+    exp.state.complete(1)
+    exp._drop_handoffs()
+    store_restart(exp, tmp_path, 2)
+    # run 2 fails after its model has finished, e.g. while copying its output
+    exp.state.fail(2)
+    exp._drop_handoffs()
+    assert sorted(exp._handoffs()) == [1, 2]
+
+    # performing run 2 again replaces its own handoff, then drops the one it started from
+    store_restart(exp, tmp_path, 2)
+    with open(os.path.join(exp._handoff_path(2), 'atmos_model.res')) as f:
+        assert f.read() == 'run 2\n'
+    exp.state.complete(2)
+    exp._drop_handoffs()
+    assert sorted(exp._handoffs()) == [2]
+
+
+def test_stale_handoffs_replaced(exp, tmp_path):
+    for run in (1, 2, 3):
+        store_restart(exp, tmp_path, run)
+    # the experiment is performed again from the start
+    store_restart(exp, tmp_path / 'again', 1)
+    assert sorted(exp._handoffs()) == [1]
+
+
+def test_clear_handoffs_removes_archived_restarts(exp, tmp_path):
+    exp.restart_archive_interval = 2
+    os.makedirs(exp.restartdir)
+    for run in (1, 2, 3):
+        rundir = str(tmp_path / ('run%d' % run))
+        os.makedirs(os.path.join(rundir, 'RESTART'))
+        with open(os.path.join(rundir, 'RESTART', 'atmos_model.res'), 'w') as f:
+            f.write('run %d\n' % run)
+        exp.state.claim(run)
+        # the final run is always archived
+        exp._store_restart(run, rundir, archive=True if run == 3 else None)
+        exp.state.complete(run)
+        exp._drop_handoffs()
+    assert sorted(exp._handoffs()) == [3]
+
+    exp.clear_handoffs()
+    assert exp._handoffs() == {}
+    assert os.path.exists(exp.get_restart_file(3))
+
+
+def test_clear_handoffs_keeps_unarchived_restarts(exp, tmp_path):
+    exp.restart_archive_interval = 10
+    store_restart(exp, tmp_path, 1)
+    exp.state.complete(1)
+    exp.clear_handoffs()
+    assert sorted(exp._handoffs()) == [1]
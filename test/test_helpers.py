@@ -0,0 +1,46 @@
+import errno
+import os
+
+import pytest
+
+from isca.helpers import copy_file, mv
+
+
+def test_copy_file_leaves_hard_links_untouched(tmp_path):
+    cached, src = str(tmp_path / 'cached'), str(tmp_path / 'src')
+    with open(cached, 'w') as f:
+        f.write('cached\n')
+    with open(src, 'w') as f:
+        f.write('new\n')
+    dst = str(tmp_path / 'dst')
+    os.link(cached, dst)
+
+    copy_file(src, dst)
+    with open(dst) as f:
+        assert f.read() == 'new\n'
+    with open(cached) as f:
+        assert f.read() == 'cached\n'
+
+
+def test_mv_onto_nonempty_directory_raises(tmp_path):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    for d in (src, dst):
+        d.mkdir()
+        (d / 'file').write_text(d.name)
+    with pytest.raises(OSError) as e:
+        mv(str(src), str(dst))
+    assert e.value.errno in (errno.ENOTEMPTY, errno.EEXIST)
+    # nothing is copied into dst, and src is kept
+    assert sorted(os.listdir(str(dst))) == ['file']
+    assert (src / 'file').read_text() == 'src'
+
+
+def test_mv_falls_back_to_copy_across_filesystems(tmp_path, monkeypatch):
+    def replace(src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    monkeypatch.setattr(os, 'replace', replace)
+    src = tmp_path / 'src'
+    src.write_text('data')
+    mv(str(src), str(tmp_path / 'dst'))
+    assert not src.exists()
+    assert (tmp_path / 'dst').read_text() == 'data'
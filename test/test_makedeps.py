@@ -0,0 +1,80 @@
+import os
+
+import isca.makedeps
+from isca.makedeps import DependencyScan, scan_source
+
+CALC = """\
+module calc_mod
+  use consts_mod, only: pi
+  USE Other_Mod
+  implicit none
+  include 'fms_platform.h'
+#include "calc.inc"
+contains
+  subroutine area(r, a)
+    use calc_mod
+    real :: r, a
+    a = pi * r**2
+  end subroutine area
+end module calc_mod
+"""
+
+
+def write(path, text, mtime=None):
+    with open(path, 'w') as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_scan_source(tmp_path):
+    source = str(tmp_path / 'calc.F90')
+    write(source, CALC)
+    assert scan_source(source) == {
+        'modules': ['calc_mod'],
+        'uses': ['consts_mod', 'other_mod'],
+        'includes': ['calc.inc', 'fms_platform.h'],
+    }
+
+
+def test_scan_only_rereads_changed_files(tmp_path, monkeypatch):
+    builddir = str(tmp_path)
+    sources = {'calc.F90': str(tmp_path / 'calc.F90'), 'consts.F90': str(tmp_path / 'consts.F90')}
+    write(sources['calc.F90'], CALC, 1000)
+    write(sources['consts.F90'], 'module consts_mod\nreal, parameter :: pi = 3.14\nend module consts_mod\n', 1000)
+    scanned = []
+
+    def counting_scan(filename):
+        scanned.append(os.path.basename(filename))
+        return scan_source(filename)
+    monkeypatch.setattr(isca.makedeps, 'scan_source', counting_scan)
+
+    first = DependencyScan(builddir).digest(sources)
+    assert sorted(scanned) == ['calc.F90', 'consts.F90']
+    assert os.path.exists(os.path.join(builddir, 'dependencies.json'))
+
+    # unchanged files are not read again
+    del scanned[:]
+    assert DependencyScan(builddir).digest(sources) == first
+    assert scanned == []
+
+    # editing the body of a file rereads it, but the dependencies are the same
+    write(sources['calc.F90'], CALC.replace('pi * r**2', 'pi * r * r'), 2000)
+    assert DependencyScan(builddir).digest(sources) == first
+    assert scanned == ['calc.F90']
+
+    # a new module used changes the digest
+    write(sources['calc.F90'], CALC.replace('  implicit none', '  use new_mod\n  implicit none'), 3000)
+    assert DependencyScan(builddir).digest(sources) != first
+
+
+def test_scan_missing_and_removed_files(tmp_path):
+    builddir = str(tmp_path)
+    calc = str(tmp_path / 'calc.F90')
+    write(calc, CALC)
+    scan = DependencyScan(builddir)
+    deps = scan.scan({'calc.F90': calc, 'gone.F90': str(tmp_path / 'gone.F90')})
+    assert deps['gone.F90'] is None
+    assert deps['calc.F90']['modules'] == ['calc_mod']
+    assert list(scan.scan({}).keys()) == []
+    assert scan._read() == {}
@@ -0,0 +1,95 @@
+import csv
+import logging
+import os
+
+import pytest
+
+import isca.monitor
+from isca.monitor import ThroughputMonitor, model_day, parse_progress
+
+
+@pytest.mark.parametrize('calendar, date, day', [
+    ('thirty_day', (2, 3, 1, 12, 0, 0), 360 + 60 + 0.5),
+    ('noleap', (1, 3, 1, 0, 0, 0), 59),
+    ('julian', (4, 3, 1, 0, 0, 0), 3 * 365 + 59 + 1),
+    ('julian', (4, 2, 1, 0, 0, 0), 3 * 365 + 31),
+    ('gregorian', (2000, 1, 2, 6, 0, 0), 730119 + 1.25),
+    ('gregorian', (1900, 3, 1, 0, 0, 0), 693654),
+    # year 0 is a leap year, which datetime can't represent
+    ('gregorian', (0, 1, 1, 0, 0, 0), -366),
+    ('gregorian', (0, 12, 31, 0, 0, 0), -1),
+    ('julian', (0, 3, 1, 0, 0, 0), -366 + 60),
+])
+def test_model_day(calendar, date, day):
+    assert model_day(date, calendar) == day
+
+
+def test_model_day_unknown_calendar():
+    with pytest.raises(ValueError):
+        model_day((1, 1, 1, 0, 0, 0), 'no_calendar')
+
+
+def test_parse_progress():
+    sample = parse_progress('{"day":    12  ,"second":  43200  ,"max_speed": 0.406000E+02   ,"avg_T": 0.261000E+03   }')
+    assert sample == {'day': 12.5, 'max_speed': 40.6, 'avg_T': 261.0}
+    sample = parse_progress('{"date": "0002-01-11", "time": "00:00:00", "max_speed":  40.6   ,"avg_T": 261.0   }', 'thirty_day')
+    assert sample['day'] == 370
+    assert parse_progress(' WARNING: not progress') is None
+    assert parse_progress('{not json') is None
+    assert parse_progress('{"max_speed": 40.6}') is None
+
+
+def test_throughput_monitor(exp, monkeypatch):
+    monitor = ThroughputMonitor(exp, window=2)
+    assert exp.namelist['spectral_dynamics_nml']['json_logging']
+
+    rates = []
+    exp.on('run:throughput', lambda exp, run, sample: rates.append((run, sample['days_per_hour'])))
+    clock = [1000.0]
+    monkeypatch.setattr(isca.monitor.time, 'time', lambda: clock[0])
+    exp.emit('run:ready', exp, 3)
+    # one model day every 36 seconds, 100 days per hour
+    for day in range(1, 5):
+        clock[0] += 36
+        exp.emit('run:progress', exp, '{"day": %d, "second": 0, "max_speed": 40.0, "avg_T": 260.0}' % day)
+    exp.emit('run:progress', exp, 'a line of ordinary output')
+
+    assert [r[0] for r in rates] == [3, 3, 3, 3]
+    assert rates[0][1] is None
+    assert [round(r[1], 6) for r in rates[1:]] == [100.0, 100.0, 100.0]
+    assert round(monitor.days_per_hour, 6) == 100.0
+
+    exp.emit('run:completed', exp, 3)
+    with open(os.path.join(exp.get_outputdir(3), 'throughput.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert [float(r['day']) for r in rows] == [1.0, 2.0, 3.0, 4.0]
+    assert float(rows[-1]['wall_seconds']) == 144.0
+
+    monitor.detach()
+    exp.emit('run:progress', exp, '{"day": 5, "second": 0}')
+    assert len(monitor.samples) == 4
+
+
+class ProgressExecutor(object):
+    def execute(self, rundir, output, num_cores=1):
+        for day in range(1, 4):
+            output.feed(b'step\n{"day": %d, "second": 0, "max_speed": 40.0, "avg_T": 260.0}\n' % day)
+        return 0
+
+
+def test_monitor_keeps_output_batched(exp, tmp_path, caplog):
+    caplog.set_level(logging.DEBUG, logger='isca')
+    exp.codebase.builddir = str(tmp_path / 'build')
+    exp.codebase.executable_name = 'isca.x'
+    exp.executor = ProgressExecutor()
+    rundir = str(tmp_path / 'run')
+    os.makedirs(rundir)
+    exp.state.claim(1)
+    monitor = ThroughputMonitor(exp)
+
+    exp._execute_run(1, rundir, num_cores=1)
+    assert [sample['day'] for sample in monitor.samples] == [1.0, 2.0, 3.0]
+    # the output is logged in a single batch, as without the monitor
+    output = [r.getMessage() for r in caplog.records if r.getMessage().startswith('step')]
+    assert len(output) == 1
+    assert output[0].count('step') == 3
@@ -0,0 +1,54 @@
+import os
+import time
+
+from isca import _module_directory
+from isca.codebase import template_compiler
+from isca.objcache import parse_command, prune
+
+
+def make_entry(cachedir, key, size, used):
+    entry = os.path.join(cachedir, key[:2], key)
+    os.makedirs(entry)
+    with open(os.path.join(entry, 'a.o'), 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(entry, (used, used))
+    return entry
+
+
+def test_prune_removes_least_recently_used(tmp_path):
+    cachedir = str(tmp_path)
+    now = time.time()
+    old = make_entry(cachedir, 'aa01', 100, now - 300)
+    middle = make_entry(cachedir, 'ab02', 100, now - 200)
+    new = make_entry(cachedir, 'aa03', 100, now - 100)
+    assert prune(cachedir, 300) == 0
+    assert prune(cachedir, 250) == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(middle) and os.path.exists(new)
+    assert prune(cachedir, 0) == 2
+    assert os.listdir(os.path.join(cachedir, 'aa')) == []
+
+
+def test_prune_missing_cache(tmp_path):
+    assert prune(str(tmp_path / 'objcache'), 0) == 0
+
+
+def test_parse_command():
+    source, output, flags, includes, cpp_flags = parse_command(
+        ['-c', '-O2', '-Duse_netCDF', '-I/inc', '-I', '/other', 'src/atmos.F90'])
+    assert source == 'src/atmos.F90'
+    assert output == 'atmos.o'
+    assert flags == ['-c', '-O2', '-Duse_netCDF']
+    assert includes == ['/inc', '/other']
+    assert cpp_flags == ['-Duse_netCDF']
+    # linking is not cached
+    assert parse_command(['-o', 'isca.x', 'a.o', 'b.o']) is None
+
+
+def test_template_compiler(tmp_path):
+    templates = os.path.join(_module_directory, 'templates')
+    assert template_compiler(os.path.join(templates, 'mkmf.template.ia64')) == '$(F90)'
+    assert template_compiler(os.path.join(templates, 'mkmf.template.debug')) == 'mpif90'
+    template = tmp_path / 'mkmf.template'
+    template.write_text(u'#FC = ifort\nLD = $(F90)\n')
+    assert template_compiler(str(template)) is None
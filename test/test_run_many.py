@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from isca.diagtable import DiagTable
+from isca.experiment import Experiment, FailedRunError
+from isca.util import run_timings
+
+
+class StubExecutor(object):
+    """Stands in for the model: each run writes a restart one greater than the
+    one in its INPUT directory, and records when it starts."""
+    def __init__(self, events, fail_run=None):
+        self.events = events
+        self.fail_run = fail_run
+        self.rundirs = []
+        self.started = {}
+
+    def execute(self, rundir, output, num_cores=1):
+        restart = os.path.join(rundir, 'INPUT', 'atmos_model.res')
+        run = 1
+        if os.path.exists(restart):
+            with open(restart) as f:
+                run = int(f.read()) + 1
+        self.rundirs.append(rundir)
+        self.events.append(('execute', run))
+        self.started.setdefault(run, threading.Event()).set()
+        output.feed(b'run %d\n' % run)
+        with open(os.path.join(rundir, 'RESTART', 'atmos_model.res'), 'w') as f:
+            f.write('%d' % run)
+        return 1 if run == self.fail_run else 0
+
+    def wait_started(self, run):
+        return self.started.setdefault(run, threading.Event()).wait(5)
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+@pytest.fixture
+def runnable(exp, tmp_path, events):
+    """`exp` with a stub codebase and executor, which records the execution
+    and post-processing of each run in `events`."""
+    exp.codebase.builddir = str(tmp_path / 'build')
+    exp.codebase.executable_name = 'isca.x'
+    exp.codebase.write_source_control_status = lambda filename: open(filename, 'w').close()
+    os.makedirs(os.path.dirname(exp.field_table_file))
+    open(exp.field_table_file, 'w').close()
+    exp.diag_table = DiagTable()
+    exp.diag_table.add_file('atmos_daily', 1, 'days', time_units='days')
+    exp.diag_table.add_field('dynamics', 'ps', time_avg=True)
+    exp.executor = StubExecutor(events)
+
+    finish_run = exp._finish_run
+    def _finish_run(i, *args, **kwargs):
+        events.append(('finish', i))
+        finish_run(i, *args, **kwargs)
+        events.append(('finished', i))
+    exp._finish_run = _finish_run
+    return exp
+
+
+def test_post_processing_overlaps_next_run(runnable, events):
+    started_next = []
+    finish_run = runnable._finish_run
+    def _finish_run(i, *args, **kwargs):
+        # only returns promptly if the next run starts while this one is post-processed
+        started_next.append(i == 3 or runnable.executor.wait_started(i + 1))
+        finish_run(i, *args, **kwargs)
+    runnable._finish_run = _finish_run
+
+    assert runnable.run_many(1, 3, use_restart=False, num_cores=1)
+    assert all(started_next)
+    assert [run for event, run in events if event == 'execute'] == [1, 2, 3]
+    assert [run for event, run in events if event == 'finished'] == [1, 2, 3]
+    for i in (1, 2, 3):
+        assert runnable.state.status(i) == 'completed'
+        assert os.path.exists(os.path.join(runnable.get_outputdir(i), runnable.output_log))
+    # the final restart is archived and no longer kept in the workdir
+    assert os.path.exists(runnable.get_restart_file(3))
+    assert runnable._handoffs() == {}
+
+
+@pytest.mark.parametrize('max_pending', [1, 2])
+def test_staging_directories_and_backpressure(runnable, events, max_pending):
+    finish_run = runnable._finish_run
+    def _finish_run(*args, **kwargs):
+        time.sleep(0.1)
+        finish_run(*args, **kwargs)
+    runnable._finish_run = _finish_run
+
+    runnable.run_many(1, 5, use_restart=False, num_cores=1, max_pending=max_pending)
+    rundirs = runnable.executor.rundirs
+    assert len(set(rundirs)) == max_pending + 1
+    assert rundirs == [rundirs[i % (max_pending + 1)] for i in range(len(rundirs))]
+    # run i never starts before run i-max_pending-1 has been post-processed
+    for i in range(max_pending + 2, 6):
+        assert events.index(('finished', i - max_pending - 1)) < events.index(('execute', i))
+
+
+def test_background_failure_raised_and_run_failed(runnable, events):
+    write_status = runnable.codebase.write_source_control_status
+    def write_source_control_status(filename):
+        if filename.startswith(runnable.get_outputdir(1)):
+            raise IOError('disk full')
+        write_status(filename)
+    runnable.codebase.write_source_control_status = write_source_control_status
+
+    with pytest.raises(IOError, match='disk full'):
+        runnable.run_many(1, 4, use_restart=False, num_cores=1)
+    assert runnable.state.status(1) == 'failed'
+    assert runnable.state.status(2) == 'completed'
+    # no further run starts once the failure is noticed
+    assert runnable.state.status(3) is None
+    assert [run for event, run in events if event == 'execute'] == [1, 2]
+
+
+def test_foreground_failure_not_masked(runnable, events):
+    runnable.executor.fail_run = 2
+    write_status = runnable.codebase.write_source_control_status
+    def write_source_control_status(filename):
+        if filename.startswith(runnable.get_outputdir(1)):
+            # fail only once run 2 has failed
+            time.sleep(0.2)
+            raise IOError('disk full')
+        write_status(filename)
+    runnable.codebase.write_source_control_status = write_source_control_status
+
+    with pytest.raises(FailedRunError):
+        runnable.run_many(1, 3, use_restart=False, num_cores=1)
+    assert ('finish', 1) in events
+    assert runnable.state.status(1) == 'failed'
+    assert runnable.state.status(2) == 'failed'
+    assert runnable.state.status(3) is None
+
+
+def test_phase_timings(runnable):
+    reported = {}
+    runnable.on('run:phase', lambda exp, i, phase, elapsed: reported.setdefault(i, []).append((phase, elapsed)))
+    # stands in for combining the output of a run on several cores
+    runnable.combine_output = lambda *args, **kwargs: time.sleep(0.05)
+
+    runnable.run_many(1, 2, use_restart=False, num_cores=2)
+    records = {}
+    for i in (1, 2):
+        with open(os.path.join(runnable.get_outputdir(i), 'timings.json')) as f:
+            records[i] = record = json.load(f)
+        assert record['run'] == i
+        assert record['num_cores'] == 2
+        assert set(record['phases']) <= set(Experiment.RUN_PHASES)
+        # restarts are combined before the next run, the diagnostics in the background
+        assert record['phases']['combine_restarts'] >= 0.05
+        assert record['phases']['combine'] >= 0.05
+        assert record['total'] == pytest.approx(sum(record['phases'].values()))
+        # every phase is reported as it finishes, and its times are summed
+        totals = {}
+        for phase, elapsed in reported[i]:
+            totals[phase] = totals.get(phase, 0.0) + elapsed
+        assert totals == pytest.approx(record['phases'])
+
+    df = run_timings(runnable)
+    assert list(df.index) == [1, 2]
+    assert list(df.columns) == list(Experiment.RUN_PHASES) + ['total']
+    for i in (1, 2):
+        assert df.loc[i, 'total'] == pytest.approx(records[i]['total'])
+        assert df.loc[i, 'execute'] == pytest.approx(records[i]['phases']['execute'])
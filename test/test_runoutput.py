@@ -0,0 +1,92 @@
+import logging
+import os
+
+import pytest
+
+from isca.experiment import FailedRunError
+from isca.runoutput import RunOutput
+
+
+def read_pipe(output, blocks):
+    """Write `blocks` to a pipe, one write each, and have `output` read it."""
+    r, w = os.pipe()
+    try:
+        for block in blocks:
+            os.write(w, block)
+        os.close(w)
+        with output:
+            output.read_from(r, blocksize=4)
+    finally:
+        os.close(r)
+
+
+def isca_records(caplog, level):
+    return [r.getMessage() for r in caplog.records if r.name == 'isca' and r.levelno == level]
+
+
+def test_partial_lines_across_reads(tmp_path):
+    logfile = str(tmp_path / 'model.log')
+    output = RunOutput(logfile)
+    blocks = [b'hel', b'lo\nwor', b'ld\n', 'caf\xe9\n'.encode('utf-8'), b'no newline']
+    read_pipe(output, blocks)
+    assert list(output.tail) == ['hello', 'world', 'caf\xe9', 'no newline']
+    with open(logfile) as f:
+        assert f.read() == 'hello\nworld\ncaf\xe9\nno newline'
+
+
+def test_tail_keeps_last_lines(tmp_path):
+    logfile = str(tmp_path / 'model.log')
+    output = RunOutput(logfile, tail=3)
+    with output:
+        for n in range(10):
+            output.feed(b'line %d\n' % n)
+    assert list(output.tail) == ['line 7', 'line 8', 'line 9']
+    with open(logfile) as f:
+        assert len(f.read().splitlines()) == 10
+
+
+def test_logged_in_batches(tmp_path, caplog):
+    caplog.set_level(logging.DEBUG, logger='isca')
+    output = RunOutput(str(tmp_path / 'model.log'), interval=3600)
+    with output:
+        for n in range(5):
+            output.feed(b'line %d\n' % n)
+        assert isca_records(caplog, logging.DEBUG) == []
+    assert isca_records(caplog, logging.DEBUG) == ['\n'.join('line %d' % n for n in range(5))]
+
+
+def test_repeated_warnings_capped(tmp_path, caplog):
+    caplog.set_level(logging.DEBUG, logger='isca')
+    logfile = str(tmp_path / 'model.log')
+    with RunOutput(logfile, interval=3600, max_warnings=2) as output:
+        output.feed(b'step 1\n' + b'WARNING: negative humidity\n' * 5 + b'step 2\n')
+    assert isca_records(caplog, logging.WARNING) == [
+        'WARNING: negative humidity',
+        'WARNING: negative humidity',
+        '... 3 more warnings, see %s' % logfile,
+    ]
+    assert isca_records(caplog, logging.DEBUG) == ['step 1\nstep 2']
+
+
+class FailingExecutor(object):
+    def execute(self, rundir, output, num_cores=1):
+        for n in range(5):
+            output.feed(b'step %d\n' % n)
+        output.feed(b'FATAL: model blew up\n')
+        return 1
+
+
+def test_tail_reported_on_failure(exp, tmp_path, caplog):
+    exp.codebase.builddir = str(tmp_path / 'build')
+    exp.codebase.executable_name = 'isca.x'
+    exp.executor = FailingExecutor()
+    exp.output_tail = 3
+    rundir = str(tmp_path / 'run')
+    os.makedirs(rundir)
+    exp.state.claim(1)
+
+    with pytest.raises(FailedRunError) as e:
+        exp._execute_run(1, rundir, num_cores=1)
+    assert e.value.output == ['step 3', 'step 4', 'FATAL: model blew up']
+    assert 'Last 3 lines of output:\nstep 3\nstep 4\nFATAL: model blew up' in isca_records(caplog, logging.ERROR)
+    assert exp.state.status(1) == 'failed'
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+from isca.scheduler import EnsembleScheduler, mpi_library
+
+
+class StubExperiment(object):
+    """Records the runs it performs in a log shared by all stubs."""
+    def __init__(self, name, log, fail=(), seconds=0.05):
+        self.name = name
+        self.workdir = '/work/' + name
+        self.log = log
+        self.fail = fail
+        self.seconds = seconds
+        self.calls = []
+
+    def run(self, i, **kwargs):
+        self.calls.append((i, kwargs))
+        self.log.append(('start', self.name, kwargs['num_cores']))
+        time.sleep(self.seconds)
+        self.log.append(('end', self.name, kwargs['num_cores']))
+        if i in self.fail:
+            raise RuntimeError('run %d failed' % i)
+
+
+def cores_in_use(log):
+    """The largest number of cores in use at once, from a log of starts and ends."""
+    used = peak = 0
+    for event, _, cores in list(log):
+        used += cores if event == 'start' else -cores
+        peak = max(peak, used)
+    return peak
+
+
+def test_packs_jobs_onto_cores():
+    log = []
+    scheduler = EnsembleScheduler(num_cores=32)
+    exps = [StubExperiment('exp%d' % n, log) for n in range(3)]
+    for exp in exps:
+        scheduler.add(exp, runs=range(1, 4), num_cores=16, use_restart=False, restart_file=None)
+    assert scheduler.run() == {'exp0': None, 'exp1': None, 'exp2': None}
+    assert cores_in_use(log) == 32
+    for exp in exps:
+        assert [i for i, _ in exp.calls] == [1, 2, 3]
+        # only the first run takes the restart options
+        assert exp.calls[0][1]['use_restart'] is False
+        assert 'use_restart' not in exp.calls[1][1]
+
+
+def test_backfills_smaller_jobs():
+    log = []
+    scheduler = EnsembleScheduler(num_cores=32)
+    scheduler.add(StubExperiment('big', log), runs=[1], num_cores=24)
+    scheduler.add(StubExperiment('wide', log), runs=[1], num_cores=16)
+    scheduler.add(StubExperiment('small', log), runs=[1], num_cores=8)
+    scheduler.run()
+    starts = [name for event, name, _ in log if event == 'start']
+    # small fits beside big, wide has to wait for big to finish
+    assert set(starts[:2]) == {'big', 'small'}
+    assert starts[2] == 'wide'
+    assert cores_in_use(log) == 32
+
+
+def test_next_run_of_a_job_goes_first():
+    log = []
+    scheduler = EnsembleScheduler(num_cores=16)
+    scheduler.add(StubExperiment('first', log), runs=[1, 2], num_cores=16)
+    scheduler.add(StubExperiment('second', log), runs=[1], num_cores=16)
+    scheduler.run()
+    assert [name for event, name, _ in log if event == 'start'] == ['first', 'first', 'second']
+
+
+def test_failed_job_is_abandoned():
+    log = []
+    scheduler = EnsembleScheduler(num_cores=32)
+    failing = StubExperiment('failing', log, fail=[2])
+    other = StubExperiment('other', log)
+    scheduler.add(failing, runs=range(1, 5), num_cores=16)
+    scheduler.add(other, runs=range(1, 5), num_cores=16)
+    results = scheduler.run()
+    assert isinstance(results['failing'], RuntimeError)
+    assert results['other'] is None
+    assert [i for i, _ in failing.calls] == [1, 2]
+    assert [i for i, _ in other.calls] == [1, 2, 3, 4]
+
+
+def test_add_checks_jobs():
+    scheduler = EnsembleScheduler(num_cores=8)
+    with pytest.raises(ValueError):
+        scheduler.add(StubExperiment('wide', []), runs=[1], num_cores=16)
+    scheduler.add(StubExperiment('exp', []), runs=[1], num_cores=8)
+    with pytest.raises(ValueError):
+        scheduler.add(StubExperiment('exp', []), runs=[2], num_cores=8)
+
+
+def pinned_cores(exp):
+    """The cores each run of `exp` was pinned to with Intel MPI options."""
+    return [set(int(c) for c in kwargs['mpirun_opts'].split()[-1].split(',')) for _, kwargs in exp.calls]
+
+
+def test_jobs_side_by_side_get_disjoint_cores():
+    log = []
+    scheduler = EnsembleScheduler(num_cores=32, mpi='intel')
+    exps = [StubExperiment('exp%d' % n, log) for n in range(3)]
+    for exp in exps:
+        scheduler.add(exp, runs=[1], num_cores=16, mpirun_opts='-v')
+    scheduler.run()
+    assert exps[0].calls[0][1]['mpirun_opts'] == '-v -genv I_MPI_PIN_PROCESSOR_LIST ' + ','.join(str(c) for c in range(16))
+    first, second, third = [pinned_cores(exp)[0] for exp in exps]
+    assert not first & second
+    assert first | second == set(range(32))
+    # the third job runs on the cores of whichever finished first
+    assert third in (first, second)
+
+
+def test_pinning_options():
+    log = []
+    exp = StubExperiment('exp', log)
+    scheduler = EnsembleScheduler(num_cores=4, mpi='openmpi', first_core=4)
+    scheduler.add(exp, runs=[1], num_cores=2)
+    scheduler.run()
+    assert exp.calls[0][1]['mpirun_opts'] == '--cpu-set 4,5 --bind-to core'
+
+    exp = StubExperiment('exp', log)
+    scheduler = EnsembleScheduler(num_cores=4, mpi=False)
+    scheduler.add(exp, runs=[1], num_cores=2)
+    scheduler.run()
+    assert 'mpirun_opts' not in exp.calls[0][1]
+
+
+def test_mpi_library():
+    assert mpi_library('Intel(R) MPI Library for Linux* OS, Version 2019 Update 9 Build 20200923') == 'intel'
+    assert mpi_library('mpirun (Open MPI) 4.1.4\n\nReport bugs to http://www.open-mpi.org/community/help/') == 'openmpi'
+    assert mpi_library('HYDRA build details:') is None
@@ -0,0 +1,117 @@
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from isca import staging
+from isca.staging import InputCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return InputCache(str(tmp_path / 'inputcache'))
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """The files hashed by the cache, in order."""
+    files = []
+    def file_digest(filename):
+        files.append(os.path.basename(filename))
+        return digest(filename)
+    digest = staging.file_digest
+    monkeypatch.setattr(staging, 'file_digest', file_digest)
+    return files
+
+
+def write(path, text):
+    with open(str(path), 'w') as f:
+        f.write(text)
+    return str(path)
+
+
+def read(path):
+    with open(str(path)) as f:
+        return f.read()
+
+
+def test_digest_reused_while_unchanged(cache, tmp_path, hashed):
+    source = write(tmp_path / 'sst.nc', 'sst')
+    for run in (1, 2):
+        rundir = tmp_path / ('run%d' % run)
+        rundir.mkdir()
+        cache.stage(source, str(rundir))
+    assert hashed == ['sst.nc']
+    assert read(tmp_path / 'run2' / 'sst.nc') == 'sst'
+
+
+def test_rehashed_when_source_changes(cache, tmp_path, hashed):
+    source = write(tmp_path / 'sst.nc', 'old')
+    rundir = str(tmp_path / 'run')
+    os.makedirs(rundir)
+    staged = cache.stage(source, rundir)
+
+    st = os.stat(source)
+    write(source, 'new')
+    os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.stage(source, rundir) == staged
+    assert hashed == ['sst.nc', 'sst.nc']
+    assert read(staged) == 'new'
+    assert len(os.listdir(cache.objectdir)) == 2
+
+
+def test_objects_read_only_and_hard_linked(cache, tmp_path):
+    source = write(tmp_path / 'sst.nc', 'sst')
+    rundir = str(tmp_path / 'run')
+    os.makedirs(rundir)
+    staged = cache.stage(source, rundir)
+    cached = cache.add(source)
+    assert os.path.samefile(staged, cached)
+    assert not os.path.islink(staged)
+    assert not os.stat(cached).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+def test_symlinked_where_hard_links_fail(cache, tmp_path, monkeypatch):
+    def link(src, dst):
+        raise OSError('cross-device link')
+    monkeypatch.setattr(os, 'link', link)
+    source = write(tmp_path / 'sst.nc', 'sst')
+    rundir = str(tmp_path / 'run')
+    os.makedirs(rundir)
+    staged = cache.stage(source, rundir, name='sst_clim.nc')
+    assert os.path.islink(staged)
+    assert os.readlink(staged) == cache.add(source)
+    assert read(staged) == 'sst'
+
+
+def test_prune(cache, tmp_path):
+    kept = write(tmp_path / 'sst.nc', 'sst')
+    changed = write(tmp_path / 'ozone.nc', 'ozone')
+    removed = write(tmp_path / 'qflux.nc', 'qflux')
+    rundir = str(tmp_path / 'run')
+    os.makedirs(rundir)
+    for source in (kept, changed, removed):
+        cache.stage(source, rundir)
+    st = os.stat(changed)
+    write(changed, 'ozone, revised')
+    os.utime(changed, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    os.remove(removed)
+
+    cache.prune()
+    # the revised file has not been staged, so only the unchanged file has a cached copy
+    assert os.listdir(cache.objectdir) == [staging.file_digest(kept)]
+    assert sorted(cache._read_index()) == sorted(os.path.realpath(s) for s in (kept, changed))
+
+
+def test_concurrent_staging_keeps_every_entry(cache, tmp_path):
+    sources = [write(tmp_path / ('input%d.nc' % n), 'input %d' % n) for n in range(20)]
+
+    def stage(source):
+        rundir = str(tmp_path / ('run_' + os.path.basename(source)))
+        os.makedirs(rundir)
+        cache.stage(source, rundir)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(stage, sources))
+    assert sorted(cache._read_index()) == sorted(os.path.realpath(s) for s in sources)
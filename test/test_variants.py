@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from isca.codebase import CodeBase, host_flag
+
+
+def test_host_flag():
+    assert host_flag('ifort (IFORT) 2021.5.0 20211109\nCopyright (C) 1985-2021 Intel Corporation.') == '-xHost'
+    assert host_flag('ifx (IFX) 2024.0.0 20231017') == '-xHost'
+    assert host_flag('GNU Fortran (GCC) 12.2.0\nCopyright (C) 2022 Free Software Foundation, Inc.') == '-march=native'
+    assert host_flag('') is None
+
+
+def test_variant_flags():
+    for name, variant in CodeBase.BUILD_VARIANTS.items():
+        # compiler specific flags are chosen when compiling
+        assert '-xHost' not in variant['flags'], name
+
+
+def test_variant_builddirs(codebase):
+    fast = codebase.variant('aggressive')
+    assert fast.build_variant == 'aggressive'
+    assert codebase.build_variant == 'default'
+    assert fast.builddir == codebase.builddir + '-aggressive'
+    assert fast.executable_fullpath == os.path.join(fast.builddir, 'held_suarez.x')
+    assert len(set(codebase.variant(name).builddir for name in CodeBase.BUILD_VARIANTS)) == len(CodeBase.BUILD_VARIANTS)
+    # the variant has its own flags
+    fast.compile_flags.append('-DFAST')
+    assert '-DFAST' not in codebase.compile_flags
+    with pytest.raises(ValueError):
+        codebase.variant('unknown')
+
+
+def test_compile_debug_switches_variant(codebase, cache_executable):
+    cache_executable('mkmf.template.debug')
+    default_builddir = codebase.builddir
+    codebase.compile(debug=True)
+    assert codebase.build_variant == 'debug'
+    assert codebase.builddir == default_builddir + '-debug'
+    with open(codebase.executable_fullpath) as f:
+        assert f.read() == 'built with mkmf.template.debug'
+    assert not os.path.exists(os.path.join(default_builddir, 'held_suarez.x'))
+
+
+def test_clean_if_flags_changed(codebase):
+    os.makedirs(codebase.builddir)
+    objects = [os.path.join(codebase.builddir, name) for name in ('atmos.o', 'atmos_mod.mod')]
+    for name in objects + [os.path.join(codebase.builddir, 'Makefile')]:
+        open(name, 'w').close()
+
+    codebase._clean_if_flags_changed('mkmf.template.ia64 -O2')
+    codebase._clean_if_flags_changed('mkmf.template.ia64 -O2')
+    assert all(os.path.exists(name) for name in objects)
+    codebase._clean_if_flags_changed('mkmf.template.ia64 -O3')
+    assert not any(os.path.exists(name) for name in objects)
+    assert os.path.exists(os.path.join(codebase.builddir, 'Makefile'))
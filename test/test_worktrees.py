@@ -0,0 +1,52 @@
+import os
+import subprocess
+
+from isca.worktrees import WorktreePool
+
+
+def git(cwd, *args):
+    return subprocess.check_output(('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com') + args,
+                                   cwd=cwd).decode().strip()
+
+
+def make_repo(path):
+    os.makedirs(path)
+    git(path, 'init', '-q', '-b', 'main')
+    commit(path, 'first')
+    return path
+
+
+def commit(repo, text):
+    with open(os.path.join(repo, 'file.txt'), 'w') as f:
+        f.write(text)
+    git(repo, 'add', 'file.txt')
+    git(repo, 'commit', '-q', '-m', text)
+    return git(repo, 'rev-parse', 'HEAD')
+
+
+def test_branch_is_fetched_again(tmp_path):
+    repo = make_repo(str(tmp_path / 'repo'))
+    pool = WorktreePool(str(tmp_path / 'mirrors'))
+    path = str(tmp_path / 'main')
+    pool.add(repo, 'main', path)
+    second = commit(repo, 'second')
+    pool.remove(repo, path)
+    pool.add(repo, 'main', path)
+    assert git(path, 'rev-parse', 'HEAD') == second
+
+
+def test_leased_worktree_is_kept(tmp_path):
+    repo = make_repo(str(tmp_path / 'repo'))
+    first = git(repo, 'rev-parse', 'HEAD')
+    second = commit(repo, 'second')
+    pool = WorktreePool(str(tmp_path / 'mirrors'), max_worktrees=1)
+    old, new = str(tmp_path / 'old'), str(tmp_path / 'new')
+    pool.add(repo, first, old)
+    lease = pool.lease(old)
+    pool.add(repo, second, new)
+    assert os.path.isdir(old) and os.path.isdir(new)
+
+    lease.close()
+    pool.gc()
+    assert not os.path.isdir(old)
+    assert os.path.isdir(new)